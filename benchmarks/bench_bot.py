@@ -0,0 +1,146 @@
+"""End-to-end benchmark of the bot against in-process fakes of Telegram, Google Sheets and OpenAI.
+
+Scripted conversations (/add state machine, /aiadd and /status) are replayed through make_app by
+N concurrent chats. Reports p50/p95/p99 latency from an update being queued to the bot's first
+reply to it, throughput, memory allocated per message and the calls made to the fakes.
+
+    python benchmarks/bench_bot.py --chats 20 --rounds 5 --sheets-latency 0.2 --openai-latency 0.8
+"""
+
+import argparse
+import asyncio
+from collections import defaultdict
+import itertools
+from pathlib import Path
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from telegram import Update
+
+from tgsplitexpenses.config import load_config
+from tgsplitexpenses.ledger import connect
+from tgsplitexpenses import metrics
+from tgsplitexpenses.tgbot import make_app
+
+from fakes import FakeOpenAI, FakeSheets, FakeTelegram
+
+CONFIG_FILE = Path(__file__).parent.parent / "config.example.yaml"
+
+SCRIPTS = {
+    "add": ["/add", "12.5", "pizza", "🍴 Restaurants and Cafes", "🧶 User1", "50 / 50"],
+    "aiadd_local": ["/aiadd 12.50 pizza paid by User1 50/50"],
+    "aiadd_llm": ["/aiadd dinner with friends"],
+    "aiadd_many": ["/aiadd dinner 45 paid by User1, taxi 20 User2, museum 30 split 50/50"],
+    "status": ["/status"],
+    "settle": ["/settle"],
+    "export": ["/export"],
+}
+
+
+def percentiles(values: list) -> str:
+    if len(values) < 2:
+        return f"n={len(values)}"
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return f"n={len(values):<5} p50={q[49] * 1000:8.2f}ms p95={q[94] * 1000:8.2f}ms p99={q[98] * 1000:8.2f}ms"
+
+
+def make_update(bot, update_id: int, chat_id: int, message_id: int, text: str) -> Update:
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "User1"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split(" ")[0])}]
+    return Update.de_json({"update_id": update_id, "message": message}, bot)
+
+
+async def run(args: argparse.Namespace) -> None:
+    chat_ids = [10_000 + n for n in range(args.chats)]
+    app_config = load_config(CONFIG_FILE)
+    app_config.telegram_bot.allowed_chats = [str(chat_id) for chat_id in chat_ids]
+    app_config.telegram_bot.max_concurrent_updates = args.max_concurrent_updates
+    app_config.gsheet.layout = args.layout
+    app_config.gsheet.partition = args.partition
+
+    telegram = FakeTelegram(args.telegram_latency)
+    sheets = FakeSheets(args.sheets_latency)
+    openai = FakeOpenAI(app_config, args.openai_latency)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app_config.ledger.database_file = Path(tmp_dir) / "ledger.sqlite3"
+        app = make_app(app_config, connect(app_config.ledger.database_file), openai, request=telegram)
+        app.bot_data["ledgers"].clients = sheets
+        await app.initialize()
+        await app.post_init(app)
+        await app.start()
+        # Steady state: cold start is measured by bench_startup.py
+        while not metrics.READY.function():
+            await asyncio.sleep(0.01)
+
+        latencies = defaultdict(list)
+        update_ids = itertools.count(1)
+
+        async def chat(chat_id: int) -> None:
+            message_ids = itertools.count(1)
+            for _ in range(args.rounds):
+                for name in args.scripts:
+                    for text in SCRIPTS[name]:
+                        message_id = next(message_ids)
+                        replied = telegram.expect_reply(chat_id, message_id)
+                        update = make_update(app.bot, next(update_ids), chat_id, message_id, text)
+                        start = time.perf_counter()
+                        await app.update_queue.put(update)
+                        latencies[name].append(await asyncio.wait_for(replied, timeout=60) - start)
+
+        tracemalloc.start()
+        snapshot = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+        await asyncio.gather(*(chat(chat_id) for chat_id in chat_ids))
+        elapsed = time.perf_counter() - start
+        allocated = sum(
+            stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, "filename")
+        )
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        spans = metrics.summary()
+
+        await app.stop()
+        await app.post_stop(app)
+        await app.shutdown()
+
+    messages = sum(len(values) for values in latencies.values())
+    print(f"{args.chats} chats x {args.rounds} rounds, {messages} messages in {elapsed:.2f}s")
+    print(f"Throughput: {messages / elapsed:.1f} messages/s")
+    for name, values in latencies.items():
+        print(f"{name:<12} {percentiles(values)}")
+    print(
+        f"Memory: {allocated / messages / 1024:.1f} KiB retained per message, {peak / 1024 / 1024:.1f} MiB peak"
+    )
+    print(f"Telegram calls: {dict(telegram.calls)}")
+    print(f"Sheets calls: {dict(sheets.calls)}")
+    print(f"OpenAI calls: {openai.calls}")
+    print(f"Metrics:\n{spans}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--chats", type=int, default=10, help="Concurrent chats")
+    parser.add_argument("--rounds", type=int, default=5, help="Times each chat runs the scripts")
+    parser.add_argument("--scripts", nargs="+", choices=list(SCRIPTS), default=list(SCRIPTS))
+    parser.add_argument("--max-concurrent-updates", type=int, default=32)
+    parser.add_argument("--layout", choices=["insert", "append"], default="insert")
+    parser.add_argument("--partition", choices=["none", "year", "rows"], default="none")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="Seconds per Bot API call")
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="Seconds per Sheets API call")
+    parser.add_argument("--openai-latency", type=float, default=0.0, help="Seconds per completion")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Benchmark of /export: time and peak memory to export the whole sheet, as the history grows.
+
+Compared with reading the sheet in one `get_all_values` call and writing it at once, the export
+reads ranges of `--chunk-rows` rows and streams them to the file: one request per chunk, within
+the quota of `--requests-per-minute`.
+
+    python benchmarks/bench_export.py --history 10000 100000 --chunk-rows 5000
+"""
+
+import argparse
+import csv
+from datetime import datetime
+from pathlib import Path
+import tempfile
+import time
+import tracemalloc
+
+from tgsplitexpenses.config import load_config
+from tgsplitexpenses.export import export_transactions, ExportFilter
+from tgsplitexpenses.gsheet import GSheet
+from tgsplitexpenses.models import Transaction
+
+from bench_bot import CONFIG_FILE
+from fakes import FakeSheets
+
+
+def export_all_at_once(gsheet: GSheet, directory: Path) -> int:
+    rows = gsheet.transactions_worksheet.get_all_values()
+    with open(directory / "all.csv", "w", newline="") as file:
+        csv.writer(file).writerows(rows)
+    return len(rows) - 1
+
+
+def measure(sheets: FakeSheets, function, *args) -> str:
+    sheets.calls.clear()
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (
+        f"{elapsed * 1000:8.1f}ms, peak {peak / 1024 / 1024:6.2f} MiB, {sum(sheets.calls.values())} requests"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--history", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    parser.add_argument("--requests-per-minute", type=int, default=60)
+    args = parser.parse_args()
+
+    app_config = load_config(CONFIG_FILE)
+    app_config.gsheet.requests_per_minute = args.requests_per_minute
+    expenses = app_config.expenses
+    transaction = Transaction(
+        date=datetime.now(),
+        total=12.5,
+        title="Something",
+        category=expenses.categories[0],
+        paid_by=expenses.users[0],
+        split_type=expenses.split_types[0],
+    )
+    row = GSheet._create_row_from_transaction(transaction, app_config)
+
+    for history in args.history:
+        sheets = FakeSheets()
+        gsheet = GSheet(app_config, sheets)
+        gsheet.transactions_worksheet.rows.extend(list(row) for _ in range(history))
+        gsheet.get_header()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            directory = Path(tmp_dir)
+            print(
+                f"history {history:>7} all at once: {measure(sheets, export_all_at_once, gsheet, directory)}"
+            )
+            streamed = measure(
+                sheets,
+                export_transactions,
+                gsheet,
+                directory,
+                "export",
+                ExportFilter(),
+                False,
+                args.chunk_rows,
+            )
+            print(f"history {history:>7} streamed:    {streamed}")
+            compact = measure(
+                sheets,
+                export_transactions,
+                gsheet,
+                directory,
+                "export",
+                ExportFilter(),
+                True,
+                args.chunk_rows,
+            )
+            print(f"history {history:>7} compact:     {compact}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark of the sheet layouts: cost of writing a batch of transactions as the history grows.
+
+The fake worksheets charge `--shift-latency` seconds per row moved by an insert, as Sheets does
+more work (and recalculates more formulas) the more rows an insert at the top shifts down.
+
+    python benchmarks/bench_layout.py --history 1000 10000 100000 --shift-latency 0.000001
+"""
+
+import argparse
+from datetime import datetime
+import statistics
+import time
+
+from tgsplitexpenses.config import load_config
+from tgsplitexpenses.gsheet import GSheet
+from tgsplitexpenses.models import Transaction
+
+from bench_bot import CONFIG_FILE
+from fakes import FakeSheets
+
+LAYOUTS = [("insert", "none"), ("append", "none"), ("append", "year"), ("append", "rows")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--history", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--batch", type=int, default=10, help="Transactions per write")
+    parser.add_argument("--writes", type=int, default=20)
+    parser.add_argument("--partition-rows", type=int, default=10_000)
+    parser.add_argument("--shift-latency", type=float, default=0.000001, help="Seconds per row moved")
+    args = parser.parse_args()
+
+    app_config = load_config(CONFIG_FILE)
+    expenses = app_config.expenses
+    transaction = Transaction(
+        date=datetime.now(),
+        total=12.5,
+        title="Something",
+        category=expenses.categories[0],
+        paid_by=expenses.users[0],
+        split_type=expenses.split_types[0],
+    )
+    row = GSheet._create_row_from_transaction(transaction, app_config)
+
+    for layout, partition in LAYOUTS:
+        for history in args.history:
+            gsheet_config = app_config.gsheet.model_copy(
+                update={"layout": layout, "partition": partition, "partition_rows": args.partition_rows}
+            )
+            config = app_config.model_copy(update={"gsheet": gsheet_config})
+            sheets = FakeSheets(shift_latency=args.shift_latency)
+            gsheet = GSheet(config, sheets)
+            # The history is in the transactions worksheet, as in a sheet used before partitioning
+            base = gsheet.transactions_worksheet
+            base.rows.extend(list(row) for _ in range(history))
+            gsheet.get_transactions(config)
+            sheets.calls.clear()
+
+            timings = []
+            for _ in range(args.writes):
+                start = time.perf_counter()
+                gsheet.insert_transactions([transaction] * args.batch, config)
+                timings.append(time.perf_counter() - start)
+            calls = sum(sheets.calls.values()) / args.writes
+            print(
+                f"{layout:<6} {partition:<4} history {history:>7}: median {statistics.median(timings) * 1000:8.2f}ms "
+                f"per write, {calls:.2f} calls per write"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark of the Sheets quota scheduler under a burst of reads and writes from many chats.
+
+Chats with their own spreadsheet (same service account, so same quota) read the debtor cells and
+write transactions concurrently, against fake Sheets enforcing `--quota` requests per minute.
+Compared with the scheduler allowing as many requests as asked (i.e. no scheduling), reports
+rejected requests, failed operations, and the latency of reads and writes.
+
+    python benchmarks/bench_quota.py --chats 20 --reads 10 --writes 3 --quota 300
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import random
+import statistics
+import time
+
+from tgsplitexpenses.config import load_config
+from tgsplitexpenses.gsheet import GSheet
+from tgsplitexpenses.models import Transaction
+
+from bench_bot import CONFIG_FILE
+from fakes import FakeSheets
+
+
+def run(args: argparse.Namespace, requests_per_minute: int) -> None:
+    app_config = load_config(CONFIG_FILE)
+    sheets = FakeSheets(args.sheets_latency, quota_per_minute=args.quota)
+    expenses = app_config.expenses
+    transaction = Transaction(
+        date=datetime.now(),
+        total=12.5,
+        title="Something",
+        category=expenses.categories[0],
+        paid_by=expenses.users[0],
+        split_type=expenses.split_types[0],
+    )
+    gsheets = []
+    for n in range(args.chats):
+        gsheet_config = app_config.gsheet.model_copy(
+            update={"file_id": f"chat{n}", "requests_per_minute": requests_per_minute}
+        )
+        config = app_config.model_copy(update={"gsheet": gsheet_config})
+        gsheets.append((GSheet(config, sheets), config))
+
+    def operation(kind: str, gsheet: GSheet, config) -> float:
+        start = time.perf_counter()
+        if kind == "read":
+            gsheet.get_debtor(config)
+        else:
+            gsheet.insert_transactions([transaction], config)
+        return time.perf_counter() - start
+
+    operations = [("read", *g) for g in gsheets for _ in range(args.reads)]
+    operations += [("write", *g) for g in gsheets for _ in range(args.writes)]
+    random.Random(0).shuffle(operations)
+    latencies: dict = {"read": [], "write": []}
+    failed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        futures = [(kind, executor.submit(operation, kind, *g)) for kind, *g in operations]
+        for kind, future in futures:
+            try:
+                latencies[kind].append(future.result())
+            except Exception:
+                failed += 1
+    elapsed = time.perf_counter() - start
+
+    label = "unscheduled" if requests_per_minute > args.quota else f"{requests_per_minute}/min"
+    print(
+        f"{label:<12} {len(operations)} operations in {elapsed:.1f}s: {failed} failed, "
+        f"{sum(sheets.calls.values())} requests, {sum(sheets.rejected.values())} rejected"
+    )
+    for kind, values in latencies.items():
+        if values:
+            print(
+                f"  {kind:<5} median {statistics.median(values) * 1000:8.1f}ms, max {max(values) * 1000:8.1f}ms"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--reads", type=int, default=10, help="Debtor reads per chat")
+    parser.add_argument("--writes", type=int, default=3, help="Transaction writes per chat")
+    parser.add_argument("--threads", type=int, default=32, help="Like the default thread pool of asyncio")
+    parser.add_argument("--quota", type=int, default=300, help="Requests per minute allowed by the fake")
+    parser.add_argument("--sheets-latency", type=float, default=0.05, help="Seconds per Sheets API call")
+    args = parser.parse_args()
+    run(args, 1_000_000)
+    run(args, args.quota)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark of the settlement engine: net balances of a ledger, and the transfers that settle them.
+
+Random groups of each size get random balances summing to zero. Reports the time to settle and
+the number of transfers (at most users - 1), and the time to compute the balances of a ledger.
+
+    python benchmarks/bench_settle.py --users 3 10 100 1000 10000 100000 --transactions 100000
+"""
+
+import argparse
+from datetime import datetime
+import random
+import statistics
+import time
+
+from tgsplitexpenses.models import ExpenseCategory, ExpenseSplitType, ExpenseUser, Transaction
+from tgsplitexpenses.settle import net_balances, settle
+
+
+def random_net(users: int, rng: random.Random) -> dict:
+    cents = [rng.randint(-100_000, 100_000) for _ in range(users - 1)]
+    cents.append(-sum(cents))
+    return {f"user{n}": amount / 100 for n, amount in enumerate(cents)}
+
+
+def random_transactions(users: int, count: int, rng: random.Random) -> list:
+    group = [ExpenseUser(id=f"user{n}", emoji="👤", name=f"User{n}") for n in range(users)]
+    category = ExpenseCategory(name="Other", emoji="❓", keywords=[])
+    transactions = []
+    for _ in range(count):
+        # Uneven split among a few users
+        shares = rng.sample(group, min(users, rng.randint(2, 5)))
+        weights = [rng.randint(1, 10) for _ in shares]
+        split = {user.id: weight * 100 / sum(weights) for user, weight in zip(shares, weights)}
+        transactions.append(
+            Transaction(
+                date=datetime.now(),
+                total=rng.randint(1, 50_000) / 100,
+                title="Something",
+                category=category,
+                paid_by=rng.choice(group),
+                split_type=ExpenseSplitType(name="Custom", split=split),
+            )
+        )
+    return transactions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--users", type=int, nargs="+", default=[3, 10, 100, 1000, 10_000, 100_000])
+    parser.add_argument("--transactions", type=int, default=100_000, help="Size of the ledger")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    for users in args.users:
+        timings, transfers = [], 0
+        for _ in range(args.repeat):
+            net = random_net(users, rng)
+            start = time.perf_counter()
+            transfers = len(settle(net))
+            timings.append(time.perf_counter() - start)
+        print(
+            f"settle {users:>7} users: median {statistics.median(timings) * 1000:9.3f}ms, "
+            f"{transfers} transfers ({users - 1} max)"
+        )
+
+    users = min(args.users[-1], 1000)
+    transactions = random_transactions(users, args.transactions, rng)
+    start = time.perf_counter()
+    net = net_balances(transactions)
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    transfers = settle(net)
+    print(
+        f"ledger of {len(transactions)} transactions, {users} users: balances in {elapsed * 1000:.1f}ms, "
+        f"{len(transfers)} transfers in {(time.perf_counter() - start) * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
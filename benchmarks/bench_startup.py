@@ -0,0 +1,91 @@
+"""Cold start benchmark: time from the start of a fresh process to the reply to the first message.
+
+Each run is a new interpreter, so imports are not cached. The bot is built like in __main__, with
+the fakes of benchmarks/fakes.py (OpenAI is left to be set up by the bot itself), and gets a
+/status as soon as it is started. Also reports when the bot becomes ready, i.e. the sheet is loaded.
+
+    python benchmarks/bench_startup.py --runs 5 --sheets-latency 2
+"""
+
+import time
+
+started_at = time.perf_counter()
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+async def child(args: argparse.Namespace) -> dict:
+    import asyncio
+    from pathlib import Path
+    import tempfile
+
+    from tgsplitexpenses import metrics
+    from tgsplitexpenses.config import load_config
+    from tgsplitexpenses.ledger import connect
+    from tgsplitexpenses.tgbot import make_app
+
+    from bench_bot import CONFIG_FILE, make_update
+    from fakes import FakeSheets, FakeTelegram
+
+    imported = time.perf_counter() - started_at
+    app_config = load_config(CONFIG_FILE)
+    chat_id = int(app_config.telegram_bot.allowed_chats[0])
+    telegram = FakeTelegram(args.telegram_latency)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app_config.ledger.database_file = Path(tmp_dir) / "ledger.sqlite3"
+        app = make_app(
+            app_config, connect(app_config.ledger.database_file), request=telegram, started_at=started_at
+        )
+        app.bot_data["ledgers"].clients = FakeSheets(args.sheets_latency)
+        await app.initialize()
+        await app.post_init(app)
+        await app.start()
+
+        replied = telegram.expect_reply(chat_id, 1)
+        await app.update_queue.put(make_update(app.bot, 1, chat_id, 1, "/status"))
+        first_response = await asyncio.wait_for(replied, timeout=60) - started_at
+        while not metrics.READY.function():
+            await asyncio.sleep(0.01)
+        ready = time.perf_counter() - started_at
+
+        await app.stop()
+        await app.post_stop(app)
+        await app.shutdown()
+    return {"imports": imported, "first_response": first_response, "ready": ready}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="Seconds per Bot API call")
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="Seconds per Sheets API call")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        import asyncio
+        import logging
+
+        logging.disable(logging.CRITICAL)
+        print(json.dumps(asyncio.run(child(args))))
+        return
+
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", *sys.argv[1:]], check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    for name in ("imports", "first_response", "ready"):
+        values = [result[name] for result in results]
+        print(f"{name:<15} median={statistics.median(values) * 1000:8.1f}ms max={max(values) * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
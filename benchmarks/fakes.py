@@ -0,0 +1,230 @@
+"""In-process stand-ins for Telegram, Google Sheets and OpenAI, with configurable latency"""
+
+import asyncio
+from collections import Counter, deque
+import itertools
+import json
+import threading
+import time
+from types import SimpleNamespace
+import typing
+
+from telegram.request import BaseRequest, RequestData
+
+from tgsplitexpenses.gsheet import SheetsClientPool
+from tgsplitexpenses.quota import SheetsScheduler
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "bench_bot"}
+
+
+class FakeTelegram(BaseRequest):
+    """Answers Bot API calls locally, and lets the caller wait for the reply to a given message"""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1_000_000)
+        self._waiters: typing.Dict[typing.Tuple[int, int], asyncio.Future] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self) -> typing.Optional[float]:
+        return None
+
+    def expect_reply(self, chat_id: int, message_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[(chat_id, message_id)] = future
+        return future
+
+    async def do_request(
+        self, url: str, method: str, request_data: typing.Optional[RequestData] = None, **timeouts
+    ) -> typing.Tuple[int, bytes]:
+        await asyncio.sleep(self.latency)
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        parameters = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result: typing.Any = BOT_USER
+        elif endpoint in ("sendMessage", "sendDocument"):
+            chat_id = int(parameters["chat_id"])
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": parameters.get("text", ""),
+            }
+            reply_to = (parameters.get("reply_parameters") or {}).get("message_id")
+            future = self._waiters.pop((chat_id, reply_to), None)
+            if future is not None and not future.done():
+                future.set_result(time.perf_counter())
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class FakeAPIError(Exception):
+    """Like gspread.exceptions.APIError"""
+
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+class FakeSheetsAPI:
+    """Latency, call counts and per-minute quota shared by all the fake spreadsheets"""
+
+    def __init__(
+        self, latency: float = 0.0, shift_latency: float = 0.0, quota_per_minute: typing.Optional[int] = None
+    ) -> None:
+        self.latency = latency
+        self.shift_latency = shift_latency  # Seconds per row moved by an insert
+        self.quota_per_minute = quota_per_minute
+        self.calls: Counter = Counter()
+        self.rejected: Counter = Counter()
+        self._recent: deque = deque()
+        self._lock = threading.Lock()
+
+    def call(self, name: str) -> None:
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and self._recent[0] < now - 60:
+                self._recent.popleft()
+            if self.quota_per_minute is not None and len(self._recent) >= self.quota_per_minute:
+                self.rejected[name] += 1
+                raise FakeAPIError(429, "Quota exceeded for quota metric 'Requests' per minute")
+            self._recent.append(now)
+            self.calls[name] += 1
+        time.sleep(self.latency)
+
+
+class FakeWorksheet:
+    """The subset of gspread.Worksheet used by GSheet, backed by a list of rows"""
+
+    def __init__(self, api: FakeSheetsAPI, title: str, rows: typing.Optional[list] = None) -> None:
+        self.api = api
+        self.title = title
+        self.rows: typing.List[list] = rows if rows is not None else [["header"]]
+        self.cells: typing.Dict[str, typing.Any] = {}
+
+    def insert_rows(self, values, row: int = 1, **kwargs) -> None:
+        self.api.call("insert_rows")
+        # Like in Sheets, inserting shifts all the rows below
+        self.rows[row - 1 : row - 1] = [list(v) for v in values]
+        time.sleep(self.api.shift_latency * (len(self.rows) - row))
+
+    def append_rows(self, values, **kwargs) -> None:
+        self.api.call("append_rows")
+        self.rows.extend(list(v) for v in values)
+
+    def get_all_values(self, **kwargs) -> typing.List[list]:
+        self.api.call("get_all_values")
+        return [list(row) for row in self.rows]
+
+    def get(self, range_name: str, **kwargs) -> typing.List[list]:
+        """Only whole rows, e.g. "2:1001", without the empty ones at the end like Sheets"""
+        self.api.call("get")
+        first, last = (int(n) for n in range_name.split(":"))
+        rows = [list(row) for row in self.rows[first - 1 : last]]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        return rows
+
+    def row_values(self, row: int, **kwargs) -> list:
+        self.api.call("row_values")
+        return list(self.rows[row - 1])
+
+    def col_values(self, col: int, **kwargs) -> list:
+        self.api.call("col_values")
+        return [row[col - 1] for row in self.rows if len(row) >= col and row[col - 1] != ""]
+
+    def batch_update(self, data, **kwargs) -> None:
+        self.api.call("batch_update")
+        for update in data:
+            self.cells[update["range"]] = update["values"][0][0]
+
+    def batch_get(self, ranges, **kwargs) -> typing.List[list]:
+        self.api.call("batch_get")
+        return [[[self.cells[r]]] if r in self.cells else [] for r in ranges]
+
+
+class FakeSpreadsheet:
+    def __init__(self, api: FakeSheetsAPI, titles: typing.Iterable[str]) -> None:
+        self.api = api
+        self.by_title: typing.Dict[str, FakeWorksheet] = {
+            title: FakeWorksheet(api, title) for title in titles
+        }
+
+    def worksheets(self) -> typing.List[FakeWorksheet]:
+        self.api.call("worksheets")
+        return list(self.by_title.values())
+
+    def add_worksheet(self, title: str, rows: int, cols: int, **kwargs) -> FakeWorksheet:
+        self.api.call("add_worksheet")
+        self.by_title[title] = FakeWorksheet(self.api, title, rows=[])
+        return self.by_title[title]
+
+
+class FakeSheets(FakeSheetsAPI):
+    """Drop-in for gsheet.SheetsClientPool: every service account opens the same fake spreadsheets,
+    made of the worksheets in `titles`"""
+
+    def __init__(self, *args, titles: typing.Iterable[str] = ("Expenses", "Summary"), **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.titles = list(titles)
+        self.spreadsheets: typing.Dict[str, FakeSpreadsheet] = {}
+        self._pool = SheetsClientPool()
+
+    def get(self, service_account_file) -> "FakeSheets":
+        return self
+
+    def scheduler(self, service_account_file, requests_per_minute: int) -> SheetsScheduler:
+        return self._pool.scheduler(service_account_file, requests_per_minute)
+
+    @property
+    def waiting(self) -> int:
+        return self._pool.waiting
+
+    def close(self) -> None:
+        self._pool.close()
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self.call("open_by_key")
+        if key not in self.spreadsheets:
+            self.spreadsheets[key] = FakeSpreadsheet(self, self.titles)
+        return self.spreadsheets[key]
+
+
+class FakeOpenAI:
+    """Answers chat completions with one transaction per comma separated part of the description,
+    each one made of the first configured options"""
+
+    def __init__(self, app_config, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls = 0
+        expenses = app_config.expenses
+        self._transaction = {
+            "total": 12.5,
+            "title": "Something",
+            "category": expenses.categories[0].name,
+            "paid_by": expenses.users[0].name,
+            "split_type": expenses.split_types[0].name,
+        }
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs) -> SimpleNamespace:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        description = kwargs["messages"][-1]["content"].split(": ", 1)[-1]
+        items = [
+            {"text": part.strip(), "error": None, "missing_fields": None, "transaction": self._transaction}
+            for part in description.split(",")
+        ]
+        content = json.dumps({"error": None, "transactions": items})
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
@@ -1,22 +1,35 @@
 import logging
 from pathlib import Path
 import os
+import time
 
-from openai import OpenAI
-
-from .tgbot import make_app as tg_make_app
-from .config import load_config
-from .gsheet import GSheet
+started_at = time.perf_counter()
 
 logging.basicConfig(level=logging.INFO)
 # httpx is verbose
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
 if __name__ == "__main__":
+    from .tgbot import make_app as tg_make_app
+    from .config import load_config
+    from .ledger import connect
+
     config_file = Path(os.environ.get("TG_SPLITEXPENSE_CONFIG_FILE", "./config.yaml"))
     app_config = load_config(config_file)
-    gsheet = GSheet(app_config)
-    openai = OpenAI(api_key=app_config.openai.api_key)
-    app = tg_make_app(app_config, gsheet, openai)
-    logging.info("Running...")
-    app.run_polling()
+    db = connect(app_config.ledger.database_file)
+    # Nothing is connected yet: OpenAI and the spreadsheets are set up in background or on first use
+    app = tg_make_app(app_config, db, started_at=started_at, config_file=config_file)
+    logging.info(f"Started in {time.perf_counter() - started_at:.2f}s")
+    webhook = app_config.telegram_bot.webhook
+    if webhook:
+        logging.info(f"Running webhook on {webhook.listen}:{webhook.port}...")
+        app.run_webhook(
+            listen=webhook.listen,
+            port=webhook.port,
+            url_path=webhook.url_path,
+            webhook_url=f"{webhook.url.rstrip('/')}/{webhook.url_path}",
+            secret_token=webhook.secret_token,
+        )
+    else:
+        logging.info("Running...")
+        app.run_polling()
@@ -0,0 +1,173 @@
+import asyncio
+from enum import StrEnum
+from functools import cached_property
+import json
+import typing as t
+
+from pydantic import BaseModel, create_model, Field, ValidationError
+
+from .config import AppConfig
+from . import metrics
+
+if t.TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+
+class ExtractedItem(t.NamedTuple):
+    # Part of the user input the transaction was extracted from
+    text: str
+    # Instance of `TransactionExtractor.transaction_model`, None if it could not be extracted
+    transaction: t.Optional[BaseModel]
+    error: t.Optional[str]
+
+
+class Extraction(t.NamedTuple):
+    items: t.List[ExtractedItem]
+    # Set when nothing at all could be extracted
+    error: t.Optional[str]
+
+
+class TransactionExtractor:
+    """Extracts the transactions described in free text with OpenAI structured outputs.
+
+    All the transactions of a message are extracted in a single completion, and validated one by
+    one: an invalid one does not discard the others.
+
+    The response models and their JSON schema depend only on the expenses config, so they are
+    built once (the schema on first use) and reused by every request.
+    """
+
+    def __init__(self, app_config: AppConfig) -> None:
+        self.model = app_config.openai.model
+        # Dynamic Pydantic models based on app_config, so we can give them to OpenAI to parse the response
+        category_enum = StrEnum("Category", {c.name: c.name for c in app_config.expenses.categories})
+        user_enum = StrEnum("User", {u.name: u.name for u in app_config.expenses.users})
+        split_type_enum = StrEnum("SplitType", {s.name: s.name for s in app_config.expenses.split_types})
+        self.transaction_model = create_model(
+            "Transaction",
+            total=(float, Field(..., description="Total amount of the transaction. Must be greater than 0")),
+            title=(
+                str,
+                Field(..., description="Title of the transaction, usually a description of what was bought"),
+            ),
+            category=(
+                category_enum,
+                Field(..., description="Category of the transaction. Guess based on the title"),
+            ),
+            paid_by=(user_enum, Field(..., description="User who paid the transaction")),
+            split_type=(
+                split_type_enum,
+                Field(
+                    description="How the transaction should be split between the users",
+                    default=app_config.expenses.split_types[0].name,
+                ),
+            ),
+        )
+        self.item_model = create_model(
+            "Item",
+            text=(str, Field(..., description="Part of the user input describing this transaction")),
+            error=(
+                t.Optional[str],
+                Field(
+                    ...,
+                    description="Human readable message in case the transaction could not be completely parsed",
+                ),
+            ),
+            missing_fields=(
+                t.Optional[t.List[str]],
+                Field(
+                    ...,
+                    description="Transaction fields that could not be found or guessed from the user input",
+                ),
+            ),
+            transaction=(
+                t.Optional[self.transaction_model],
+                Field(
+                    ...,
+                    description="Transaction as parsed from the user input. If all fields could not be parsed or guessed correctly, this will be null",
+                ),
+            ),
+        )
+        self.response_model = create_model(
+            "Response",
+            error=(
+                t.Optional[str],
+                Field(
+                    ...,
+                    description="Human readable message in case no transaction at all could be found in the user input",
+                ),
+            ),
+            transactions=(
+                t.List[self.item_model],
+                Field(..., description="One item per transaction described in the user input, in order"),
+            ),
+        )
+
+    @cached_property
+    def response_format(self) -> dict:
+        """Same strict schema `chat.completions.parse` would generate on every call, built with the
+        public `pydantic_function_tool`"""
+        from openai import pydantic_function_tool
+
+        function = pydantic_function_tool(self.response_model)["function"]
+        return {
+            "type": "json_schema",
+            "json_schema": {"schema": function["parameters"], "name": function["name"], "strict": True},
+        }
+
+    def prepare(self) -> dict:
+        """The response schema, built now if it is not yet. Blocking, it imports a good part of openai:
+        called from a worker thread on reload, rather than on the first /aiadd"""
+        return self.response_format
+
+    async def extract(self, openai: "AsyncOpenAI", paid_by: str, text: str) -> Extraction:
+        messages = [
+            {
+                "role": "system",
+                "content": "Extract the information about the transactions, there can be one or more",
+            },
+            {"role": "user", "content": f"Unless stated otherwise, transactions were paid by: {paid_by}"},
+            {"role": "user", "content": f"Transactions description: {text}"},
+        ]
+        # Built on first use, off the event loop
+        response_format = self.__dict__.get("response_format") or await asyncio.to_thread(self.prepare)
+        with metrics.OPENAI.time(self.model):
+            completion = await openai.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                response_format=response_format,
+            )
+        message = completion.choices[0].message
+        if getattr(message, "refusal", None):
+            return Extraction([], f"Refused: {message.refusal}")
+        return self._validate(message.content)
+
+    def _validate(self, content: t.Optional[str]) -> Extraction:
+        if content is None:
+            return Extraction([], "Empty response")
+        try:
+            response = json.loads(content)
+            error, items = response.get("error"), response.get("transactions") or []
+        except (ValueError, TypeError, AttributeError):
+            return Extraction([], f"Unexpected response: {content}")
+        extracted = []
+        for n, item in enumerate(items, start=1):
+            text = item.get("text") if isinstance(item, dict) else None
+            text = text or f"Transaction {n}"
+            try:
+                item = self.item_model.model_validate(item)
+            except ValidationError as e:
+                extracted.append(ExtractedItem(text, None, f"Invalid transaction: {e.errors()[0]['msg']}"))
+                continue
+            if item.transaction is None or item.error:
+                item_error = item.error or "Could not be parsed"
+                if item.missing_fields:
+                    item_error += f" (missing: {', '.join(item.missing_fields)})"
+                extracted.append(ExtractedItem(text, None, item_error))
+            elif item.transaction.total <= 0:
+                extracted.append(ExtractedItem(text, None, "Total must be greater than 0"))
+            else:
+                extracted.append(ExtractedItem(text, item.transaction, None))
+        if not extracted and not error:
+            error = "No transaction found"
+        return Extraction(extracted, error)
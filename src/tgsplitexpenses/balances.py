@@ -0,0 +1,45 @@
+import typing
+
+from .config import AppConfig
+from .models import Transaction
+from .settle import apply_transaction, settle, Transfer
+
+
+class Balances:
+    """Net balance of each user, kept up to date in memory.
+
+    Positive means the user is owed money, negative means the user is in debt. It is seeded once
+    with all the transactions and then updated incrementally, in O(users), for each new one.
+    """
+
+    def __init__(self, app_config: AppConfig) -> None:
+        self.users = app_config.expenses.users
+        self.seeded = False
+        self._net: typing.Dict[str, float] = {user.id: 0.0 for user in self.users}
+
+    def seed(self, transactions: typing.Iterable[Transaction]) -> None:
+        self._net = {user.id: 0.0 for user in self.users}
+        for transaction in transactions:
+            apply_transaction(self._net, transaction)
+        self.seeded = True
+
+    def apply(self, transaction: Transaction) -> None:
+        # Before seeding the transaction is going to be part of the seed anyway
+        if self.seeded:
+            apply_transaction(self._net, transaction)
+
+    @property
+    def net(self) -> typing.Dict[str, float]:
+        return dict(self._net)
+
+    def get_debtor(self) -> typing.Tuple[str, float]:
+        """User with the largest debt and the amount they have to repay"""
+        user = min(self.users, key=lambda u: self._net.get(u.id, 0.0))
+        amount = round(-self._net.get(user.id, 0.0), 2)
+        if amount <= 0:
+            return "Nobody", 0.0
+        return user.name, amount
+
+    def settle(self) -> typing.List[Transfer]:
+        """Transfers that settle all the debts, works with any number of users and splits"""
+        return settle(self._net)
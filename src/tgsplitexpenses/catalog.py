@@ -0,0 +1,47 @@
+import typing
+
+from telegram import ReplyKeyboardMarkup
+
+from .config import AppConfig
+from . import models
+from .utils import make_keyboard
+
+SKIP = "⏭ Skip"
+
+
+class Catalog:
+    """Lookups and keyboards for the conversation, built once from the expenses config.
+
+    Replies are resolved with dict lookups and the keyboards are immutable, so they are shared
+    by all the conversations.
+    """
+
+    def __init__(self, app_config: AppConfig) -> None:
+        expenses = app_config.expenses
+        self.category_by_displayname = {c.displayname: c for c in expenses.categories}
+        self.category_by_name = {c.name: c for c in expenses.categories}
+        self.user_by_displayname = {u.displayname: u for u in expenses.users}
+        self.user_by_name = {u.name: u for u in expenses.users}
+        self.user_by_id = {u.id: u for u in expenses.users}
+        self.split_type_by_name = {s.name: s for s in expenses.split_types}
+
+        self.categories_keyboard = make_keyboard(list(self.category_by_displayname), 3, "Category")
+        self.paid_by_keyboard = make_keyboard(list(self.user_by_displayname), 1, "Paid by")
+        self.split_type_keyboard = make_keyboard(list(self.split_type_by_name), 1, "Split Type")
+        self.review_keyboard = make_keyboard([SKIP, *self.category_by_displayname], 3, "Category")
+        # Suggested categories (by name) -> keyboard, there are only so many combinations
+        self._suggested_categories_keyboards: typing.Dict[typing.Tuple[str, ...], ReplyKeyboardMarkup] = {}
+
+    def suggested_categories_keyboard(
+        self, suggested: typing.List[models.ExpenseCategory]
+    ) -> ReplyKeyboardMarkup:
+        """Categories keyboard with the `suggested` categories as first options"""
+        if not suggested:
+            return self.categories_keyboard
+        key = tuple(c.name for c in suggested)
+        keyboard = self._suggested_categories_keyboards.get(key)
+        if keyboard is None:
+            options = [c.displayname for c in suggested]
+            keyboard = make_keyboard([*options, *self.category_by_displayname], 3, "Category")
+            self._suggested_categories_keyboards[key] = keyboard
+        return keyboard
@@ -1,19 +1,54 @@
 from pathlib import Path
-from pydantic import BaseModel
+import typing
+
+from pydantic import BaseModel, model_validator
 from ruamel.yaml import YAML
 
 from . import models
 
 
 class AppConfig(BaseModel):
+    class _WebhookConfig(BaseModel):
+        url: str  # Public base URL Telegram will send updates to, e.g. https://bot.example.com
+        listen: str = "0.0.0.0"
+        port: int = 8443
+        url_path: str = "telegram"
+        secret_token: typing.Optional[str] = None
+
     class _TelegramBotConfig(BaseModel):
         token: str
         allowed_chats: list[str]
+        webhook: typing.Optional["AppConfig._WebhookConfig"] = None  # Long polling if not set
+        max_concurrent_updates: int = 32
+        warm_up: bool = True  # Load the spreadsheets in background at startup, otherwise on first use
+        # Seconds between checks of the config file for changes, which are applied without a restart
+        reload_interval: typing.Optional[float] = 10
 
     class _ExpensesConfig(BaseModel):
         users: list[models.ExpenseUser]
         categories: list[models.ExpenseCategory]
         split_types: list[models.ExpenseSplitType]
+        # Added to the ledger when due, see `recurring.py`
+        recurring: list[models.RecurringExpense] = []
+
+        @model_validator(mode="after")
+        def _check_recurring(self) -> "AppConfig._ExpensesConfig":
+            options = {
+                "category": {c.name for c in self.categories},
+                "paid_by": {u.id for u in self.users},
+                "split_type": {s.name for s in self.split_types},
+            }
+            ids = set()
+            for expense in self.recurring:
+                if expense.id in ids:
+                    raise ValueError(f"Recurring expense id {expense.id} is used more than once")
+                ids.add(expense.id)
+                for field, values in options.items():
+                    if getattr(expense, field) not in values:
+                        raise ValueError(
+                            f"Unknown {field} {getattr(expense, field)} of recurring expense {expense.id}"
+                        )
+            return self
 
     class _GSheetConfig(BaseModel):
         service_account_file: Path
@@ -22,18 +57,80 @@ class AppConfig(BaseModel):
         summary_worksheet_name: str
         summary_worksheet_cell_user_in_debt: str
         summary_worksheet_cell_amount_to_repay: str
+        # "insert": newest on top, every write shifts all the rows. "append": newest at the bottom, constant cost
+        layout: typing.Literal["insert", "append"] = "insert"
+        # Split the transactions in a worksheet per year ("<transactions_worksheet_name> <year>") or per
+        # `partition_rows` rows ("<transactions_worksheet_name> 2", ...). The bot then writes the summary cells
+        partition: typing.Literal["none", "year", "rows"] = "none"
+        partition_rows: int = 10000
+        # Sheets API requests per minute allowed to the service account, shared by all its sheets
+        requests_per_minute: int = 60
 
     class _OpenAIConfig(BaseModel):
         model: str
         api_key: str
 
+    class _LedgerConfig(BaseModel):
+        database_file: Path = Path("./ledger.sqlite3")  # Relative to the directory of the config file
+        max_open_ledgers: int = 64  # Least recently used ones are closed, and reopened when needed
+
+    class _MetricsConfig(BaseModel):
+        listen: str = "127.0.0.1"
+        port: typing.Optional[int] = None  # Prometheus endpoint at /metrics, disabled if not set
+        log_interval: typing.Optional[float] = (
+            None  # Seconds between summaries in the log, disabled if not set
+        )
+
+    class _ChatConfig(BaseModel):
+        expenses: "AppConfig._ExpensesConfig"
+        gsheet: "AppConfig._GSheetConfig"
+
     telegram_bot: _TelegramBotConfig
     openai: _OpenAIConfig
     expenses: _ExpensesConfig
     gsheet: _GSheetConfig
+    ledger: _LedgerConfig = _LedgerConfig()
+    metrics: _MetricsConfig = _MetricsConfig()
+    # Chat id -> its own expenses and spreadsheet, other allowed chats use the top level ones
+    chats: dict[str, _ChatConfig] = {}
+
+    @model_validator(mode="before")
+    @classmethod
+    def _inherit_chat_config(cls, data: typing.Any) -> typing.Any:
+        # Chats can override just some of the gsheet settings (e.g. file_id) and reuse the expenses, but
+        # not the recurring ones: they belong to a single ledger
+        if isinstance(data, dict):
+            for chat in (data.get("chats") or {}).values():
+                if "expenses" not in chat:
+                    expenses = data.get("expenses")
+                    if isinstance(expenses, dict):
+                        expenses = {field: value for field, value in expenses.items() if field != "recurring"}
+                    chat["expenses"] = expenses
+                chat["gsheet"] = {**dict(data.get("gsheet") or {}), **dict(chat.get("gsheet") or {})}
+        return data
+
+    @model_validator(mode="after")
+    def _check_chats_allowed(self) -> "AppConfig":
+        for chat_id in self.chats:
+            if chat_id not in self.telegram_bot.allowed_chats:
+                raise ValueError(f"Chat {chat_id} has its own ledger but is not in allowed_chats")
+        return self
+
+    def ledger_key(self, chat_id: str) -> str:
+        return chat_id if chat_id in self.chats else "default"
+
+    def for_ledger(self, key: str) -> "AppConfig":
+        """Config as seen by a single ledger: its own expenses and gsheet settings"""
+        if key not in self.chats:
+            return self
+        chat = self.chats[key]
+        return self.model_copy(update={"expenses": chat.expenses, "gsheet": chat.gsheet, "chats": {}})
 
 
 def load_config(config_file: Path) -> AppConfig:
     config = YAML(typ="safe").load(config_file)
     config = AppConfig(**config)
+    # Next to the config rather than in the working directory, e.g. in the /config volume of the container
+    if not config.ledger.database_file.is_absolute():
+        config.ledger.database_file = config_file.parent / config.ledger.database_file
     return config
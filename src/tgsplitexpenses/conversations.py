@@ -0,0 +1,97 @@
+import json
+import sqlite3
+import typing
+
+from .catalog import Catalog
+
+# Fields of the partial transaction in user_data, stored by name/id instead of the whole model
+_REFERENCES = {
+    "category": ("name", "category_by_name"),
+    "paid_by": ("id", "user_by_id"),
+    "split_type": ("name", "split_type_by_name"),
+}
+
+
+# (chat id, user id): each chat has its own ledger, so a user has a conversation in each chat
+Key = typing.Tuple[int, int]
+
+
+class ConversationStore:
+    """Persists the conversation state of each user in each chat, so restarts don't lose half-entered
+    transactions.
+
+    Records are compact (ids and names, not pydantic models). Saves only mark the conversation
+    dirty, `flush` writes all the dirty ones in a single transaction. Conversations are loaded
+    lazily, on the first message of the user in the chat after a restart.
+    """
+
+    def __init__(self, db: sqlite3.Connection) -> None:
+        self._db = db
+        with self._db:
+            columns = [column[1] for column in self._db.execute("PRAGMA table_info(conversations)")]
+            if columns and "chat_id" not in columns:
+                # Created when conversations were per user: their chat is unknown, they start over
+                self._db.execute("DROP TABLE conversations")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS conversations (
+                    chat_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, user_id)
+                )
+                """
+            )
+        self._loaded: typing.Set[Key] = set()
+        # Key -> record to write, None to delete
+        self._dirty: typing.Dict[Key, typing.Optional[str]] = {}
+
+    def load(self, key: Key, user_data: dict, catalog: Catalog) -> None:
+        """Fill `user_data` with the persisted state, only the first time the conversation is seen"""
+        if key in self._loaded:
+            return
+        self._loaded.add(key)
+        if user_data.get("STATE") is not None:
+            return
+        row = self._db.execute(
+            "SELECT data FROM conversations WHERE chat_id = ? AND user_id = ?", key
+        ).fetchone()
+        if row is None:
+            return
+        record = json.loads(row[0])
+        transaction = record.get("TRANSACTION")
+        if transaction is not None:
+            for field, (_, index) in _REFERENCES.items():
+                if field in transaction:
+                    value = getattr(catalog, index).get(transaction[field])
+                    if value is None:
+                        return  # Not in the config anymore, the conversation has to start over
+                    transaction[field] = value
+        user_data.update(record)
+
+    def save(self, key: Key, user_data: dict) -> None:
+        self._loaded.add(key)
+        if user_data.get("STATE") in (None, "END"):
+            self._dirty[key] = None
+            return
+        record = dict(user_data)
+        if "TRANSACTION" in record:
+            record["TRANSACTION"] = {
+                field: getattr(value, _REFERENCES[field][0]) if field in _REFERENCES else value
+                for field, value in record["TRANSACTION"].items()
+            }
+        self._dirty[key] = json.dumps(record, default=str)
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM conversations WHERE chat_id = ? AND user_id = ?",
+                [key for key, data in dirty.items() if data is None],
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO conversations (chat_id, user_id, data) VALUES (?, ?, ?)",
+                [(*key, data) for key, data in dirty.items() if data is not None],
+            )
@@ -0,0 +1,147 @@
+import csv
+import gzip
+import logging
+from pathlib import Path
+import typing
+
+from .gsheet import GSheet
+
+# Columns of the rows written by `GSheet._create_row_from_transaction`: year, month, day, time, title,
+# category, total, paid by and split type, then the percentage, share and debt of each user
+_INT_COLUMNS = (0, 1, 2)
+_STR_COLUMNS = (3, 4, 5, 7, 8)
+
+
+class ExportFilter(typing.NamedTuple):
+    since: typing.Optional[str] = None  # "YYYY-MM", included
+    until: typing.Optional[str] = None  # "YYYY-MM", included
+    category: typing.Optional[str] = None  # Category name
+
+    @property
+    def years(self) -> typing.Optional[typing.Tuple[int, int]]:
+        if self.since is None or self.until is None:
+            return None
+        return int(self.since[:4]), int(self.until[:4])
+
+    def matches(self, row: list) -> bool:
+        try:
+            month = f"{int(row[0]):04d}-{int(row[1]):02d}"
+            category = row[5]
+        except (ValueError, TypeError, IndexError):
+            return False
+        if self.since is not None and month < self.since:
+            return False
+        if self.until is not None and month > self.until:
+            return False
+        return self.category is None or category == self.category
+
+
+class _CsvWriter:
+    def __init__(self, path: Path, header: list, compress: bool = False) -> None:
+        self.path = path
+        if compress:
+            self._file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        else:
+            self._file = open(path, "w", encoding="utf-8", newline="")
+        self._csv = csv.writer(self._file)
+        self._csv.writerow(header)
+
+    def write(self, rows: typing.List[list]) -> None:
+        self._csv.writerows(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _ParquetWriter:
+    """Typed columns, written one row group per chunk"""
+
+    def __init__(self, path: Path, header: list) -> None:
+        import pyarrow
+        import pyarrow.parquet
+
+        self.path = path
+        self._pyarrow = pyarrow
+        fields = []
+        for n, name in enumerate(header):
+            if n in _INT_COLUMNS:
+                type_ = pyarrow.int64()
+            elif n in _STR_COLUMNS:
+                type_ = pyarrow.string()
+            else:
+                type_ = pyarrow.float64()
+            # Column names have to be unique
+            name = str(name) or f"column_{n + 1}"
+            if name in (field.name for field in fields):
+                name = f"{name}_{n + 1}"
+            fields.append(pyarrow.field(name, type_))
+        self._schema = pyarrow.schema(fields)
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema, compression="zstd")
+
+    def write(self, rows: typing.List[list]) -> None:
+        columns = [
+            self._pyarrow.array([_convert(row[n], n) for row in rows], type=field.type)
+            for n, field in enumerate(self._schema)
+        ]
+        self._writer.write_table(self._pyarrow.Table.from_arrays(columns, schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+def _convert(value: typing.Any, column: int) -> typing.Any:
+    if column in _STR_COLUMNS:
+        return str(value)
+    try:
+        return int(float(value)) if column in _INT_COLUMNS else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _open_writer(
+    directory: Path, name: str, header: list, compact: bool
+) -> typing.Union[_CsvWriter, _ParquetWriter]:
+    if not compact:
+        return _CsvWriter(directory / f"{name}.csv", header)
+    try:
+        return _ParquetWriter(directory / f"{name}.parquet", header)
+    except ImportError:
+        # pyarrow is optional, see the "parquet" extra
+        logging.info("pyarrow is not installed, exporting as gzip CSV")
+        return _CsvWriter(directory / f"{name}.csv.gz", header, compress=True)
+
+
+def export_transactions(
+    gsheet: GSheet,
+    directory: Path,
+    name: str,
+    export_filter: ExportFilter,
+    compact: bool = False,
+    chunk_rows: int = 5000,
+) -> typing.Tuple[Path, int]:
+    """Write the transactions of the sheet matching `export_filter` to a file in `directory`, CSV or, if
+    `compact`, Parquet (gzip CSV without pyarrow). Returns the file and the number of transactions.
+
+    The sheet is read and the file written `chunk_rows` at a time, so memory use does not depend on
+    the size of the sheet. Blocking: it is run in a worker thread.
+    """
+    header = gsheet.get_header()
+    writer = _open_writer(directory, name, header, compact)
+    count = 0
+    chunk: typing.List[list] = []
+    try:
+        for row in gsheet.iter_rows(chunk_rows, export_filter.years):
+            if not any(row) or not export_filter.matches(row):
+                continue
+            # Sheets leaves out the empty cells at the end of the row
+            chunk.append(row + [""] * (len(header) - len(row)))
+            if len(chunk) == chunk_rows:
+                writer.write(chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write(chunk)
+            count += len(chunk)
+    finally:
+        writer.close()
+    return writer.path, count
@@ -1,19 +1,137 @@
 import logging
+import threading
 
-import gspread
+from datetime import datetime
+from pathlib import Path
 
 from .config import AppConfig
+from . import models
+from .quota import SheetsScheduler
 from .models import Transaction
+from .utils import find_in_list
 
 import typing
 
+T = typing.TypeVar("T")
+
+if typing.TYPE_CHECKING:
+    # Imported on first use, it takes a while and is not needed to start answering messages
+    import gspread
+
+
+class SheetsClientPool:
+    """One authenticated gspread client, and API quota scheduler, per service account, shared by all the sheets"""
+
+    def __init__(self) -> None:
+        self._clients: typing.Dict[Path, "gspread.Client"] = {}
+        self._schedulers: typing.Dict[Path, SheetsScheduler] = {}
+        self._lock = threading.Lock()
+
+    def get(self, service_account_file: Path) -> "gspread.Client":
+        with self._lock:
+            if service_account_file not in self._clients:
+                import gspread
+
+                self._clients[service_account_file] = gspread.service_account(filename=service_account_file)
+            return self._clients[service_account_file]
+
+    def scheduler(self, service_account_file: Path, requests_per_minute: int) -> SheetsScheduler:
+        with self._lock:
+            if service_account_file not in self._schedulers:
+                self._schedulers[service_account_file] = SheetsScheduler(requests_per_minute)
+            return self._schedulers[service_account_file]
+
+    @property
+    def waiting(self) -> int:
+        return sum(scheduler.waiting for scheduler in self._schedulers.values())
+
+    def close(self) -> None:
+        for scheduler in self._schedulers.values():
+            scheduler.close()
+
+
+class PartialWriteError(Exception):
+    """Writing to more than one partition failed midway, only the first `written` transactions are in the sheet"""
+
+    def __init__(self, written: int, cause: Exception) -> None:
+        super().__init__(str(cause))
+        self.written = written
+
 
 class GSheet:
-    def __init__(self, app_config: AppConfig) -> None:
-        gsa = gspread.service_account(filename=app_config.gsheet.service_account_file)
-        ss = gsa.open_by_key(app_config.gsheet.file_id)
-        self.transactions_worksheet = ss.worksheet(app_config.gsheet.transactions_worksheet_name)
-        self.summary_worksheet = ss.worksheet(app_config.gsheet.summary_worksheet_name)
+    """Transactions and summary worksheets of a spreadsheet, opened on first use.
+
+    Transactions can be partitioned over several worksheets (see `AppConfig._GSheetConfig.partition`),
+    so that writes don't get slower as the history grows. Partitions are only written by the
+    writer of the ledger, one batch at a time, so their state needs no locking.
+
+    All the API calls go through the scheduler of the service account, which keeps them within
+    the quota.
+    """
+
+    def __init__(self, app_config: AppConfig, clients: typing.Optional[SheetsClientPool] = None) -> None:
+        self.app_config = app_config
+        self._clients = clients or SheetsClientPool()
+        self._scheduler = self._clients.scheduler(
+            app_config.gsheet.service_account_file, app_config.gsheet.requests_per_minute
+        )
+        self._lock = threading.Lock()
+        self._spreadsheet: typing.Optional["gspread.Spreadsheet"] = None
+        self._worksheets: typing.Optional[typing.Tuple["gspread.Worksheet", "gspread.Worksheet"]] = None
+        self._partitions: typing.Optional[typing.Dict[str, "gspread.Worksheet"]] = None  # By title
+        self._partition_rows: typing.Dict[str, int] = {}  # Rows in use, header included, by title
+        self._header: typing.Optional[list] = None
+
+    def _open(self) -> typing.Tuple["gspread.Worksheet", "gspread.Worksheet"]:
+        with self._lock:
+            if self._worksheets is None:
+                gsheet_config = self.app_config.gsheet
+                client = self._clients.get(gsheet_config.service_account_file)
+                ss = self._scheduler.read(
+                    ("open", gsheet_config.file_id), "open_by_key", client.open_by_key, gsheet_config.file_id
+                )
+                # All the worksheets at once, partitions included, instead of one request per worksheet
+                worksheets = self._scheduler.read(
+                    ("worksheets", gsheet_config.file_id), "worksheets", ss.worksheets
+                )
+                by_title = {worksheet.title: worksheet for worksheet in worksheets}
+                for title in (
+                    gsheet_config.transactions_worksheet_name,
+                    gsheet_config.summary_worksheet_name,
+                ):
+                    if title not in by_title:
+                        import gspread
+
+                        raise gspread.WorksheetNotFound(title)
+                base = gsheet_config.transactions_worksheet_name
+                self._partitions = {
+                    title: worksheet
+                    for title, worksheet in by_title.items()
+                    if title == base or GSheet._partition_number(base, title) is not None
+                }
+                self._spreadsheet = ss
+                self._worksheets = (by_title[base], by_title[gsheet_config.summary_worksheet_name])
+            return self._worksheets
+
+    async def run(self, priority: int, function: typing.Callable[..., T], *args) -> T:
+        """Call a blocking method of the sheet from the event loop, on a thread of the scheduler (see `quota.READ`, `quota.WRITE`)"""
+        return await self._scheduler.run(priority, function, *args)
+
+    @property
+    def is_open(self) -> bool:
+        return self._worksheets is not None
+
+    @property
+    def partitioned(self) -> bool:
+        return self.app_config.gsheet.partition != "none"
+
+    @property
+    def transactions_worksheet(self) -> "gspread.Worksheet":
+        return self._open()[0]
+
+    @property
+    def summary_worksheet(self) -> "gspread.Worksheet":
+        return self._open()[1]
 
     @staticmethod
     def _create_row_from_transaction(transaction: Transaction, app_config: AppConfig) -> list:
@@ -43,17 +161,203 @@ class GSheet:
         ]
         return row
 
-    def insert_transaction(self, transaction: Transaction, app_config: AppConfig) -> typing.Tuple[str, float]:
-        logging.info(f"Inserting transaction {transaction}")
-        row = GSheet._create_row_from_transaction(transaction, app_config)
-        self.transactions_worksheet.insert_row(row, index=2)  # Skip header
-        return self.get_debtor(app_config)
+    @staticmethod
+    def _create_transaction_from_row(row: list, app_config: AppConfig) -> Transaction:
+        users = app_config.expenses.users
+        year, month, day, time, title, category_name, total, paid_by_name, split_type_name = row[:9]
+        percentages = row[9 : 9 + len(users)]
+        hour, minute = (int(part) for part in str(time).split(":"))
+
+        paid_by = find_in_list(paid_by_name, users, "name")
+        if paid_by is None:
+            raise ValueError(f"Unknown user {paid_by_name}")
+        category = find_in_list(category_name, app_config.expenses.categories, "name")
+        if category is None:
+            category = models.ExpenseCategory(name=category_name, emoji="❓", keywords=[])
+        # Use the split as it was recorded, the split type could have been changed in the config since
+        split_type = models.ExpenseSplitType(
+            name=split_type_name,
+            split={user.id: float(percentage) * 100 for user, percentage in zip(users, percentages)},
+        )
+        return Transaction(
+            date=datetime(int(year), int(month), int(day), hour, minute),
+            total=float(total),
+            title=str(title),
+            category=category,
+            paid_by=paid_by,
+            split_type=split_type,
+        )
+
+    def _get_partitions(self) -> typing.Dict[str, "gspread.Worksheet"]:
+        """The transactions worksheet, plus the ones named after it with a number (year or sequence)"""
+        self._open()
+        return self._partitions
+
+    @staticmethod
+    def _partition_number(base: str, title: str) -> typing.Optional[int]:
+        suffix = title[len(base) + 1 :]
+        if title.startswith(f"{base} ") and suffix.isdigit():
+            return int(suffix)
+        return None
+
+    def _get_partition(self, title: str) -> "gspread.Worksheet":
+        partitions = self._get_partitions()
+        if title not in partitions:
+            header = self.get_header()
+            logging.info(f"Creating worksheet {title}")
+            worksheet = self._scheduler.write(
+                "add_worksheet", self._spreadsheet.add_worksheet, title, rows=1000, cols=len(header)
+            )
+            self._scheduler.write("append_rows", worksheet.append_rows, [header], table_range="A1")
+            partitions[title] = worksheet
+            self._partition_rows[title] = 1
+        return partitions[title]
+
+    def _split_in_partitions(
+        self, transactions: typing.List[Transaction]
+    ) -> typing.List[typing.Tuple[str, typing.List[Transaction]]]:
+        """Consecutive runs of transactions going to the same partition"""
+        gsheet_config = self.app_config.gsheet
+        base = gsheet_config.transactions_worksheet_name
+        if gsheet_config.partition == "none":
+            return [(base, transactions)]
+        if gsheet_config.partition == "year":
+            runs: typing.List[typing.Tuple[str, typing.List[Transaction]]] = []
+            for transaction in transactions:
+                title = f"{base} {transaction.date.year}"
+                if not runs or runs[-1][0] != title:
+                    runs.append((title, []))
+                runs[-1][1].append(transaction)
+            return runs
+
+        # Fill the last partition, then roll over to new ones
+        partitions = self._get_partitions()
+        number, title = max((GSheet._partition_number(base, title) or 1, title) for title in partitions)
+        if title not in self._partition_rows:
+            self._partition_rows[title] = len(self._read(partitions[title], "col_values", 1))
+        free = gsheet_config.partition_rows - (self._partition_rows[title] - 1)
+        runs, start = [], 0
+        while start < len(transactions):
+            if free <= 0:
+                number += 1
+                title, free = f"{base} {number}", gsheet_config.partition_rows
+            runs.append((title, transactions[start : start + free]))
+            start += free
+            free = 0
+        return runs
+
+    def _transactions_worksheets(
+        self, years: typing.Optional[typing.Tuple[int, int]] = None
+    ) -> typing.List["gspread.Worksheet"]:
+        """All the worksheets with transactions, only the partitions of `years` (first, last) if partitioned by year"""
+        if not self.partitioned:
+            return [self.transactions_worksheet]
+        partitions = self._get_partitions()
+        if years is None or self.app_config.gsheet.partition != "year":
+            return list(partitions.values())
+        base = self.app_config.gsheet.transactions_worksheet_name
+        return [
+            worksheet
+            for title, worksheet in partitions.items()
+            # The transactions worksheet has the history from before partitioning
+            if title == base or years[0] <= GSheet._partition_number(base, title) <= years[1]
+        ]
+
+    def get_header(self) -> list:
+        if self._header is None:
+            self._header = self._read(self.transactions_worksheet, "row_values", 1)
+        return self._header
+
+    def iter_rows(
+        self, chunk_rows: int = 5000, years: typing.Optional[typing.Tuple[int, int]] = None
+    ) -> typing.Iterator[list]:
+        """Rows of the transactions worksheets, header excluded, read `chunk_rows` at a time: they are
+        never all in memory, however large the sheet is"""
+        for worksheet in self._transactions_worksheets(years):
+            start = 2  # Skip header
+            while True:
+                rows = self._read(
+                    worksheet,
+                    "get",
+                    f"{start}:{start + chunk_rows - 1}",
+                    value_render_option="UNFORMATTED_VALUE",
+                )
+                yield from rows
+                # Sheets leaves out the empty rows at the end of the range
+                if len(rows) < chunk_rows:
+                    break
+                start += chunk_rows
+
+    def get_transactions(self, app_config: AppConfig) -> typing.List[Transaction]:
+        transactions = []
+        for worksheet in self._transactions_worksheets():
+            rows = self._read(worksheet, "get_all_values", value_render_option="UNFORMATTED_VALUE")
+            for n, row in enumerate(rows[1:], start=2):  # Skip header
+                if not any(row):
+                    continue
+                try:
+                    transactions.append(GSheet._create_transaction_from_row(row, app_config))
+                except (ValueError, TypeError) as e:
+                    logging.warning(f"Skipping row {n} of the {worksheet.title} worksheet: {e}")
+        return transactions
+
+    def insert_transaction(self, transaction: Transaction, app_config: AppConfig) -> None:
+        self.insert_transactions([transaction], app_config)
+
+    def insert_transactions(self, transactions: typing.List[Transaction], app_config: AppConfig) -> None:
+        logging.info(f"Inserting {len(transactions)} transactions: {[str(t) for t in transactions]}")
+        written = 0
+        for title, run in self._split_in_partitions(transactions):
+            try:
+                self._write_rows(title, [GSheet._create_row_from_transaction(t, app_config) for t in run])
+            except Exception as e:
+                if written:
+                    raise PartialWriteError(written, e) from e
+                raise
+            written += len(run)
+
+    def _write_rows(self, title: str, rows: typing.List[list]) -> None:
+        worksheet = self._get_partition(title) if self.partitioned else self.transactions_worksheet
+        if self.app_config.gsheet.layout == "append":
+            self._scheduler.write("append_rows", worksheet.append_rows, rows, table_range="A1")
+        else:
+            # Newest on top, as if each transaction had been inserted at the top one by one
+            self._scheduler.write("insert_rows", worksheet.insert_rows, rows[::-1], row=2)  # Skip header
+        if title in self._partition_rows:
+            self._partition_rows[title] += len(rows)
+
+    def update_summary(self, user_in_debt: str, amount_to_repay: float, app_config: AppConfig) -> None:
+        """Write the summary computed by the bot, for layouts the formulas of the sheet cannot summarize"""
+        worksheet = self.summary_worksheet
+        self._scheduler.write(
+            "batch_update",
+            worksheet.batch_update,
+            [
+                {
+                    "range": app_config.gsheet.summary_worksheet_cell_user_in_debt,
+                    "values": [[user_in_debt]],
+                },
+                {
+                    "range": app_config.gsheet.summary_worksheet_cell_amount_to_repay,
+                    "values": [[amount_to_repay]],
+                },
+            ],
+        )
 
     def get_debtor(self, app_config: AppConfig) -> typing.Tuple[str, float]:
-        user_in_debt = self.summary_worksheet.acell(
-            app_config.gsheet.summary_worksheet_cell_user_in_debt
-        ).value
-        amount_to_repay = self.summary_worksheet.acell(
-            app_config.gsheet.summary_worksheet_cell_amount_to_repay
-        ).value
+        cells = (
+            app_config.gsheet.summary_worksheet_cell_user_in_debt,
+            app_config.gsheet.summary_worksheet_cell_amount_to_repay,
+        )
+        # Both cells in a single request
+        value_ranges = self._read(self.summary_worksheet, "batch_get", cells)
+        user_in_debt, amount_to_repay = (
+            value_range[0][0] if value_range and value_range[0] else "" for value_range in value_ranges
+        )
         return user_in_debt, amount_to_repay
+
+    def _read(self, worksheet: "gspread.Worksheet", method: str, *args, **kwargs) -> typing.Any:
+        """Call a read `method` of `worksheet` through the scheduler, concurrent identical reads are made once.
+        Arguments must be hashable."""
+        key = (self.app_config.gsheet.file_id, worksheet.title, method, args, tuple(sorted(kwargs.items())))
+        return self._scheduler.read(key, method, getattr(worksheet, method), *args, **kwargs)
@@ -0,0 +1,117 @@
+import csv
+from datetime import datetime
+import itertools
+import re
+import typing
+
+from . import models
+from .keywords import CategoryMatcher
+
+# Lowercase header names, as exported by the most common banks
+DATE_COLUMNS = ("date", "transaction date", "booking date", "value date", "data", "data operazione")
+AMOUNT_COLUMNS = ("amount", "total", "value", "importo")
+TITLE_COLUMNS = ("description", "title", "payee", "merchant", "details", "memo", "name", "descrizione")
+DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y")
+
+
+def _find_column(header: typing.List[str], candidates: typing.Tuple[str, ...]) -> int:
+    normalized = [h.strip().lower() for h in header]
+    for candidate in candidates:
+        if candidate in normalized:
+            return normalized.index(candidate)
+    raise ValueError(f"No column named like any of: {', '.join(candidates)}")
+
+
+def _parse_date(text: str) -> datetime:
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), date_format)
+        except ValueError:
+            pass
+    raise ValueError(f"Unknown date format: {text}")
+
+
+def _parse_amount(text: str) -> float:
+    """Signed amount: -12.50, 12.50-, (12.50), 1.234,56, 1,234.56, 1,234 (a thousand, money has 2 decimals)"""
+    text = text.strip().replace(" ", "")
+    negative = text.startswith("-") or text.endswith("-") or (text.startswith("(") and text.endswith(")"))
+    text = text.strip("-+()")
+    if "," in text and "." in text:
+        # Thousands separator is whichever comes first: 1.234,56 or 1,234.56
+        thousands = "." if text.index(".") < text.index(",") else ","
+        text = text.replace(thousands, "")
+    else:
+        separator = "," if "," in text else "."
+        # Repeated (1,234,567) or followed by 3 digits (1,234): thousands, otherwise decimals (12,50)
+        if text.count(separator) > 1 or re.fullmatch(rf"\d+\{separator}\d{{3}}", text):
+            text = text.replace(separator, "")
+    amount = float(text.replace(",", "."))
+    return -amount if negative else amount
+
+
+class ImportResult(typing.NamedTuple):
+    transactions: typing.List[models.Transaction]
+    # Rows whose category could not be guessed: {"date", "total", "title"}
+    review: typing.List[dict]
+    # Rows that could not be read at all or are income: (line number, reason)
+    skipped: typing.List[typing.Tuple[int, str]]
+
+
+def import_csv(
+    lines: typing.Iterable[str],
+    category_matcher: CategoryMatcher,
+    paid_by: models.ExpenseUser,
+    split_type: models.ExpenseSplitType,
+) -> ImportResult:
+    """Reads a CSV bank statement, categorizing each row with the config keywords.
+
+    In statements with negative amounts, those are the expenses and the positive ones (salary,
+    refunds, ...) are income: they are skipped. Statements without any negative amount (e.g. credit
+    card ones) are all expenses.
+    """
+    lines = iter(lines)
+    first_line = next(lines, "")
+    try:
+        dialect = csv.Sniffer().sniff(first_line, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(itertools.chain([first_line], lines), dialect)
+    header = next(reader, [])
+    date_column = _find_column(header, DATE_COLUMNS)
+    amount_column = _find_column(header, AMOUNT_COLUMNS)
+    title_column = _find_column(header, TITLE_COLUMNS)
+
+    result = ImportResult([], [], [])
+    rows = []
+    for row in reader:
+        if not any(row):
+            continue
+        try:
+            date = _parse_date(row[date_column])
+            amount = _parse_amount(row[amount_column])
+            title = " ".join(row[title_column].split())
+        except (ValueError, IndexError) as e:
+            result.skipped.append((reader.line_num, str(e)))
+            continue
+        if not amount or not title:
+            result.skipped.append((reader.line_num, "Missing amount or description"))
+            continue
+        rows.append((reader.line_num, date, amount, title))
+
+    # The sign convention is only known once all the rows are read
+    expenses_negative = any(amount < 0 for _, _, amount, _ in rows)
+    for line_num, date, amount, title in rows:
+        if expenses_negative and amount > 0:
+            result.skipped.append((line_num, f"Income, not an expense: {title} {amount}"))
+            continue
+        total = abs(amount)
+        category = category_matcher.best(title)
+        if category is None:
+            result.review.append({"date": date.isoformat(), "total": total, "title": title})
+            continue
+        result.transactions.append(
+            models.Transaction(
+                date=date, total=total, title=title, category=category, paid_by=paid_by, split_type=split_type
+            )
+        )
+    return result
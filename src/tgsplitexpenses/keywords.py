@@ -0,0 +1,93 @@
+import re
+import typing
+
+from . import models
+
+TOKEN_RE = re.compile(r"\w+")
+FUZZY_MIN_LENGTH = 4  # Shorter words are too easy to confuse with each other
+FUZZY_PENALTY = 0.5
+
+
+def tokenize(text: str) -> typing.List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def _deletes(token: str) -> typing.Set[str]:
+    return {token[:i] + token[i + 1 :] for i in range(len(token))}
+
+
+class CategoryMatcher:
+    """Suggests categories for a title based on their keywords.
+
+    Built once per config: keywords are tokenized into a trie, so multi-word keywords like
+    "grocery store" match, and every title is scanned in a single pass. Words not in any keyword
+    are matched to the closest keyword word within one typo (symmetric delete index), at a
+    lower score.
+    """
+
+    def __init__(self, categories: typing.List[models.ExpenseCategory], fuzzy: bool = True) -> None:
+        self.categories = categories
+        self.fuzzy = fuzzy
+        # token -> child node, None key holds the indexes of the categories a keyword ends in
+        self._trie: dict = {}
+        self._vocabulary: typing.Set[str] = set()
+        for n, category in enumerate(categories):
+            for keyword in category.keywords:
+                tokens = tokenize(keyword)
+                if not tokens:
+                    continue
+                node = self._trie
+                for token in tokens:
+                    node = node.setdefault(token, {})
+                node.setdefault(None, []).append(n)
+                self._vocabulary.update(tokens)
+        self._fuzzy_index: typing.Dict[str, typing.Set[str]] = {}
+        for token in self._vocabulary:
+            if len(token) >= FUZZY_MIN_LENGTH:
+                for variant in _deletes(token) | {token}:
+                    self._fuzzy_index.setdefault(variant, set()).add(token)
+
+    def _canonical(self, token: str, fuzzy: bool) -> typing.Tuple[typing.Optional[str], bool]:
+        """Keyword token matching `token`, and whether the match is fuzzy"""
+        if token in self._vocabulary:
+            return token, False
+        if not fuzzy or len(token) < FUZZY_MIN_LENGTH:
+            return None, False
+        candidates = set()
+        for variant in _deletes(token) | {token}:
+            candidates |= self._fuzzy_index.get(variant, set())
+        if len(candidates) != 1:
+            return None, False  # No match, or ambiguous
+        return candidates.pop(), True
+
+    def rank(
+        self, title: str, fuzzy: typing.Optional[bool] = None
+    ) -> typing.List[typing.Tuple[models.ExpenseCategory, float]]:
+        """Categories matching `title` with their score, best first. `fuzzy` overrides the default of the matcher"""
+        fuzzy = self.fuzzy if fuzzy is None else fuzzy
+        tokens = [self._canonical(token, fuzzy) for token in tokenize(title)]
+        scores: typing.Dict[int, float] = {}
+        for start in range(len(tokens)):
+            node = self._trie
+            score = 0.0
+            for token, is_fuzzy in tokens[start:]:
+                node = node.get(token) if token is not None else None
+                if node is None:
+                    break
+                score += FUZZY_PENALTY if is_fuzzy else 1.0
+                for n in node.get(None, []):
+                    scores[n] = max(scores.get(n, 0.0), score)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(self.categories[n], score) for n, score in ranked]
+
+    def suggest(self, title: str, limit: int = 3) -> typing.List[models.ExpenseCategory]:
+        return [category for category, _ in self.rank(title)[:limit]]
+
+    def best(self, title: str) -> typing.Optional[models.ExpenseCategory]:
+        """Best category, only if it is not tied with another one. Used to save transactions without
+        asking, so only exact keyword matches count: a typo-tolerant match is too often another word
+        (e.g. "sent" for "rent"), those are only suggestions"""
+        ranked = self.rank(title, fuzzy=False)
+        if not ranked or (len(ranked) > 1 and ranked[0][1] == ranked[1][1]):
+            return None
+        return ranked[0][0]
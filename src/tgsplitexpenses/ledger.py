@@ -0,0 +1,119 @@
+from datetime import datetime
+from pathlib import Path
+import sqlite3
+import typing
+
+from .models import Transaction
+
+
+def connect(database_file: Path) -> sqlite3.Connection:
+    """Opens the database shared by all the ledgers, creating the schema if needed"""
+    db = sqlite3.connect(database_file, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    with db:
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                data TEXT NOT NULL,
+                synced_at TEXT,
+                ledger TEXT NOT NULL DEFAULT 'default'
+            )
+            """
+        )
+        columns = [column[1] for column in db.execute("PRAGMA table_info(transactions)")]
+        if "ledger" not in columns:  # Databases created before multi-ledger support
+            db.execute("ALTER TABLE transactions ADD COLUMN ledger TEXT NOT NULL DEFAULT 'default'")
+        if "idempotency_key" not in columns:  # Databases created before recurring expenses
+            db.execute("ALTER TABLE transactions ADD COLUMN idempotency_key TEXT")
+        db.execute("DROP INDEX IF EXISTS transactions_unsynced")
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS transactions_ledger_unsynced ON transactions (ledger, id) WHERE synced_at IS NULL"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS transactions_ledger ON transactions (ledger, id)")
+        db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS transactions_ledger_idempotency_key ON transactions (ledger, idempotency_key) WHERE idempotency_key IS NOT NULL"
+        )
+    return db
+
+
+def unsynced_ledgers(db: sqlite3.Connection) -> typing.List[str]:
+    """Keys of the ledgers with transactions still to be synced to their sheet"""
+    rows = db.execute("SELECT DISTINCT ledger FROM transactions WHERE synced_at IS NULL")
+    return [key for (key,) in rows]
+
+
+def unsynced_count(db: sqlite3.Connection) -> int:
+    """Transactions of all the ledgers still to be synced to their sheet"""
+    return db.execute("SELECT COUNT(*) FROM transactions WHERE synced_at IS NULL").fetchone()[0]
+
+
+class Ledger:
+    """Local SQLite ledger, the source of truth for transactions.
+
+    Transactions are committed here first and mirrored to the sheet later,
+    `synced_at` is set once a row made it to the sheet. All the ledgers share the same database,
+    rows are partitioned by ledger `key`.
+    """
+
+    def __init__(self, db: sqlite3.Connection, key: str = "default") -> None:
+        self._db = db
+        self.key = key
+
+    def add(self, transaction: Transaction) -> int:
+        return self.add_many([transaction])[0]
+
+    def add_many(
+        self, transactions: typing.List[Transaction], keys: typing.Optional[typing.List[str]] = None
+    ) -> typing.List[typing.Optional[int]]:
+        """Ids of the added transactions. With idempotency `keys` (one per transaction), the ones whose key
+        is already in the ledger are not added again: their id is None"""
+        ids = []
+        with self._db:
+            for transaction, key in zip(transactions, keys or [None] * len(transactions)):
+                cursor = self._db.execute(
+                    """
+                    INSERT INTO transactions (date, data, ledger, idempotency_key) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (ledger, idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+                    """,
+                    (transaction.date.isoformat(), transaction.model_dump_json(), self.key, key),
+                )
+                ids.append(cursor.lastrowid if cursor.rowcount else None)
+        return ids
+
+    def keys(self, prefix: str) -> typing.Set[str]:
+        """Idempotency keys starting with `prefix` already in the ledger"""
+        rows = self._db.execute(
+            "SELECT idempotency_key FROM transactions WHERE ledger = ? AND substr(idempotency_key, 1, ?) = ?",
+            (self.key, len(prefix), prefix),
+        )
+        return {key for (key,) in rows}
+
+    def unsynced(self, limit: int = -1) -> typing.List[typing.Tuple[int, Transaction]]:
+        rows = self._db.execute(
+            "SELECT id, data FROM transactions WHERE ledger = ? AND synced_at IS NULL ORDER BY id LIMIT ?",
+            (self.key, limit),
+        )
+        return [(id_, Transaction.model_validate_json(data)) for id_, data in rows]
+
+    def count_unsynced(self) -> int:
+        return self._db.execute(
+            "SELECT COUNT(*) FROM transactions WHERE ledger = ? AND synced_at IS NULL", (self.key,)
+        ).fetchone()[0]
+
+    def mark_synced(self, ids: typing.List[int]) -> None:
+        now = datetime.now().isoformat()
+        with self._db:
+            self._db.executemany(
+                "UPDATE transactions SET synced_at = ? WHERE id = ?", [(now, id_) for id_ in ids]
+            )
+
+    def recent(self, limit: int) -> typing.List[typing.Tuple[Transaction, bool]]:
+        """Latest transactions, newest first, each with whether it was synced already"""
+        rows = self._db.execute(
+            "SELECT data, synced_at IS NOT NULL FROM transactions WHERE ledger = ? ORDER BY id DESC LIMIT ?",
+            (self.key, limit),
+        )
+        return [(Transaction.model_validate_json(data), bool(synced)) for data, synced in rows]
@@ -0,0 +1,159 @@
+import asyncio
+from collections import OrderedDict
+import logging
+import sqlite3
+import typing
+
+from .ai import TransactionExtractor
+from .balances import Balances
+from .catalog import Catalog
+from .config import AppConfig
+from .gsheet import GSheet, SheetsClientPool
+from .keywords import CategoryMatcher
+from .ledger import Ledger
+from .parser import TransactionParser
+from .stats import Stats
+from .writer import TransactionWriter
+
+
+class ConfigSnapshot:
+    """Config of a ledger and all that is derived from it: lookups, keyboards, keyword index, parser and AI models.
+
+    Never modified once built. When the config file changes a new one is built off the event loop
+    and swapped in as a whole: handlers take `ledger.config` once and use it throughout, so they
+    see a consistent config even if it is swapped while they wait.
+    """
+
+    def __init__(self, app_config: AppConfig) -> None:
+        self.app_config = app_config
+        self.catalog = Catalog(app_config)
+        self.category_matcher = CategoryMatcher(app_config.expenses.categories)
+        self.parser = TransactionParser(app_config, self.category_matcher)
+        self.ai = TransactionExtractor(app_config)
+
+    def derives_from(self, app_config: AppConfig) -> bool:
+        """Whether this snapshot would be the same if built from `app_config`"""
+        return (
+            self.app_config.expenses == app_config.expenses
+            and self.app_config.openai.model == app_config.openai.model
+            and self.app_config.gsheet == app_config.gsheet
+        )
+
+
+class ChatLedger:
+    """A ledger with its own users, categories, split types and spreadsheet, and all that is derived from them"""
+
+    def __init__(
+        self,
+        key: str,
+        app_config: AppConfig,
+        db: sqlite3.Connection,
+        clients: SheetsClientPool,
+        config: typing.Optional[ConfigSnapshot] = None,
+    ):
+        self.key = key
+        self.config = config or ConfigSnapshot(app_config)
+        self.gsheet = GSheet(app_config, clients)
+        self.ledger = Ledger(db, key)
+        self.writer = TransactionWriter(self.gsheet, self.ledger, app_config)
+        self.balances = Balances(app_config)
+        self.stats = Stats()
+        self.writer.views.extend([self.balances, self.stats])
+        if self.gsheet.partitioned:
+            # The formulas of the summary worksheet can't keep up with new partitions
+            self.writer.summary = self.balances.get_debtor
+
+    @property
+    def app_config(self) -> AppConfig:
+        return self.config.app_config
+
+    def reconfigure(self, config: ConfigSnapshot) -> None:
+        """Swap in the snapshot of the new config, built with `LedgerRegistry.prepare_reload`"""
+        self.config = config
+        self.gsheet.app_config = self.writer.app_config = config.app_config
+        self.balances.users = config.app_config.expenses.users
+
+
+class LedgerRegistry:
+    """Ledgers of all the allowed chats, keyed by chat id.
+
+    Chats without their own ledger in the config share the "default" one. Ledgers are created
+    on first use, at most `max_open` are kept open: the least recently used ones are closed
+    (their transactions stay in the local ledger) and reopened when needed.
+    """
+
+    def __init__(self, app_config: AppConfig, db: sqlite3.Connection) -> None:
+        self.app_config = app_config
+        self.db = db
+        self.max_open = app_config.ledger.max_open_ledgers
+        self.clients = SheetsClientPool()
+        self._open: OrderedDict[str, ChatLedger] = OrderedDict()
+        # Evicted ledgers whose writer is still stopping, by key, and the task stopping it
+        self._closing: typing.Dict[str, typing.Tuple[ChatLedger, asyncio.Task]] = {}
+
+    def prepare_reload(
+        self, app_config: AppConfig, ledgers: typing.List[ChatLedger]
+    ) -> typing.Dict[str, ConfigSnapshot]:
+        """Snapshots of the new config for `ledgers`, to be built in a worker thread as they take a while"""
+        snapshots = {}
+        for ledger in ledgers:
+            snapshots[ledger.key] = snapshot = self._snapshot(app_config, ledger)
+            snapshot.ai.prepare()
+        return snapshots
+
+    def reload(self, app_config: AppConfig, snapshots: typing.Dict[str, ConfigSnapshot]) -> None:
+        """Switch to `app_config` all at once: it runs on the event loop, without awaiting"""
+        self.app_config = app_config
+        for key, ledger in self._open.items():
+            # Ledgers opened while the snapshots were being built get theirs now
+            ledger.reconfigure(snapshots.get(key) or self._snapshot(app_config, ledger))
+
+    @staticmethod
+    def _snapshot(app_config: AppConfig, ledger: ChatLedger) -> ConfigSnapshot:
+        ledger_config = app_config.for_ledger(ledger.key)
+        if ledger_config.gsheet != ledger.app_config.gsheet:
+            # The spreadsheet is already open, with its layout and partitions
+            logging.warning(f"The gsheet settings of ledger {ledger.key} changed, restart to apply them")
+            ledger_config = ledger_config.model_copy(update={"gsheet": ledger.app_config.gsheet})
+        if ledger.config.derives_from(ledger_config):
+            return ledger.config
+        return ConfigSnapshot(ledger_config)
+
+    def get(self, chat_id: typing.Union[int, str]) -> ChatLedger:
+        return self.get_by_key(self.app_config.ledger_key(str(chat_id)))
+
+    def get_by_key(self, key: str) -> ChatLedger:
+        ledger = self._open.get(key)
+        if ledger is not None:
+            self._open.move_to_end(key)
+            return ledger
+        logging.info(f"Opening ledger {key}")
+        ledger = ChatLedger(key, self.app_config.for_ledger(key), self.db, self.clients)
+        # The new writer syncs the same rows: it starts once the evicted one is done
+        closing = self._closing.get(key)
+        ledger.writer.start(predecessor=closing[0].writer if closing is not None else None)
+        self._open[key] = ledger
+        if len(self._open) > self.max_open:
+            self._evict(*self._open.popitem(last=False))
+        return ledger
+
+    def _evict(self, key: str, ledger: ChatLedger) -> None:
+        logging.info(f"Closing ledger {key}")
+        task = asyncio.create_task(ledger.writer.stop())
+        self._closing[key] = (ledger, task)
+
+        def _closed(_: asyncio.Task) -> None:
+            if self._closing.get(key, (None,))[0] is ledger:
+                del self._closing[key]
+
+        task.add_done_callback(_closed)
+
+    @property
+    def open_ledgers(self) -> typing.List[ChatLedger]:
+        return list(self._open.values())
+
+    async def close(self) -> None:
+        await asyncio.gather(*(ledger.writer.stop() for ledger in self._open.values()))
+        self._open.clear()
+        await asyncio.gather(*(task for _, task in self._closing.values()))
+        self.clients.close()
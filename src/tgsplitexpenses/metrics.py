@@ -0,0 +1,219 @@
+import asyncio
+import bisect
+from contextlib import contextmanager
+import logging
+import threading
+import time
+import typing
+
+# Upper bounds in seconds, from a cached reply to a slow LLM completion
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = typing.Tuple[str, ...]
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Labels = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: typing.Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """Value read when collected, e.g. the length of a queue"""
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.function: typing.Callable[[], float] = lambda: 0
+
+    def set_function(self, function: typing.Callable[[], float]) -> None:
+        self.function = function
+
+    def set(self, value: float) -> None:
+        self.function = lambda: value
+
+    def collect(self) -> typing.List[str]:
+        try:
+            value = self.function()
+        except Exception as e:
+            logging.warning(f"Cannot collect {self.name}: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Span:
+    """Duration and errors of an operation: `<name>_seconds` histogram and `<name>_errors_total` counter"""
+
+    def __init__(self, name: str, help: str, labelnames: Labels = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.errors = Counter(f"{name}_errors_total", f"{help}, failed", labelnames)
+        # labels -> [count per bucket (not cumulative, +Inf last), sum, max]
+        self._values: typing.Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *labels: str) -> None:
+        with self._lock:
+            value = self._values.get(labels)
+            if value is None:
+                value = self._values[labels] = [[0] * (len(BUCKETS) + 1), 0.0, 0.0]
+            value[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+            value[1] += seconds
+            value[2] = max(value[2], seconds)
+
+    @contextmanager
+    def time(self, *labels: str) -> typing.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.errors.inc(*labels)
+            raise
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def collect(self) -> typing.List[str]:
+        name = f"{self.name}_seconds"
+        lines = [f"# HELP {name} {self.help}, duration in seconds", f"# TYPE {name} histogram"]
+        with self._lock:
+            for labels, (buckets, total, _) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip([*BUCKETS, "+Inf"], buckets):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines + self.errors.collect()
+
+    def summary(self) -> typing.List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        errors = self.errors._values
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)}: {sum(buckets)} calls, "
+            f"{errors.get(labels, 0):g} errors, avg {total / sum(buckets) * 1000:.1f}ms, max {max_ * 1000:.1f}ms"
+            for labels, (buckets, total, max_) in values
+        ]
+
+
+HANDLER = Span("tgsplitexpenses_handler", "Updates handled", ("handler",))
+STATE = Span("tgsplitexpenses_state", "Messages of the /add conversation handled", ("state",))
+STATE_TRANSITIONS = Counter(
+    "tgsplitexpenses_state_transitions_total", "Conversation state transitions", ("from_state", "to_state")
+)
+SHEETS = Span("tgsplitexpenses_sheets", "Google Sheets API calls", ("call",))
+OPENAI = Span("tgsplitexpenses_openai", "OpenAI completions", ("model",))
+SHEETS_RETRIES = Counter(
+    "tgsplitexpenses_sheets_retries_total", "Retried writes of transactions to the sheet"
+)
+SHEETS_COALESCED = Counter(
+    "tgsplitexpenses_sheets_coalesced_total",
+    "Sheets reads answered by an identical read in flight",
+    ("call",),
+)
+SHEETS_QUEUED = Gauge("tgsplitexpenses_sheets_queued", "Sheets API calls waiting for quota")
+SYNCED = Counter("tgsplitexpenses_synced_transactions_total", "Transactions written to the sheet")
+UNSYNCED = Gauge("tgsplitexpenses_unsynced_transactions", "Transactions waiting to be written to the sheet")
+UPDATES_QUEUED = Gauge("tgsplitexpenses_updates_queued", "Updates received and not yet handled")
+READY = Gauge("tgsplitexpenses_ready", "1 once the spreadsheets of the open ledgers are loaded")
+FIRST_RESPONSE = Gauge(
+    "tgsplitexpenses_first_response_seconds",
+    "Seconds from the start of the process to the first handled update",
+)
+
+METRICS: typing.List[typing.Union[Counter, Gauge, Span]] = [
+    HANDLER,
+    STATE,
+    STATE_TRANSITIONS,
+    SHEETS,
+    OPENAI,
+    SHEETS_RETRIES,
+    SHEETS_COALESCED,
+    SHEETS_QUEUED,
+    SYNCED,
+    UNSYNCED,
+    UPDATES_QUEUED,
+    READY,
+    FIRST_RESPONSE,
+]
+
+
+def exposition() -> str:
+    """All the metrics in the Prometheus text format"""
+    return "\n".join(line for metric in METRICS for line in metric.collect()) + "\n"
+
+
+def summary() -> str:
+    lines = [line for span in (HANDLER, STATE, SHEETS, OPENAI) for line in span.summary()]
+    for metric in (
+        SHEETS_RETRIES,
+        SHEETS_COALESCED,
+        SHEETS_QUEUED,
+        SYNCED,
+        UNSYNCED,
+        UPDATES_QUEUED,
+        READY,
+        FIRST_RESPONSE,
+    ):
+        lines.extend(line for line in metric.collect() if not line.startswith("#"))
+    return "\n".join(lines)
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass  # Headers are not needed
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?")[0] if len(parts) >= 2 and parts[0] == "GET" else None
+        if path == "/metrics":
+            status, body = "200 OK", exposition().encode()
+        elif path == "/health":
+            # The event loop is answering, messages are being handled
+            status, body = "200 OK", b"OK\n"
+        elif path == "/ready":
+            status, body = (
+                ("200 OK", b"Ready\n") if READY.function() else ("503 Service Unavailable", b"Starting\n")
+            )
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (ConnectionError, UnicodeDecodeError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(listen: str, port: int) -> asyncio.Server:
+    """Serve the metrics at http://<listen>:<port>/metrics, and liveness and readiness at /health and /ready"""
+    server = await asyncio.start_server(_handle_request, listen, port)
+    logging.info(f"Serving metrics on http://{listen}:{port}/metrics")
+    return server
@@ -1,5 +1,7 @@
 from pydantic import BaseModel
-from datetime import datetime
+import calendar
+from datetime import date, datetime, timedelta
+import typing
 
 
 class ExpenseUser(BaseModel):
@@ -37,3 +39,35 @@ class Transaction(BaseModel):
 
     def __str__(self):
         return f"{self.date.strftime('%Y-%m-%d %H:%M')} - {self.title} - {self.total} - {self.paid_by.displayname} - {self.category.displayname} - {self.split_type.name}"
+
+
+class RecurringExpense(BaseModel):
+    id: str  # Never change it: it tells the occurrences already added apart from the new ones
+    title: str
+    total: float
+    category: str  # Category name
+    paid_by: str  # User id
+    split_type: str  # Split type name
+    every: typing.Literal["day", "week", "month", "year"] = "month"
+    start: date  # First occurrence, then every day/week/month/year on the same weekday/day
+    end: typing.Optional[date] = None  # Last possible occurrence, if any
+
+    def occurrences(self, until: date) -> typing.Iterator[date]:
+        """Occurrences from the first one to `until`, included"""
+        last = min(until, self.end) if self.end is not None else until
+        n = 0
+        while (occurrence := self._occurrence(n)) <= last:
+            yield occurrence
+            n += 1
+
+    def _occurrence(self, n: int) -> date:
+        if self.every == "day":
+            return self.start + timedelta(days=n)
+        if self.every == "week":
+            return self.start + timedelta(weeks=n)
+        months = n if self.every == "month" else 12 * n
+        year, month = divmod(self.start.month - 1 + months, 12)
+        year += self.start.year
+        # E.g. on the 31st, the last day of the shorter months
+        day = min(self.start.day, calendar.monthrange(year, month + 1)[1])
+        return date(year, month + 1, day)
@@ -0,0 +1,114 @@
+from datetime import datetime
+import re
+import typing
+
+from .config import AppConfig
+from . import models
+from .keywords import CategoryMatcher
+
+AMOUNT_RE = re.compile(r"(?<![\w/])(\d+(?:[.,]\d{1,2})?)(?![\w/])")
+RATIO_RE = re.compile(r"\d+\s*/\s*\d+")
+PAID_BY_RE = re.compile(r"\bpaid\s+by\b", re.IGNORECASE)
+
+
+def _normalize_ratio(ratio: str) -> str:
+    return re.sub(r"\s+", "", ratio)
+
+
+class TransactionParser:
+    """Deterministic parser for simple messages like "12.50 pizza paid by User1 50/50".
+
+    Used as a fast path before asking the LLM: it only returns a transaction when every field
+    is found and unambiguous, otherwise it reports which fields are missing or ambiguous.
+    """
+
+    def __init__(self, app_config: AppConfig, category_matcher: CategoryMatcher) -> None:
+        self.expenses = app_config.expenses
+        self.category_matcher = category_matcher
+        self.default_split_type = self.expenses.split_types[0]
+        # Split types can be referenced by their full name or by the ratio in it ("50 / 50" -> "50/50")
+        self._split_type_by_name: typing.Dict[str, models.ExpenseSplitType] = {}
+        self._split_type_by_ratio: typing.Dict[str, typing.List[models.ExpenseSplitType]] = {}
+        for split_type in self.expenses.split_types:
+            self._split_type_by_name[split_type.name.lower()] = split_type
+            for ratio in RATIO_RE.findall(split_type.name):
+                self._split_type_by_ratio.setdefault(_normalize_ratio(ratio), []).append(split_type)
+        self._user_patterns = [
+            (
+                user,
+                re.compile(rf"(?<!\w){re.escape(user.name)}(?!\w)|{re.escape(user.emoji)}", re.IGNORECASE),
+            )
+            for user in self.expenses.users
+        ]
+
+    def parse(
+        self, text: str, sender_name: str = ""
+    ) -> typing.Tuple[typing.Optional[models.Transaction], typing.List[str]]:
+        """Returns the parsed transaction, or None with the fields that could not be resolved"""
+        missing = []
+
+        split_type, text = self.parse_split_type(text)
+        if split_type is None:
+            missing.append("split_type")
+
+        paid_by, text = self.parse_paid_by(text, sender_name)
+        if paid_by is None:
+            missing.append("paid_by")
+
+        amounts = AMOUNT_RE.findall(text)
+        total = float(amounts[0].replace(",", ".")) if len(amounts) == 1 else 0.0
+        if total <= 0:
+            # No amount, more than one or 0: left to the LLM
+            missing.append("total")
+        else:
+            text = AMOUNT_RE.sub(" ", text, count=1)
+
+        title = " ".join(text.split()).strip(" -,:")
+        if not title:
+            missing.append("title")
+
+        category = self.category_matcher.best(title) if title else None
+        if category is None:
+            missing.append("category")
+
+        if missing:
+            return None, missing
+        transaction = models.Transaction(
+            date=datetime.now(),
+            total=total,
+            title=title,
+            category=category,
+            paid_by=paid_by,
+            split_type=split_type,
+        )
+        return transaction, []
+
+    def parse_split_type(self, text: str) -> typing.Tuple[typing.Optional[models.ExpenseSplitType], str]:
+        lowered = text.lower()
+        for name, split_type in self._split_type_by_name.items():
+            start = lowered.find(name)
+            if start != -1:
+                return split_type, text[:start] + " " + text[start + len(name) :]
+        ratios = RATIO_RE.findall(text)
+        if not ratios:
+            return self.default_split_type, text
+        candidates = self._split_type_by_ratio.get(_normalize_ratio(ratios[0]), [])
+        if len(ratios) > 1 or len(candidates) != 1:
+            return None, text  # Ambiguous or unknown
+        return candidates[0], RATIO_RE.sub(" ", text, count=1)
+
+    def parse_paid_by(
+        self, text: str, sender_name: str
+    ) -> typing.Tuple[typing.Optional[models.ExpenseUser], str]:
+        mentioned = [(user, pattern) for user, pattern in self._user_patterns if pattern.search(text)]
+        if len(mentioned) > 1:
+            return None, text
+        if len(mentioned) == 1:
+            user, pattern = mentioned[0]
+            text = PAID_BY_RE.sub(" ", pattern.sub(" ", text))
+            return user, text
+        # Nobody mentioned, the sender paid if they are one of the users
+        for user, pattern in self._user_patterns:
+            if sender_name and pattern.search(sender_name):
+                return user, PAID_BY_RE.sub(" ", text)
+        return None, text
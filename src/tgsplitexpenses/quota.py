@@ -0,0 +1,188 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import heapq
+import itertools
+import logging
+import threading
+import time
+import typing
+
+from . import metrics
+
+T = typing.TypeVar("T")
+
+WRITE = 0
+READ = 1
+
+
+class _InFlight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: typing.Any = None
+        self.exception: typing.Optional[BaseException] = None
+
+
+class SheetsScheduler:
+    """Shared by all the sheets of a service account, keeps their API calls within the quota.
+
+    Calls take a token from a bucket: when it is empty callers wait, writes before reads. The
+    bucket holds bursts of up to a tenth of `requests_per_minute` and is refilled with the other
+    nine tenths over the minute, so that no 60 seconds window goes over the quota.
+    Identical reads in flight are made only once, and everyone waiting gets the same result.
+    Calls rejected for exceeding the quota anyway (e.g. the quota is shared with other clients)
+    empty the bucket and are retried with exponential backoff.
+
+    Calls are blocking, as gspread is: they are made from worker threads. `run` gives them threads
+    of their own, so that waiting for the quota never holds up the default executor of the event
+    loop, and the calls waiting for a thread wait on the event loop, writes first.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = 60,
+        max_retries: int = 4,
+        retry_delay: float = 2.0,
+        max_workers: int = 4,
+    ) -> None:
+        self.capacity = max(1.0, requests_per_minute / 10)
+        self.rate = (requests_per_minute - self.capacity) / 60
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._condition = threading.Condition()
+        self._waiting: typing.List[typing.Tuple[int, int]] = []  # (priority, sequence) heap
+        self._sequence = itertools.count()
+        self._reads: typing.Dict[typing.Hashable, _InFlight] = {}
+        self._reads_lock = threading.Lock()
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="sheets")
+        self._closed = False
+        self._busy = 0  # Threads taken by `run`
+        self._admissions: typing.List[typing.Tuple[int, int, asyncio.Future]] = []  # Waiting for a thread
+
+    async def run(self, priority: int, function: typing.Callable[..., T], *args, **kwargs) -> T:
+        """Run `function`, blocking and making its API calls through this scheduler, on a thread of the scheduler"""
+        if self._busy < self.max_workers and not self._admissions:
+            self._busy += 1
+        else:
+            admitted = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._admissions, (priority, next(self._sequence), admitted))
+            try:
+                await admitted  # The thread is handed over by `_release`
+            except asyncio.CancelledError:
+                if admitted.done() and not admitted.cancelled():
+                    self._release()
+                raise
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(function, *args, **kwargs)
+        )
+        # The thread is free only once the call is done, even if the caller is cancelled meanwhile
+        future.add_done_callback(self._done)
+        return await asyncio.shield(future)
+
+    def _done(self, future: asyncio.Future) -> None:
+        if not future.cancelled():
+            future.exception()  # Retrieved, in case the caller is gone
+        self._release()
+
+    def _release(self) -> None:
+        while self._admissions:
+            _, _, admitted = heapq.heappop(self._admissions)
+            if not admitted.done():
+                admitted.set_result(None)
+                return
+        self._busy -= 1
+
+    def close(self) -> None:
+        """Stop the calls waiting for the quota, and the ones not started yet"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _acquire(self, priority: int) -> None:
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                if self._closed:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    raise RuntimeError("Sheets scheduler closed")
+                self._refill()
+                if self._waiting[0] == ticket and self._tokens >= 1:
+                    self._tokens -= 1
+                    heapq.heappop(self._waiting)
+                    self._condition.notify_all()  # The next in line may be able to go too
+                    return
+                # Wake up when a token is due, or when the head of the line changes
+                self._condition.wait(timeout=max((1 - self._tokens) / self.rate, 0.01))
+
+    def _drain(self) -> None:
+        with self._condition:
+            self._tokens = 0
+            self._updated_at = time.monotonic()
+
+    @property
+    def waiting(self) -> int:
+        """Calls waiting for the quota, or for a thread"""
+        return len(self._waiting) + len(self._admissions)
+
+    def call(self, priority: int, name: str, function: typing.Callable[..., T], *args, **kwargs) -> T:
+        delay = self.retry_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            self._acquire(priority)
+            try:
+                with metrics.SHEETS.time(name):
+                    return function(*args, **kwargs)
+            except Exception as e:
+                if not is_quota_error(e) or attempt > self.max_retries:
+                    raise
+                logging.warning(f"Sheets quota exceeded by {name} ({attempt}), retrying in {delay}s")
+                metrics.SHEETS_RETRIES.inc()
+                self._drain()
+                time.sleep(delay)
+                delay *= 2
+
+    def write(self, name: str, function: typing.Callable[..., T], *args, **kwargs) -> T:
+        return self.call(WRITE, name, function, *args, **kwargs)
+
+    def read(self, key: typing.Hashable, name: str, function: typing.Callable[..., T], *args, **kwargs) -> T:
+        """Read, or wait for the result of the identical read (same `key`) already in flight"""
+        with self._reads_lock:
+            in_flight = self._reads.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._reads[key] = _InFlight()
+        if not leader:
+            metrics.SHEETS_COALESCED.inc(name)
+            in_flight.done.wait()
+            if in_flight.exception is not None:
+                raise in_flight.exception
+            return in_flight.result
+        try:
+            in_flight.result = self.call(READ, name, function, *args, **kwargs)
+            return in_flight.result
+        except BaseException as e:
+            in_flight.exception = e
+            raise
+        finally:
+            with self._reads_lock:
+                del self._reads[key]
+            in_flight.done.set()
+
+
+def is_quota_error(e: Exception) -> bool:
+    # gspread.exceptions.APIError, without importing gspread
+    return (
+        getattr(e, "code", None) == 429 or getattr(getattr(e, "response", None), "status_code", None) == 429
+    )
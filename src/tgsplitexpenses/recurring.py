@@ -0,0 +1,63 @@
+import asyncio
+from datetime import date, datetime, time
+import logging
+import typing
+
+from .config import AppConfig
+from .ledger import Ledger
+from .ledgers import ChatLedger
+from . import models
+
+KEY_PREFIX = "recurring"
+
+
+def due_transactions(
+    app_config: AppConfig, ledger: Ledger, today: date
+) -> typing.Tuple[typing.List[models.Transaction], typing.List[str]]:
+    """Occurrences of the recurring expenses of `app_config` (as seen by `ledger`) due by `today` and not
+    in `ledger` yet, oldest first, with their idempotency keys. Only the local ledger is read: the
+    ledger doesn't need to be open.
+
+    New recurring expenses are added from their start. Once some occurrences are in the ledger only
+    the ones after the latest are due: the keys embed the date, so after a change of `start` or
+    `every` the past occurrences of the new schedule would otherwise be added again."""
+    expenses = app_config.expenses
+    categories = {c.name: c for c in expenses.categories}
+    users = {u.id: u for u in expenses.users}
+    split_types = {s.name: s for s in expenses.split_types}
+    due = []
+    for expense in expenses.recurring:
+        prefix = f"{KEY_PREFIX}:{expense.id}:"
+        added = ledger.keys(prefix)
+        latest = max((key[len(prefix) :] for key in added), default="")  # ISO dates sort as strings
+        for occurrence in expense.occurrences(today):
+            key = f"{prefix}{occurrence.isoformat()}"
+            if occurrence.isoformat() <= latest:
+                continue
+            transaction = models.Transaction(
+                date=datetime.combine(occurrence, time()),
+                total=expense.total,
+                title=expense.title,
+                category=categories[expense.category],
+                paid_by=users[expense.paid_by],
+                split_type=split_types[expense.split_type],
+            )
+            due.append((transaction, key))
+    due.sort(key=lambda item: item[0].date)
+    return [transaction for transaction, _ in due], [key for _, key in due]
+
+
+def add_due(ledger: ChatLedger, today: typing.Optional[date] = None) -> int:
+    """Add the recurring expenses due, also the ones missed while the bot was down, returns how many.
+
+    They are committed together, so the writer syncs them to the sheet in a single batch, and with
+    idempotency keys: an occurrence is never added twice, even across restarts.
+    """
+    transactions, keys = due_transactions(ledger.app_config, ledger.ledger, today or date.today())
+    if not transactions:
+        return 0
+    synced = ledger.writer.put_many(transactions, keys)
+    # Nobody waits for the sync: the writer logs the failures and retries in background
+    asyncio.gather(*synced, return_exceptions=True)
+    logging.info(f"Added {len(synced)} recurring expenses to ledger {ledger.key}")
+    return len(synced)
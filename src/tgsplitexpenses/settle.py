@@ -0,0 +1,71 @@
+import heapq
+import typing
+
+from .models import Transaction
+
+
+class Transfer(typing.NamedTuple):
+    from_user: str  # User id of who pays
+    to_user: str  # User id of who gets paid
+    amount: float
+
+
+def apply_transaction(net: typing.Dict[str, float], transaction: Transaction) -> None:
+    """Add `transaction` to the net balance of each user, positive means the user is owed money"""
+    net[transaction.paid_by.id] = net.get(transaction.paid_by.id, 0.0) + transaction.total
+    for user_id, percentage in transaction.split_type.split.items():
+        net[user_id] = net.get(user_id, 0.0) - transaction.total * percentage / 100
+
+
+def net_balances(transactions: typing.Iterable[Transaction]) -> typing.Dict[str, float]:
+    net: typing.Dict[str, float] = {}
+    for transaction in transactions:
+        apply_transaction(net, transaction)
+    return net
+
+
+def settle(net: typing.Mapping[str, float], decimals: int = 2) -> typing.List[Transfer]:
+    """Transfers that bring every net balance to zero, from debtors to creditors.
+
+    Greedy minimum cash flow: debtors whose debt is exactly what a creditor is owed are paired
+    first, then the largest debtor repeatedly pays the largest creditor (two heaps), so each
+    transfer settles at least one of them. That is at most users - 1 transfers, in
+    O(users log users). Amounts are rounded to `decimals`, leftovers below that are dropped.
+    """
+    scale = 10**decimals
+    # Integer cents, so that amounts sum up exactly
+    debts: typing.List[typing.Tuple[int, str]] = []
+    credits: typing.List[typing.Tuple[int, str]] = []
+    for user_id, amount in net.items():
+        cents = round(amount * scale)
+        if cents < 0:
+            debts.append((cents, user_id))  # Negative: the heap pops the largest debt first
+        elif cents > 0:
+            credits.append((-cents, user_id))
+
+    transfers = []
+    creditors_by_amount: typing.Dict[int, typing.List[str]] = {}
+    for cents, user_id in sorted(credits, reverse=True):  # Reversed, so pop() gives the first one
+        creditors_by_amount.setdefault(-cents, []).append(user_id)
+    unmatched_debts = []
+    for cents, user_id in sorted(debts):
+        creditors = creditors_by_amount.get(-cents)
+        if creditors:
+            transfers.append(Transfer(user_id, creditors.pop(), -cents / scale))
+        else:
+            unmatched_debts.append((cents, user_id))
+    debts = unmatched_debts
+    credits = [(-cents, user_id) for cents, user_ids in creditors_by_amount.items() for user_id in user_ids]
+    heapq.heapify(debts)
+    heapq.heapify(credits)
+
+    while debts and credits:
+        debt, debtor = heapq.heappop(debts)
+        credit, creditor = heapq.heappop(credits)
+        cents = min(-debt, -credit)
+        transfers.append(Transfer(debtor, creditor, cents / scale))
+        if debt + cents:
+            heapq.heappush(debts, (debt + cents, debtor))
+        if credit + cents:
+            heapq.heappush(credits, (credit + cents, creditor))
+    return transfers
@@ -0,0 +1,57 @@
+import typing
+
+from .models import Transaction
+
+DIMENSIONS = ("month", "category", "paid_by", "split_type")
+
+# (month as "YYYY-MM", category name, paid by user id, split type name)
+BucketKey = typing.Tuple[str, str, str, str]
+
+
+class Stats:
+    """Materialized aggregates (total and count) of all the transactions.
+
+    Seeded once with all the transactions, then updated on every new one. Transactions are
+    grouped in buckets by month, category, payer and split type, so queries, time windows
+    included, only go through the buckets and never through the transactions.
+    """
+
+    def __init__(self) -> None:
+        self.seeded = False
+        self._buckets: typing.Dict[BucketKey, typing.List[float]] = {}
+
+    def seed(self, transactions: typing.Iterable[Transaction]) -> None:
+        self._buckets = {}
+        for transaction in transactions:
+            self._apply(transaction)
+        self.seeded = True
+
+    def apply(self, transaction: Transaction) -> None:
+        if self.seeded:
+            self._apply(transaction)
+
+    def _apply(self, transaction: Transaction) -> None:
+        key = (
+            transaction.date.strftime("%Y-%m"),
+            transaction.category.name,
+            transaction.paid_by.id,
+            transaction.split_type.name,
+        )
+        bucket = self._buckets.setdefault(key, [0.0, 0])
+        bucket[0] += transaction.total
+        bucket[1] += 1
+
+    def query(
+        self, by: str, since: typing.Optional[str] = None, until: typing.Optional[str] = None
+    ) -> typing.Dict[str, typing.Tuple[float, int]]:
+        """Total and count grouped `by` one of DIMENSIONS, for the months in [since, until] ("YYYY-MM")"""
+        index = DIMENSIONS.index(by)
+        result: typing.Dict[str, typing.List[float]] = {}
+        for key, (total, count) in self._buckets.items():
+            month = key[0]
+            if (since and month < since) or (until and month > until):
+                continue
+            group = result.setdefault(key[index], [0.0, 0])
+            group[0] += total
+            group[1] += count
+        return {group: (round(total, 2), int(count)) for group, (total, count) in result.items()}
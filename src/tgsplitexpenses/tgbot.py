@@ -1,11 +1,22 @@
+import asyncio
+from collections import Counter
 from enum import StrEnum
 import logging
+import re
+import sqlite3
+import time
 import typing as t
 
 from datetime import datetime
 from functools import wraps
+import importlib
+import itertools
+from pathlib import Path
+import tempfile
 
 from telegram import Update, ReplyKeyboardRemove
+from telegram.error import TelegramError
+from telegram.request import BaseRequest
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -13,13 +24,30 @@ from telegram.ext import (
     ContextTypes,
 )
 from telegram.ext import filters
-from pydantic import create_model, Field
 
 from .config import AppConfig
 from . import models
-from .gsheet import GSheet
-from openai import OpenAI
-from .utils import is_float, make_keyboard, find_in_list, get_suggested_category
+from .ledger import Ledger, unsynced_count, unsynced_ledgers
+from .ledgers import ChatLedger, LedgerRegistry
+from .stats import DIMENSIONS
+from .utils import is_float
+from .watcher import ConfigWatcher, restart_required
+from .catalog import Catalog, SKIP
+from .importer import import_csv, ImportResult
+from . import recurring
+from .export import export_transactions, ExportFilter
+from .updates import PerConversationUpdateProcessor
+from .conversations import ConversationStore
+from . import metrics
+from .quota import is_quota_error, READ
+
+if t.TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+
+EXPORT_USAGE = "/export [YYYY-MM [YYYY-MM]] [category] [compact]"
+# Largest file a bot can send
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
 
 
 class UserState(StrEnum):
@@ -29,6 +57,7 @@ class UserState(StrEnum):
     GET_CATEGORY = "GET_CATEGORY"
     GET_SPLIT_TYPE = "GET_SPLIT_TYPE"
     GET_PAID_BY = "GET_PAID_BY"
+    REVIEW_CATEGORY = "REVIEW_CATEGORY"
     END = "END"
 
 
@@ -41,11 +70,44 @@ def restricted_by_chat_id(f):
                 f"Attempted message in {update.message.chat.id} by {update.message.from_user.username}. Not in allowed chats. Rejected."
             )
             return
-        return await f(update, context)
+        # Conversations survive restarts: load the state on the first message of the user in the chat,
+        # save it after each
+        conversations: ConversationStore = context.bot_data["conversations"]
+        key = (update.message.chat.id, update.message.from_user.id)
+        conversation = _conversation(update, context)
+        conversations.load(key, conversation, _get_ledger(update, context).config.catalog)
+        try:
+            with metrics.HANDLER.time(f.__name__):
+                return await f(update, context)
+        finally:
+            conversations.save(key, conversation)
+            if "first_response" not in context.bot_data:
+                context.bot_data["first_response"] = time.perf_counter() - context.bot_data["started_at"]
+                metrics.FIRST_RESPONSE.set(context.bot_data["first_response"])
+                logging.info(f"First message handled {context.bot_data['first_response']:.2f}s after start")
 
     return wrapper
 
 
+def _conversation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> dict:
+    """State of the conversation of the user in this chat: chats have their own ledger, users, categories..."""
+    return context.user_data.setdefault(update.message.chat.id, {})
+
+
+def _get_ledger(update: Update, context: ContextTypes.DEFAULT_TYPE) -> ChatLedger:
+    ledgers: LedgerRegistry = context.bot_data["ledgers"]
+    return ledgers.get(update.message.chat.id)
+
+
+def _get_openai(context: ContextTypes.DEFAULT_TYPE) -> "AsyncOpenAI":
+    if context.bot_data["openai"] is None:
+        from openai import AsyncOpenAI
+
+        app_config: AppConfig = context.bot_data["app_config"]
+        context.bot_data["openai"] = AsyncOpenAI(api_key=app_config.openai.api_key)
+    return context.bot_data["openai"]
+
+
 @restricted_by_chat_id
 async def _handler_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message_parts = [
@@ -53,7 +115,11 @@ async def _handler_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         "/add or /new to add a transaction",
         "/aiadd to add a transaction with AI",
         "/status to show debt status",
-        "/stats NOT IMPLEMENTED",
+        "/settle to show who has to pay whom to settle all the debts",
+        "/history to show the latest transactions",
+        "Send a CSV bank statement, with a caption like 'paid by User1 50/50', to import it",
+        "/stats [all | YYYY-MM [YYYY-MM]] to show expense stats",
+        f"{EXPORT_USAGE} to export the transactions",
     ]
     message = "\n".join(message_parts)
     await update.message.reply_text(message, quote=True)
@@ -61,15 +127,31 @@ async def _handler_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 @restricted_by_chat_id
 async def _handler_new(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    context.user_data.clear()
-    context.user_data["STATE"] = UserState.START
+    conversation = _conversation(update, context)
+    conversation.clear()
+    conversation["STATE"] = UserState.START
     await _handler_text(update, context)
 
 
 @restricted_by_chat_id
 async def _handler_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    app_config: AppConfig = context.bot_data["app_config"]
-    current_state = context.user_data.get("STATE")
+    current_state = _conversation(update, context).get("STATE")
+    state_name = current_state if current_state in UserState._value2member_map_ else "UNKNOWN"
+    with metrics.STATE.time(state_name):
+        await _handle_state(update, context, current_state)
+    next_state = _conversation(update, context).get("STATE")
+    if next_state != current_state:
+        metrics.STATE_TRANSITIONS.inc(state_name, str(next_state))
+
+
+async def _handle_state(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, current_state: t.Optional[str]
+) -> None:
+    ledger = _get_ledger(update, context)
+    # The same config throughout, even if it is reloaded meanwhile
+    config = ledger.config
+    catalog = config.catalog
+    conversation = _conversation(update, context)
 
     logging.info(
         f"Handling: {update.message.from_user.name} ({update.message.from_user.id}) | {current_state} | {update.message.text} | {update.message.chat.id}"
@@ -84,8 +166,8 @@ async def _handler_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
 
     if current_state == UserState.START:
-        context.user_data["TRANSACTION"] = {}
-        context.user_data["STATE"] = UserState.GET_TOTAL
+        conversation["TRANSACTION"] = {}
+        conversation["STATE"] = UserState.GET_TOTAL
         await update.message.reply_text(
             "🆕 New transaction\n💲 Total:",
             reply_markup=ReplyKeyboardRemove(),
@@ -100,8 +182,8 @@ async def _handler_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             await update.message.reply_text("Not a number. Total:", quote=True)
             return
         total = float(total_text)
-        context.user_data["TRANSACTION"]["total"] = total
-        context.user_data["STATE"] = UserState.GET_TITLE
+        conversation["TRANSACTION"]["total"] = total
+        conversation["STATE"] = UserState.GET_TITLE
         await update.message.reply_text(f"Total: {total}\n✏️ Title:", quote=True)
         return
 
@@ -109,16 +191,12 @@ async def _handler_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         title_text = update.message.text
         assert title_text
         title = title_text
-        context.user_data["TRANSACTION"]["title"] = title
-        context.user_data["STATE"] = UserState.GET_CATEGORY
-
-        all_categories = [c.displayname for c in app_config.expenses.categories]
-        # Add a suggested category as first option, based on title
-        suggested_category = get_suggested_category(title, app_config.expenses.categories)
-        if suggested_category:
-            all_categories.insert(0, suggested_category.displayname)
+        conversation["TRANSACTION"]["title"] = title
+        conversation["STATE"] = UserState.GET_CATEGORY
 
-        categories_keyboard = make_keyboard(all_categories, 3, "Category")
+        # Add the suggested categories as first options, based on title
+        suggested_categories = config.category_matcher.suggest(title, limit=3)
+        categories_keyboard = catalog.suggested_categories_keyboard(suggested_categories)
         await update.message.reply_text(
             f"Title: {title}\n🏷 Category:", reply_markup=categories_keyboard, quote=True
         )
@@ -127,25 +205,19 @@ async def _handler_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if current_state == UserState.GET_CATEGORY:
         category_text = update.message.text
         assert category_text
-        category: models.ExpenseCategory = find_in_list(
-            category_text, app_config.expenses.categories, "displayname"
-        )
+        category = catalog.category_by_displayname.get(category_text)
         if not category:
-            categories_keyboard = make_keyboard(
-                [c.displayname for c in app_config.expenses.categories], 3, "Category"
-            )
             await update.message.reply_text(
                 "Not a valid category. Category:",
-                reply_markup=categories_keyboard,
+                reply_markup=catalog.categories_keyboard,
                 quote=True,
             )
             return
-        context.user_data["TRANSACTION"]["category"] = category
-        context.user_data["STATE"] = UserState.GET_PAID_BY
-        paid_by_keyboard = make_keyboard([u.displayname for u in app_config.expenses.users], 1, "Paid by")
+        conversation["TRANSACTION"]["category"] = category
+        conversation["STATE"] = UserState.GET_PAID_BY
         await update.message.reply_text(
             f"Category: {category.displayname}\n👤 Paid by:",
-            reply_markup=paid_by_keyboard,
+            reply_markup=catalog.paid_by_keyboard,
             quote=True,
         )
         return
@@ -153,23 +225,19 @@ async def _handler_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if current_state == UserState.GET_PAID_BY:
         paid_by_text = update.message.text
         assert paid_by_text
-        paid_by: models.ExpenseUser = find_in_list(paid_by_text, app_config.expenses.users, "displayname")
+        paid_by = catalog.user_by_displayname.get(paid_by_text)
         if not paid_by:
-            paid_by_keyboard = make_keyboard([u.displayname for u in app_config.expenses.users], 1, "Paid by")
             await update.message.reply_text(
                 "Not a valid paid by. Paid by:",
-                reply_markup=paid_by_keyboard,
+                reply_markup=catalog.paid_by_keyboard,
                 quote=True,
             )
             return
-        context.user_data["TRANSACTION"]["paid_by"] = paid_by
-        context.user_data["STATE"] = UserState.GET_SPLIT_TYPE
-        split_type_keybaord = make_keyboard(
-            [s.name for s in app_config.expenses.split_types], 1, "Split Type"
-        )
+        conversation["TRANSACTION"]["paid_by"] = paid_by
+        conversation["STATE"] = UserState.GET_SPLIT_TYPE
         await update.message.reply_text(
             f"Paid by: {paid_by.displayname}\n🔀 Split type:",
-            reply_markup=split_type_keybaord,
+            reply_markup=catalog.split_type_keyboard,
             quote=True,
         )
         return
@@ -177,52 +245,235 @@ async def _handler_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if current_state == UserState.GET_SPLIT_TYPE:
         split_type_text = update.message.text
         assert split_type_text
-        split_type: models.ExpenseSplitType = find_in_list(
-            split_type_text, app_config.expenses.split_types, "name"
-        )
+        split_type = catalog.split_type_by_name.get(split_type_text)
         if not split_type:
-            split_type_keybaord = make_keyboard(
-                [s.name for s in app_config.expenses.split_types], 1, "Split Type"
-            )
             await update.message.reply_text(
                 "Not a valid split type. Split type:",
-                reply_markup=split_type_keybaord,
+                reply_markup=catalog.split_type_keyboard,
                 quote=True,
             )
             return
-        context.user_data["TRANSACTION"]["split_type"] = split_type
+        conversation["TRANSACTION"]["split_type"] = split_type
         all_done = await update.message.reply_text(
             f"Split type: {split_type.name}\n⭐️ All done!",
             reply_markup=ReplyKeyboardRemove(),
             quote=True,
         )
 
-        transaction_dict = context.user_data["TRANSACTION"]
+        transaction_dict = conversation["TRANSACTION"]
         transaction_dict["date"] = datetime.now()
-        transaction = models.Transaction(**context.user_data["TRANSACTION"])
+        transaction = models.Transaction(**conversation["TRANSACTION"])
 
-        gsheet: GSheet = context.bot_data["gsheet"]
-        try:
-            user_in_debt, amount_to_repay = gsheet.insert_transaction(transaction, app_config)
-            context.user_data["STATE"] = UserState.END
-            await update.message.reply_text(
-                f"✅ Saved to cloud.\n\nUser in debt: {user_in_debt}\nAmount to repay: {amount_to_repay}\n\nUse /add to add more\n\n🆕 Try /aiadd",
-                reply_to_message_id=all_done.message_id,
+        await _save_transaction(update, context, transaction, reply_to_message_id=all_done.message_id)
+        return
+
+    if current_state == UserState.REVIEW_CATEGORY:
+        category_text = update.message.text
+        assert category_text
+        imported = conversation["IMPORT"]
+        if category_text != SKIP:
+            category = catalog.category_by_displayname.get(category_text)
+            if not category:
+                await update.message.reply_text(
+                    "Not a valid category. Category:",
+                    reply_markup=catalog.review_keyboard,
+                    quote=True,
+                )
+                return
+            item = imported["review"][0]
+            transaction = models.Transaction(
+                date=datetime.fromisoformat(item["date"]),
+                total=item["total"],
+                title=item["title"],
+                category=category,
+                paid_by=catalog.user_by_id[imported["paid_by"]],
+                split_type=catalog.split_type_by_name[imported["split_type"]],
             )
-        except Exception as e:
-            logging.error(e)
-            await update.message.reply_text(
-                f"❌ Error saving to cloud.\n\n{str(e)}\n\nUse /add to try again.",
-                reply_to_message_id=all_done.message_id,
+            synced = ledger.writer.put(transaction)
+            _follow_up_sync(update, context, synced, update.message.message_id, report_success=False)
+        imported["review"].pop(0)
+        await _ask_review(update, context)
+        return
+
+
+async def _save_transaction(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    transaction: models.Transaction,
+    reply_to_message_id: t.Optional[int] = None,
+) -> None:
+    await _save_transactions(update, context, [transaction], reply_to_message_id)
+
+
+async def _save_transactions(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    transactions: t.List[models.Transaction],
+    reply_to_message_id: t.Optional[int] = None,
+) -> None:
+    # Committed to the local ledger right away, the sheet is synced in background: answer now
+    # and follow up once the sync is done. Transactions put together are written in one batch
+    ledger = _get_ledger(update, context)
+    synced = asyncio.gather(*ledger.writer.put_many(transactions))
+    _conversation(update, context)["STATE"] = UserState.END
+    saved_text = "✅ Saved." if len(transactions) == 1 else f"✅ Saved {len(transactions)} transactions."
+    saved = await update.message.reply_text(
+        f"{saved_text}\n\n{_format_debtor(ledger)}\n\nUse /add to add more\n\n🆕 Try /aiadd",
+        reply_to_message_id=reply_to_message_id,
+        quote=True,
+    )
+    _follow_up_sync(update, context, synced, saved.message_id)
+
+
+def _follow_up_sync(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    synced: asyncio.Future,
+    reply_to_message_id: int,
+    report_success: bool = True,
+) -> None:
+    # Not `application.create_task`: `Application.stop` waits for those, and while Sheets is down a
+    # sync can take longer than the stop timeout. These are cancelled on stop, the rows stay in the
+    # ledger and are synced on the next start
+    task = asyncio.create_task(_reply_when_synced(update, synced, reply_to_message_id, report_success))
+    sync_replies: t.Set[asyncio.Task] = context.bot_data["sync_replies"]
+    sync_replies.add(task)
+    task.add_done_callback(sync_replies.discard)
+
+
+async def _reply_when_synced(
+    update: Update, synced: asyncio.Future, reply_to_message_id: int, report_success: bool = True
+) -> None:
+    try:
+        await synced
+        if not report_success:
+            return
+        text = "☁️ Synced to cloud."
+    except Exception as e:
+        logging.error(e)
+        text = f"⚠️ Syncing to cloud failed.\n\n{_describe_error(e)}\n\nIt will be retried in background."
+    try:
+        await update.message.reply_text(text, reply_to_message_id=reply_to_message_id)
+    except TelegramError as e:
+        # Not an application task, the error handlers don't see it
+        logging.error(f"Could not reply about the sync: {e}")
+
+
+def _describe_error(e: Exception) -> str:
+    if is_quota_error(e):
+        return "Google Sheets is busy right now"
+    return str(e)
+
+
+def _format_debtor(ledger: ChatLedger) -> str:
+    if not ledger.balances.seeded:
+        return "Debt status not available yet, check /status later"
+    user_in_debt, amount_to_repay = ledger.balances.get_debtor()
+    return f"User in debt: {user_in_debt}\nAmount to repay: {amount_to_repay}"
+
+
+@restricted_by_chat_id
+async def _handler_import(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    document = update.message.document
+    ledger = _get_ledger(update, context)
+    config = ledger.config
+    # Who paid and how to split come from the caption, e.g. "paid by User1 50/50"
+    split_type, caption = config.parser.parse_split_type(update.message.caption or "")
+    paid_by, _ = config.parser.parse_paid_by(caption, update.message.from_user.full_name)
+    if split_type is None or paid_by is None:
+        await update.message.reply_text(
+            "Send the CSV again with a caption saying who paid and the split type, e.g. 'paid by User1 50/50'",
+            quote=True,
+        )
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "import.csv"
+        file = await document.get_file()
+        await file.download_to_drive(path)
+        try:
+            result = await asyncio.to_thread(
+                _import_csv_file, path, config.category_matcher, paid_by, split_type
             )
+        except (ValueError, UnicodeDecodeError) as e:
+            await update.message.reply_text(f"❌ Cannot import {document.file_name}.\n\n{str(e)}", quote=True)
+            return
+
+    conversation = _conversation(update, context)
+    conversation.clear()
+    conversation["STATE"] = UserState.END
+    message_parts = [f"📥 Imported {len(result.transactions)} transactions from {document.file_name}"]
+    if result.skipped:
+        skipped = [f"Line {line}: {reason}" for line, reason in result.skipped[:10]]
+        message_parts.append("\n".join([f"⚠️ Skipped {len(result.skipped)} rows", *skipped]))
+    if result.review:
+        message_parts.append(f"🔎 {len(result.review)} rows need a category")
+    imported = await update.message.reply_text("\n\n".join(message_parts), quote=True)
+
+    if result.transactions:
+        # All committed to the ledger together, the writer syncs them to the sheet in one batch
+        synced = asyncio.gather(*ledger.writer.put_many(result.transactions))
+        _follow_up_sync(update, context, synced, imported.message_id)
+    if result.review:
+        conversation["IMPORT"] = {
+            "paid_by": paid_by.id,
+            "split_type": split_type.name,
+            "review": result.review,
+        }
+        conversation["STATE"] = UserState.REVIEW_CATEGORY
+    await _ask_review(update, context)
+    return
+
+
+def _import_csv_file(path: Path, *args) -> ImportResult:
+    with open(path, encoding="utf-8-sig", newline="") as lines:
+        return import_csv(lines, *args)
+
+
+async def _ask_review(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    conversation = _conversation(update, context)
+    if conversation.get("STATE") != UserState.REVIEW_CATEGORY:
         return
+    review = conversation["IMPORT"]["review"]
+    if not review:
+        conversation["STATE"] = UserState.END
+        await update.message.reply_text(
+            f"⭐️ Review done!\n\n{_format_debtor(_get_ledger(update, context))}",
+            reply_markup=ReplyKeyboardRemove(),
+            quote=True,
+        )
+        return
+    catalog = _get_ledger(update, context).config.catalog
+    item = review[0]
+    date = datetime.fromisoformat(item["date"]).strftime("%Y-%m-%d")
+    await update.message.reply_text(
+        f"🔎 To review ({len(review)} left)\n{date} - {item['title']} - {item['total']}\n🏷 Category:",
+        reply_markup=catalog.review_keyboard,
+        quote=True,
+    )
 
 
 @restricted_by_chat_id
 async def _handler_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    app_config: AppConfig = context.bot_data["app_config"]
-    gsheet: GSheet = context.bot_data["gsheet"]
-    user_in_debt, amount_to_repay = gsheet.get_debtor(app_config)
+    ledger = _get_ledger(update, context)
+    if ledger.balances.seeded:
+        user_in_debt, amount_to_repay = ledger.balances.get_debtor()
+    elif not ledger.gsheet.is_open:
+        # Still connecting, don't keep the user waiting for it
+        await update.message.reply_text("⏳ Loading the spreadsheet, try again in a few seconds", quote=True)
+        return
+    else:
+        # Still loading the transactions, fall back to the summary computed by the sheet
+        try:
+            user_in_debt, amount_to_repay = await ledger.gsheet.run(
+                READ, ledger.gsheet.get_debtor, ledger.app_config
+            )
+        except Exception as e:
+            logging.error(e)
+            await update.message.reply_text(
+                f"⚠️ Cannot read the spreadsheet.\n\n{_describe_error(e)}\n\nTry again later.", quote=True
+            )
+            return
     await update.message.reply_text(
         f"\n\nUser in debt: {user_in_debt}\nAmount to repay: {amount_to_repay}",
         quote=True,
@@ -231,130 +482,390 @@ async def _handler_status(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
 @restricted_by_chat_id
-async def _handler_aiadd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    context.user_data.clear()
-    context.user_data["STATE"] = UserState.START
-    user_text = update.message.text
-    assert user_text
-    user_text = user_text.replace("/aiadd", "").strip()
-    if not len(user_text):
-        await update.message.reply_text("Please provide a description of the transaction", quote=True)
+async def _handler_settle(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    ledger = _get_ledger(update, context)
+    if not ledger.balances.seeded:
+        await update.message.reply_text("Debts not available yet, try again later", quote=True)
         return
-
-    # The following will generate a dynamic Pydantic model based on app_config, so we can give it to OpenAI to parse the response
-    app_config: AppConfig = context.bot_data["app_config"]
-    category_enum = StrEnum("Category", {c.name: c.name for c in app_config.expenses.categories})
-    user_enum = StrEnum("User", {u.name: u.name for u in app_config.expenses.users})
-    split_type_enum = StrEnum("SplitType", {s.name: s.name for s in app_config.expenses.split_types})
-    transaction_model = create_model(
-        "Transaction",
-        total=(float, Field(..., description="Total amount of the transaction. Must be greater than 0")),
-        title=(
-            str,
-            Field(..., description="Title of the transaction, usually a description of what was bought"),
-        ),
-        category=(
-            category_enum,
-            Field(..., description="Category of the transaction. Guess based on the title"),
-        ),
-        paid_by=(user_enum, Field(..., description="User who paid the transaction")),
-        split_type=(
-            split_type_enum,
-            Field(
-                description="How the transaction should be split between the users",
-                default=app_config.expenses.split_types[0].name,
-            ),
-        ),
-    )
-    response_model = create_model(
-        "Response",
-        error=(
-            t.Optional[str],
-            Field(
-                ...,
-                description="Human readable message in case the transaction could not be completely parsed",
-            ),
-        ),
-        missing_fields=(
-            t.Optional[t.List[str]],
-            Field(
-                ..., description="Transaction fields that could not be found or guessed from the user input"
-            ),
-        ),
-        transaction=(
-            t.Optional[transaction_model],
-            Field(
-                ...,
-                description="Transaction as parsed from the user input. If all fields could not be parsed or guessed correctly, this will be null",
-            ),
-        ),
-    )
-    messages = [
-        {"role": "system", "content": "Extract the information about this transaction"},
-        {"role": "user", "content": f"Transaction was paid by: {update.message.from_user.full_name}"},
-        {"role": "user", "content": f"Transaction description: {user_text}"},
+    transfers = ledger.balances.settle()
+    if not transfers:
+        await update.message.reply_text("🤝 All settled up", quote=True)
+        return
+    # Users removed from the config can still have debts, they are shown by id
+    names = {user_id: user.displayname for user_id, user in ledger.config.catalog.user_by_id.items()}
+    lines = [
+        f"{names.get(transfer.from_user, transfer.from_user)} ➡️ {names.get(transfer.to_user, transfer.to_user)}: {transfer.amount}"
+        for transfer in transfers
     ]
+    await update.message.reply_text("\n".join(["💸 To settle up:", *lines]), quote=True)
+    return
 
-    openai: OpenAI = context.bot_data["openai"]
-    completion = openai.beta.chat.completions.parse(
-        model=app_config.openai.model,
-        messages=messages,
-        response_format=response_model,
-    )
-    response_model = completion.choices[0].message.parsed
-    if response_model.error:
-        await update.message.reply_text(
-            f"{response_model.error}\n{response_model.missing_fields}", quote=True
-        )
-        return
 
-    transaction = models.Transaction(
-        total=response_model.transaction.total,
-        title=response_model.transaction.title,
-        category=find_in_list(
-            response_model.transaction.category.value, app_config.expenses.categories, "name"
-        ),
-        paid_by=find_in_list(response_model.transaction.paid_by.value, app_config.expenses.users, "name"),
-        split_type=find_in_list(
-            response_model.transaction.split_type.value, app_config.expenses.split_types, "name"
-        ),
-        date=datetime.now(),
-    )
-    await update.message.reply_text(f"Transaction extracted by AI:\n\n{transaction}", quote=True)
+async def _job_flush_conversations(context: ContextTypes.DEFAULT_TYPE) -> None:
+    conversations: ConversationStore = context.bot_data["conversations"]
+    conversations.flush()
 
-    gsheet: GSheet = context.bot_data["gsheet"]
-    try:
-        user_in_debt, amount_to_repay = gsheet.insert_transaction(transaction, app_config)
-        context.user_data["STATE"] = UserState.END
-        await update.message.reply_text(
-            f"✅ Saved to cloud.\n\nUser in debt: {user_in_debt}\nAmount to repay: {amount_to_repay}\n\nUse /add to add more\n\n🆕 Try /aiadd",
-            quote=True,
-        )
-    except Exception as e:
-        logging.error(e)
-        await update.message.reply_text(
-            f"❌ Error saving to cloud.\n\n{str(e)}\n\nUse /add to try again.", quote=True
+
+async def _job_check_balances(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Compare the local balances with the summary computed by the sheet formulas"""
+    ledgers: LedgerRegistry = context.bot_data["ledgers"]
+    for ledger in ledgers.open_ledgers:
+        if not ledger.balances.seeded or ledger.writer.pending:
+            continue  # The sheet is expected to lag behind
+        sheet_user_in_debt, sheet_amount_to_repay = await ledger.gsheet.run(
+            READ, ledger.gsheet.get_debtor, ledger.app_config
         )
-    return
+        user_in_debt, amount_to_repay = ledger.balances.get_debtor()
+        try:
+            sheet_amount_to_repay = float(str(sheet_amount_to_repay).replace(",", "."))
+        except ValueError:
+            logging.warning(
+                f"Cannot check balances of {ledger.key}, unexpected amount in sheet: {sheet_amount_to_repay}"
+            )
+            continue
+        if amount_to_repay and (
+            sheet_user_in_debt != user_in_debt or abs(sheet_amount_to_repay - amount_to_repay) > 0.01
+        ):
+            logging.warning(
+                f"Balances of {ledger.key} out of sync with the sheet: {user_in_debt} {amount_to_repay} (local) vs {sheet_user_in_debt} {sheet_amount_to_repay} (sheet)"
+            )
 
 
-def make_app(app_config: AppConfig, gsheet: GSheet, openai: OpenAI):
-    async def _post_init(application):
+async def _job_add_recurring_expenses(context: ContextTypes.DEFAULT_TYPE) -> None:
+    app_config: AppConfig = context.bot_data["app_config"]
+    ledgers: LedgerRegistry = context.bot_data["ledgers"]
+    keys = dict.fromkeys(app_config.ledger_key(chat_id) for chat_id in app_config.telegram_bot.allowed_chats)
+    today = datetime.now().date()
+    for key in keys:
+        ledger_config = app_config.for_ledger(key)
+        # Idle ledgers are opened (and their sheet loaded) only when something is due
+        if (
+            ledger_config.expenses.recurring
+            and recurring.due_transactions(ledger_config, Ledger(ledgers.db, key), today)[0]
+        ):
+            recurring.add_due(ledgers.get_by_key(key), today)
+
+
+async def _job_log_metrics(context: ContextTypes.DEFAULT_TYPE) -> None:
+    logging.info(f"Metrics:\n{metrics.summary()}")
+
+
+async def _job_reload_config(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Apply the changes of the config file without a restart"""
+    watcher: ConfigWatcher = context.bot_data["config_watcher"]
+    ledgers: LedgerRegistry = context.bot_data["ledgers"]
+    app_config = await asyncio.to_thread(watcher.check)
+    if app_config is None:
+        return
+    # Everything derived from the config is rebuilt off the event loop...
+    snapshots = await asyncio.to_thread(ledgers.prepare_reload, app_config, ledgers.open_ledgers)
+    old_config: AppConfig = context.bot_data["app_config"]
+    for section in restart_required(old_config, app_config):
+        logging.warning(f"The {section} settings changed, restart to apply them")
+    # ...and swapped in all at once, nothing else runs in between
+    if app_config.openai.api_key != old_config.openai.api_key:
+        context.bot_data["openai"] = None  # Created again on first use
+    context.bot_data["app_config"] = app_config
+    ledgers.reload(app_config, snapshots)
+    logging.info(f"Config reloaded from {watcher.config_file}")
+
+
+async def _warm_up(application) -> None:
+    """Set up in background what the first messages are going to need, without delaying them"""
+    app_config: AppConfig = application.bot_data["app_config"]
+    start = time.perf_counter()
+    try:
         await application.bot.set_my_commands(
             [
                 ("add", "Add a new transaction (or start over)"),
                 ("aiadd", "Add a new transaction (AI)"),
                 ("status", "Debt status"),
+                ("settle", "How to settle all the debts"),
+                ("history", "Latest transactions"),
+                ("stats", "Expense stats"),
+                ("export", "Export the transactions"),
                 ("start", "Starts the bot"),
                 ("help", "Get help"),
             ]
         )
+    except Exception as e:
+        logging.warning(f"Cannot set the bot commands: {e}")
+
+    if app_config.telegram_bot.warm_up:
+        try:
+            await asyncio.to_thread(importlib.import_module, "gspread")
+            # Also needed for the schema of the responses, even if the client was given
+            await asyncio.to_thread(importlib.import_module, "openai")
+        except ImportError as e:
+            logging.error(f"Cannot warm up: {e}")
+        # Their writers load the sheets, failures are retried by the writers without affecting the bot
+        ledgers: LedgerRegistry = application.bot_data["ledgers"]
+        chat_ids = app_config.telegram_bot.allowed_chats
+        keys = list(dict.fromkeys(app_config.ledger_key(chat_id) for chat_id in chat_ids))
+        for key in keys[: ledgers.max_open]:
+            ledgers.get_by_key(key)
+    application.bot_data["warmed_up"] = True
+    logging.info(f"Warmed up in {time.perf_counter() - start:.2f}s, the sheets are loaded in background")
+
+
+def _is_ready(application) -> bool:
+    ledgers: LedgerRegistry = application.bot_data["ledgers"]
+    return application.bot_data["warmed_up"] and all(ledger.writer.seeded for ledger in ledgers.open_ledgers)
+
+
+async def _job_open_unsynced_ledgers(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Open the ledgers with transactions not in their sheet yet, so they get synced even if idle"""
+    ledgers: LedgerRegistry = context.bot_data["ledgers"]
+    for key in unsynced_ledgers(ledgers.db):
+        ledgers.get_by_key(key)
+
+
+def _stats_group_name(catalog: Catalog, by: str, group: str) -> str:
+    if by == "category" and group in catalog.category_by_name:
+        return catalog.category_by_name[group].displayname
+    if by == "paid_by" and group in catalog.user_by_id:
+        return catalog.user_by_id[group].displayname
+    return group
+
+
+@restricted_by_chat_id
+async def _handler_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    ledger = _get_ledger(update, context)
+    stats = ledger.stats
+    if not stats.seeded:
+        await update.message.reply_text("Stats not available yet, try again later", quote=True)
+        return
+    # /stats (this month), /stats all, /stats YYYY-MM, /stats YYYY-MM YYYY-MM
+    args = context.args or []
+    if args == ["all"]:
+        since, until = None, None
+    elif len(args) <= 2 and all(re.fullmatch(r"\d{4}-\d{2}", arg) for arg in args):
+        since = args[0] if args else datetime.now().strftime("%Y-%m")
+        until = args[-1] if args else since
+    else:
+        await update.message.reply_text("Usage: /stats [all | YYYY-MM [YYYY-MM]]", quote=True)
+        return
+
+    catalog = ledger.config.catalog
+    titles = {
+        "month": "📅 Month",
+        "category": "🏷 Category",
+        "paid_by": "👤 Paid by",
+        "split_type": "🔀 Split type",
+    }
+    by_month = stats.query("month", since, until)
+    if not by_month:
+        await update.message.reply_text("No transactions in this period", quote=True)
+        return
+    total = round(sum(total for total, _ in by_month.values()), 2)
+    count = sum(count for _, count in by_month.values())
+    period = "All time" if since is None else since if since == until else f"{since} - {until}"
+    message_parts = [f"📊 {period}: {total} ({count} transactions)"]
+    for by in DIMENSIONS:
+        groups = by_month if by == "month" else stats.query(by, since, until)
+        if by == "month" and len(groups) < 2:
+            continue
+        ordered = sorted(groups.items()) if by == "month" else sorted(groups.items(), key=lambda g: -g[1][0])
+        lines = [
+            f"{_stats_group_name(catalog, by, group)}: {group_total} ({group_count})"
+            for group, (group_total, group_count) in ordered
+        ]
+        message_parts.append("\n".join([titles[by], *lines]))
+    await update.message.reply_text("\n\n".join(message_parts), quote=True)
+    return
+
+
+@restricted_by_chat_id
+async def _handler_export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    ledger = _get_ledger(update, context)
+    catalog = ledger.config.catalog
+    # /export, /export 2025-01 2025-03 Groceries, /export compact, ...
+    args = list(context.args or [])
+    compact = "compact" in args
+    args = [arg for arg in args if arg != "compact"]
+    months = list(itertools.takewhile(lambda arg: re.fullmatch(r"\d{4}-\d{2}", arg), args))[:2]
+    category_text = " ".join(args[len(months) :])
+    category = None
+    if category_text:
+        category = next((c for c in catalog.category_by_name if c.lower() == category_text.lower()), None)
+        if category is None:
+            await update.message.reply_text(
+                f"Unknown category {category_text}. Usage: {EXPORT_USAGE}\n\nCategories: {', '.join(catalog.category_by_name)}",
+                quote=True,
+            )
+            return
+    export_filter = ExportFilter(
+        since=months[0] if months else None, until=months[-1] if months else None, category=category
+    )
+
+    exporting = await update.message.reply_text("⏳ Exporting...", quote=True)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        name = "_".join(["transactions", *months, *([category] if category else [])]).replace(" ", "_")
+        try:
+            # Read in ranges: new rows inserted at the top meanwhile would shift them
+            async with ledger.writer.paused():
+                path, count = await ledger.gsheet.run(
+                    READ, export_transactions, ledger.gsheet, Path(tmp_dir), name, export_filter, compact
+                )
+        except Exception as e:
+            logging.error(e)
+            await exporting.edit_text(
+                f"⚠️ Cannot read the spreadsheet.\n\n{_describe_error(e)}\n\nTry again later."
+            )
+            return
+        if not count:
+            await exporting.edit_text("No transactions to export")
+            return
+        if path.stat().st_size > MAX_DOCUMENT_SIZE:
+            await exporting.edit_text("Too large to send, use /export compact or narrow down the period")
+            return
+        caption = f"📤 {count} transactions"
+        if ledger.writer.pending:
+            caption += f", {ledger.writer.pending} more are not in the spreadsheet yet"
+        document = await asyncio.to_thread(path.read_bytes)
+        await update.message.reply_document(document, filename=path.name, caption=caption, quote=True)
+    await exporting.delete()
+    return
+
+
+@restricted_by_chat_id
+async def _handler_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    ledger = _get_ledger(update, context)
+    transactions = ledger.ledger.recent(10)
+    if not transactions:
+        await update.message.reply_text("No transactions yet", quote=True)
+        return
+    lines = [f"{'' if synced else '⏳ '}{transaction}" for transaction, synced in transactions]
+    await update.message.reply_text("\n\n".join(lines), quote=True)
+    return
+
+
+@restricted_by_chat_id
+async def _handler_aiadd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    conversation = _conversation(update, context)
+    conversation.clear()
+    conversation["STATE"] = UserState.START
+    user_text = update.message.text
+    assert user_text
+    user_text = user_text.replace("/aiadd", "").strip()
+    if not len(user_text):
+        await update.message.reply_text("Please provide a description of the transaction", quote=True)
+        return
+
+    # Simple messages are parsed locally, the LLM is only asked when something is missing or ambiguous
+    ledger = _get_ledger(update, context)
+    # The same config throughout, even if it is reloaded while waiting for the LLM
+    config = ledger.config
+    aiadd_paths: Counter = context.bot_data["aiadd_paths"]
+    transaction, missing = config.parser.parse(user_text, update.message.from_user.full_name)
+    if transaction is not None:
+        aiadd_paths["local"] += 1
+        logging.info(f"/aiadd parsed locally | paths so far: {dict(aiadd_paths)}")
+        await update.message.reply_text(f"Transaction extracted:\n\n{transaction}", quote=True)
+        await _save_transaction(update, context, transaction)
+        return
+
+    aiadd_paths["llm"] += 1
+    logging.info(f"/aiadd asking the LLM, missing locally: {missing} | paths so far: {dict(aiadd_paths)}")
+    # All the transactions of the message in one completion, each one validated on its own
+    extraction = await config.ai.extract(_get_openai(context), update.message.from_user.full_name, user_text)
+    if not extraction.items:
+        await update.message.reply_text(f"❌ {extraction.error}", quote=True)
+        return
+
+    catalog = config.catalog
+    transactions, failed = [], []
+    for item in extraction.items:
+        if item.transaction is None:
+            failed.append(f"• {item.text}: {item.error}")
+            continue
+        transactions.append(
+            models.Transaction(
+                total=item.transaction.total,
+                title=item.transaction.title,
+                category=catalog.category_by_name[item.transaction.category.value],
+                paid_by=catalog.user_by_name[item.transaction.paid_by.value],
+                split_type=catalog.split_type_by_name[item.transaction.split_type.value],
+                date=datetime.now(),
+            )
+        )
+    logging.info(f"/aiadd extracted {len(transactions)} transactions, {len(failed)} failed")
+
+    message_parts = []
+    if len(transactions) == 1:
+        message_parts.append(f"Transaction extracted by AI:\n\n{transactions[0]}")
+    elif transactions:
+        extracted = "\n\n".join(f"{n}. {transaction}" for n, transaction in enumerate(transactions, start=1))
+        message_parts.append(f"{len(transactions)} transactions extracted by AI:\n\n{extracted}")
+    if failed:
+        message_parts.append("\n".join(["⚠️ Not saved, add them again with /add or /aiadd:", *failed]))
+    await update.message.reply_text("\n\n".join(message_parts), quote=True)
+
+    if transactions:
+        await _save_transactions(update, context, transactions)
+    return
 
-    app = ApplicationBuilder().token(app_config.telegram_bot.token).post_init(_post_init).build()
+
+def make_app(
+    app_config: AppConfig,
+    db: sqlite3.Connection,
+    openai: t.Optional["AsyncOpenAI"] = None,
+    request: t.Optional[BaseRequest] = None,
+    started_at: t.Optional[float] = None,
+    config_file: t.Optional[Path] = None,
+):
+    """Build the bot. Nothing is connected here: the OpenAI client (unless given) and the spreadsheets
+    are set up on first use, or in background right after startup if `telegram_bot.warm_up` is set.
+    `started_at` is the `time.perf_counter()` the time to the first response is measured from.
+    `config_file`, the file `app_config` was loaded from, is reloaded when it changes."""
+
+    async def _post_init(application):
+        # Nothing that can be slow or fail here, so polling starts right away: the rest is done in background
+        application.bot_data["warm_up"] = asyncio.create_task(_warm_up(application))
+
+        # Sync what was left behind by a previous run
+        for key in unsynced_ledgers(db):
+            application.bot_data["ledgers"].get_by_key(key)
+
+        metrics_config = app_config.metrics
+        if metrics_config.port is not None:
+            application.bot_data["metrics_server"] = await metrics.start_server(
+                metrics_config.listen, metrics_config.port
+            )
+
+    async def _post_stop(application):
+        application.bot_data["warm_up"].cancel()
+        for task in list(application.bot_data["sync_replies"]):
+            task.cancel()
+        # Local and quick, before waiting for the writes in flight to the sheets
+        application.bot_data["conversations"].flush()
+        metrics_server = application.bot_data.pop("metrics_server", None)
+        if metrics_server is not None:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+        await application.bot_data["ledgers"].close()
+        db.close()
+
+    builder = (
+        ApplicationBuilder()
+        .token(app_config.telegram_bot.token)
+        .post_init(_post_init)
+        .post_stop(_post_stop)
+        .concurrent_updates(PerConversationUpdateProcessor(app_config.telegram_bot.max_concurrent_updates))
+    )
+    if request is not None:
+        # Talk to something else than the Bot API, e.g. the fakes used by the benchmarks
+        builder = builder.request(request).get_updates_request(request)
+    app = builder.build()
     app.bot_data = {
         "app_config": app_config,
-        "gsheet": gsheet,
         "openai": openai,
+        "started_at": started_at if started_at is not None else time.perf_counter(),
+        "warmed_up": False,
+        "aiadd_paths": Counter(),
+        "sync_replies": set(),
+        "ledgers": LedgerRegistry(app_config, db),
+        "conversations": ConversationStore(db),
     }
     app.add_handler(CommandHandler("start", _handler_start))
     app.add_handler(CommandHandler("help", _handler_start))
@@ -362,5 +873,24 @@ def make_app(app_config: AppConfig, gsheet: GSheet, openai: OpenAI):
     app.add_handler(CommandHandler("add", _handler_new))
     app.add_handler(CommandHandler("aiadd", _handler_aiadd))
     app.add_handler(CommandHandler("status", _handler_status))
+    app.add_handler(CommandHandler("settle", _handler_settle))
+    app.add_handler(CommandHandler("history", _handler_history))
+    app.add_handler(CommandHandler("stats", _handler_stats))
+    app.add_handler(CommandHandler("export", _handler_export))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, _handler_text))
+    app.add_handler(MessageHandler(filters.Document.FileExtension("csv"), _handler_import))
+    app.job_queue.run_repeating(_job_flush_conversations, interval=5)
+    app.job_queue.run_repeating(_job_check_balances, interval=3600, first=600)
+    app.job_queue.run_repeating(_job_open_unsynced_ledgers, interval=300)
+    # Soon after startup too, to catch up with what was due while the bot was down
+    app.job_queue.run_repeating(_job_add_recurring_expenses, interval=3600, first=10)
+    if app_config.metrics.log_interval:
+        app.job_queue.run_repeating(_job_log_metrics, interval=app_config.metrics.log_interval)
+    if config_file is not None and app_config.telegram_bot.reload_interval:
+        app.bot_data["config_watcher"] = ConfigWatcher(config_file)
+        app.job_queue.run_repeating(_job_reload_config, interval=app_config.telegram_bot.reload_interval)
+    metrics.UPDATES_QUEUED.set_function(app.update_queue.qsize)
+    metrics.READY.set_function(lambda: int(_is_ready(app)))
+    metrics.SHEETS_QUEUED.set_function(lambda: app.bot_data["ledgers"].clients.waiting)
+    metrics.UNSYNCED.set_function(lambda: unsynced_count(db))
     return app
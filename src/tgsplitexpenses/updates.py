@@ -0,0 +1,55 @@
+import asyncio
+import typing
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# (chat id, user id)
+_Key = typing.Tuple[typing.Optional[int], typing.Optional[int]]
+
+
+class PerConversationUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently, but one at a time for each user in each chat.
+
+    Each user has a conversation state per chat, so updates of the same user in the same chat are
+    run in order, while different users and chats don't wait for each other.
+    """
+
+    def __init__(self, max_concurrent_updates: int) -> None:
+        super().__init__(max_concurrent_updates)
+        self._locks: typing.Dict[_Key, asyncio.Lock] = {}
+        self._queued: typing.Dict[_Key, int] = {}
+
+    @staticmethod
+    def _key(update: object) -> typing.Optional[_Key]:
+        if not isinstance(update, Update):
+            return None
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        user_id = update.effective_user.id if update.effective_user else None
+        if chat_id is None and user_id is None:
+            return None
+        return chat_id, user_id
+
+    async def do_process_update(self, update: object, coroutine: typing.Awaitable[typing.Any]) -> None:
+        key = self._key(update)
+        if key is None:
+            await coroutine
+            return
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._queued[key] = self._queued.get(key, 0) + 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            # Forget about conversations with nothing queued, so idle ones cost nothing
+            self._queued[key] -= 1
+            if not self._queued[key]:
+                del self._queued[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
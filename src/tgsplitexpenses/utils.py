@@ -1,6 +1,5 @@
 from telegram import KeyboardButton, ReplyKeyboardMarkup
 import pydantic
-from . import models
 
 
 def is_float(string: str):
@@ -25,18 +24,3 @@ def find_in_list(to_find: str, lst: list[pydantic.BaseModel], key: str):
         if getattr(elem, key) == to_find:
             return elem
     return None
-
-
-def get_suggested_category(
-    title: str, categories: list[models.ExpenseCategory]
-) -> models.ExpenseCategory | None:
-    keyword_to_category = {}
-    for cat in categories:
-        for kw in cat.keywords:
-            keyword_to_category[kw.lower()] = cat
-    suggested_category = None
-    for word in title.lower().split(" "):
-        if word in keyword_to_category:
-            suggested_category = keyword_to_category[word]
-            break
-    return suggested_category
@@ -0,0 +1,49 @@
+import logging
+from pathlib import Path
+import typing
+
+from .config import AppConfig, load_config
+
+
+class ConfigWatcher:
+    """Notices changes of the config file, by its modification time, and validates the new config.
+
+    `check` is blocking (it reads and validates the file): it is called from a worker thread.
+    """
+
+    def __init__(self, config_file: Path) -> None:
+        self.config_file = config_file
+        self._mtime = self._stat()
+
+    def _stat(self) -> typing.Optional[int]:
+        try:
+            return self.config_file.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def check(self) -> typing.Optional[AppConfig]:
+        """The new config if the file changed since the last check and is valid, otherwise None"""
+        mtime = self._stat()
+        if mtime is None or mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        try:
+            return load_config(self.config_file)
+        except Exception as e:
+            # E.g. saved halfway by an editor, it is checked again on the next change
+            logging.error(f"Not reloading {self.config_file}, the config is not valid: {e}")
+            return None
+
+
+def restart_required(old: AppConfig, new: AppConfig) -> typing.List[str]:
+    """Settings that changed but only apply after a restart: the bot, the local ledger and the metrics
+    are set up once. The allowed chats, the expenses and OpenAI apply right away. The spreadsheets
+    are checked ledger by ledger, see `LedgerRegistry.prepare_reload`."""
+    changed = []
+    telegram_bot = old.telegram_bot.model_copy(update={"allowed_chats": new.telegram_bot.allowed_chats})
+    if telegram_bot != new.telegram_bot:
+        changed.append("telegram_bot")
+    for section in ("ledger", "metrics"):
+        if getattr(old, section) != getattr(new, section):
+            changed.append(section)
+    return changed
@@ -0,0 +1,232 @@
+import asyncio
+import contextlib
+import logging
+import typing
+
+from .config import AppConfig
+from .gsheet import GSheet, PartialWriteError
+from . import metrics
+from .quota import READ, WRITE
+from .ledger import Ledger
+from .models import Transaction
+
+
+class View(typing.Protocol):
+    """In-memory state derived from all the transactions"""
+
+    def seed(self, transactions: typing.Iterable[Transaction]) -> None: ...
+
+    def apply(self, transaction: Transaction) -> None: ...
+
+
+class LedgerClosedError(Exception):
+    """The writer was stopped before syncing the transaction, it is synced when the ledger is opened again"""
+
+
+class TransactionWriter:
+    """Write-behind sync from the local ledger to GSheet.
+
+    Handlers put transactions, which are committed to the ledger right away, and get back a
+    future. The worker mirrors unsynced ledger rows to the sheet in batches (one sheet write
+    per flush) off the event loop, retrying with exponential backoff. Rows that still fail stay
+    unsynced in the ledger and are retried every `resync_interval` seconds, also across restarts.
+
+    Views are seeded by the worker with the sheet rows plus the unsynced ledger rows (never
+    while a flush is moving rows from one to the other) and then updated on every put.
+
+    Only one writer at a time syncs a ledger: a writer started while the previous one of the same
+    ledger is still stopping waits for it, then takes over its futures and its puts.
+    """
+
+    def __init__(
+        self,
+        gsheet: GSheet,
+        ledger: Ledger,
+        app_config: AppConfig,
+        max_batch_size: int = 500,
+        linger: float = 0.5,
+        max_retries: int = 5,
+        retry_delay: float = 1.0,
+        resync_interval: float = 60.0,
+    ) -> None:
+        self.gsheet = gsheet
+        self.ledger = ledger
+        self.app_config = app_config
+        self.max_batch_size = max_batch_size
+        self.linger = linger
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.resync_interval = resync_interval
+        self.views: typing.List[View] = []
+        # (user in debt, amount to repay) written to the summary cells after syncing, if set
+        self.summary: typing.Optional[typing.Callable[[], typing.Tuple[str, float]]] = None
+        self.seeded = False
+        self._waiters: typing.Dict[int, asyncio.Future] = {}
+        self._wakeup = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._successor: typing.Optional["TransactionWriter"] = None
+        self._task: typing.Optional[asyncio.Task] = None
+        self._seeding = False
+        self._syncing = asyncio.Lock()  # Held by a sync, or to pause syncing
+
+    def put(self, transaction: Transaction) -> asyncio.Future:
+        """Commit `transaction` to the ledger, the future resolves once it is in the sheet"""
+        return self.put_many([transaction])[0]
+
+    def put_many(
+        self, transactions: typing.List[Transaction], keys: typing.Optional[typing.List[str]] = None
+    ) -> typing.List[asyncio.Future]:
+        """Commit `transactions` to the ledger together, so they are written to the sheet in one batch.
+        One future per transaction added: the ones with an idempotency key already in the ledger are skipped."""
+        if self._successor is not None:
+            return self._successor.put_many(transactions, keys)
+        loop = asyncio.get_running_loop()
+        futures = []
+        for id_, transaction in zip(self.ledger.add_many(transactions, keys), transactions):
+            if id_ is None:
+                continue
+            future = loop.create_future()
+            if self._stopped.is_set():
+                future.set_exception(LedgerClosedError("Ledger closed, it is synced when opened again"))
+            else:
+                self._waiters[id_] = future
+            futures.append(future)
+            for view in self.views:
+                view.apply(transaction)
+        self._wakeup.set()
+        return futures
+
+    @property
+    def pending(self) -> int:
+        return self.ledger.count_unsynced()
+
+    def start(self, predecessor: typing.Optional["TransactionWriter"] = None) -> None:
+        """`predecessor` is the writer of the same ledger, if it is still stopping"""
+        if predecessor is not None:
+            predecessor._successor = self
+        self._wakeup.set()  # Pick up rows left unsynced by a previous run
+        self._task = asyncio.create_task(self._run(predecessor))
+
+    async def stop(self) -> None:
+        if self._task is None:
+            self._hand_over()
+            return
+        self._closing.set()
+        self._wakeup.set()
+        if self._seeding:
+            # Only reading, it can wait for the quota for a while: no need to wait for it
+            self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._hand_over()
+
+    def _hand_over(self) -> None:
+        """Pass the futures still waiting for a sync to the successor, or fail them"""
+        waiters, self._waiters = self._waiters, {}
+        if self._successor is not None:
+            self._successor._waiters.update(waiters)
+        else:
+            for future in waiters.values():
+                if not future.done():
+                    future.set_exception(LedgerClosedError("Ledger closed, it is synced when opened again"))
+        self._stopped.set()
+
+    async def _run(self, predecessor: typing.Optional["TransactionWriter"] = None) -> None:
+        if predecessor is not None:
+            await predecessor._stopped.wait()
+        while not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.resync_interval)
+                # Give bursts a chance to pile up, so they end up in the same write
+                await asyncio.sleep(self.linger)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self.seeded and not self._closing.is_set():
+                await self._seed()
+            await self._sync()
+
+    async def _seed(self) -> None:
+        try:
+            self._seeding = True
+            transactions = await self.gsheet.run(READ, self.gsheet.get_transactions, self.app_config)
+        except Exception as e:
+            logging.warning(f"Reading transactions from the sheet failed, will retry: {e}")
+            return
+        finally:
+            self._seeding = False
+        transactions.extend(transaction for _, transaction in self.ledger.unsynced())
+        for view in self.views:
+            view.seed(transactions)
+        self.seeded = True
+        logging.info(f"Seeded {len(self.views)} views with {len(transactions)} transactions")
+
+    @contextlib.asynccontextmanager
+    async def paused(self) -> typing.AsyncIterator[None]:
+        """No writes to the sheet meanwhile, once the one in progress is done: e.g. to read it in
+        several ranges, without new rows inserted at the top shifting them. Puts are synced afterwards"""
+        async with self._syncing:
+            yield
+
+    async def _sync(self) -> None:
+        async with self._syncing:
+            await self._sync_pending()
+
+    async def _sync_pending(self) -> None:
+        flushed = False
+        while pending := self.ledger.unsynced(self.max_batch_size):
+            if not await self._flush(pending):
+                return
+            flushed = True
+        if flushed and self.summary is not None and self.seeded:
+            try:
+                await self.gsheet.run(WRITE, self.gsheet.update_summary, *self.summary(), self.app_config)
+            except Exception as e:
+                logging.warning(f"Updating the summary failed, will retry on the next sync: {e}")
+
+    async def _flush(self, batch: typing.List[typing.Tuple[int, Transaction]]) -> bool:
+        ids = [id_ for id_, _ in batch]
+        transactions = [transaction for _, transaction in batch]
+        delay = self.retry_delay
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                await self.gsheet.run(WRITE, self.gsheet.insert_transactions, transactions, self.app_config)
+                break
+            except Exception as e:
+                if isinstance(e, PartialWriteError):
+                    # Don't write again the ones already in the sheet
+                    self.ledger.mark_synced(ids[: e.written])
+                    metrics.SYNCED.inc(amount=e.written)
+                    self._resolve(ids[: e.written])
+                    ids, transactions = ids[e.written :], transactions[e.written :]
+                logging.warning(f"Syncing {len(transactions)} transactions failed ({attempt}): {e}")
+                if attempt == self.max_retries:
+                    self._resolve(ids, exception=e)
+                    return False
+                try:
+                    await asyncio.wait_for(self._closing.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                if self._closing.is_set():
+                    # Stopping, not retrying: the rows stay unsynced for the next writer, see `_hand_over`
+                    return False
+                metrics.SHEETS_RETRIES.inc()
+                delay *= 2
+        self.ledger.mark_synced(ids)
+        metrics.SYNCED.inc(amount=len(ids))
+        self._resolve(ids)
+        return True
+
+    def _resolve(self, ids: typing.List[int], exception: typing.Optional[Exception] = None) -> None:
+        for id_ in ids:
+            future = self._waiters.pop(id_, None)
+            if future is None or future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(None)
@@ -0,0 +1,40 @@
+from datetime import datetime
+from pathlib import Path
+import typing
+
+import pytest
+
+from tgsplitexpenses.config import AppConfig, load_config
+from tgsplitexpenses.keywords import CategoryMatcher
+from tgsplitexpenses.models import Transaction
+
+CONFIG_FILE = Path(__file__).parent.parent / "config.example.yaml"
+
+
+@pytest.fixture
+def app_config() -> AppConfig:
+    return load_config(CONFIG_FILE)
+
+
+@pytest.fixture
+def category_matcher(app_config: AppConfig) -> CategoryMatcher:
+    return CategoryMatcher(app_config.expenses.categories)
+
+
+@pytest.fixture
+def make_transaction(app_config: AppConfig) -> typing.Callable[..., Transaction]:
+    expenses = app_config.expenses
+
+    def make_transaction(
+        total: float = 10.0, date: datetime = datetime(2025, 1, 1), paid_by: int = 0, split_type: int = 0
+    ) -> Transaction:
+        return Transaction(
+            date=date,
+            total=total,
+            title="test",
+            category=expenses.categories[0],
+            paid_by=expenses.users[paid_by],
+            split_type=expenses.split_types[split_type],
+        )
+
+    return make_transaction
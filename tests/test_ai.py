@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from tgsplitexpenses.ai import TransactionExtractor
+
+
+@pytest.fixture
+def extractor(app_config) -> TransactionExtractor:
+    return TransactionExtractor(app_config)
+
+
+def _item(text: str, **transaction) -> dict:
+    transaction = {"total": 10.0, "title": text, "category": "Groceries", "paid_by": "User1", **transaction}
+    return {"text": text, "error": None, "missing_fields": None, "transaction": transaction}
+
+
+def _validate(extractor, response) -> list:
+    extraction = extractor._validate(json.dumps(response))
+    return [(item.text, item.transaction is not None, item.error) for item in extraction.items]
+
+
+def test_valid_items(extractor):
+    extraction = extractor._validate(
+        json.dumps({"error": None, "transactions": [_item("fruit"), _item("rent", total=800.0)]})
+    )
+    assert extraction.error is None
+    assert [(item.text, item.transaction.total, item.error) for item in extraction.items] == [
+        ("fruit", 10.0, None),
+        ("rent", 800.0, None),
+    ]
+    assert extraction.items[0].transaction.split_type == "50 / 50"  # The default one
+
+
+def test_invalid_items_do_not_discard_the_others(extractor):
+    missing = {"text": "something", "error": "No amount", "missing_fields": ["total"], "transaction": None}
+    response = {
+        "error": None,
+        "transactions": [
+            _item("fruit"),
+            _item("free lunch", total=0.0),
+            _item("spaceship", category="Space"),
+            missing,
+            {"transaction": None},
+        ],
+    }
+    items = _validate(extractor, response)
+    assert items[:2] == [("fruit", True, None), ("free lunch", False, "Total must be greater than 0")]
+    assert items[2][:2] == ("spaceship", False) and items[2][2].startswith("Invalid transaction: ")
+    assert items[3] == ("something", False, "No amount (missing: total)")
+    assert items[4][:2] == ("Transaction 5", False) and items[4][2].startswith("Invalid transaction: ")
+
+
+@pytest.mark.parametrize(
+    "content, error",
+    [
+        (None, "Empty response"),
+        ("not json", "Unexpected response: not json"),
+        ("[]", "Unexpected response: []"),
+        (json.dumps({"error": None, "transactions": []}), "No transaction found"),
+        (json.dumps({"error": "Not an expense", "transactions": []}), "Not an expense"),
+    ],
+)
+def test_nothing_extracted(extractor, content, error):
+    assert extractor._validate(content) == ([], error)
+
+
+def test_response_error_is_kept_with_the_items(extractor):
+    extraction = extractor._validate(
+        json.dumps({"error": "Only one of two", "transactions": [_item("fruit")]})
+    )
+    assert extraction.error == "Only one of two"
+    assert len(extraction.items) == 1
@@ -0,0 +1,94 @@
+from pathlib import Path
+import sqlite3
+
+import pytest
+
+from tgsplitexpenses.catalog import Catalog
+from tgsplitexpenses.conversations import ConversationStore
+from tgsplitexpenses.ledger import connect
+
+
+@pytest.fixture
+def db() -> sqlite3.Connection:
+    return connect(Path(":memory:"))
+
+
+@pytest.fixture
+def catalog(app_config) -> Catalog:
+    return Catalog(app_config)
+
+
+def _conversation(app_config) -> dict:
+    expenses = app_config.expenses
+    return {
+        "STATE": "GET_SPLIT_TYPE",
+        "TRANSACTION": {
+            "total": 12.5,
+            "title": "Pizza",
+            "category": expenses.categories[0],
+            "paid_by": expenses.users[1],
+        },
+    }
+
+
+def _saved(db, key, user_data) -> None:
+    store = ConversationStore(db)
+    store.save(key, user_data)
+    store.flush()
+
+
+def _loaded(db, key, catalog) -> dict:
+    user_data: dict = {}
+    ConversationStore(db).load(key, user_data, catalog)  # As after a restart
+    return user_data
+
+
+def test_round_trip(app_config, db, catalog):
+    _saved(db, (1, 10), _conversation(app_config))
+    assert _loaded(db, (1, 10), catalog) == _conversation(app_config)
+
+
+def test_conversations_are_per_chat(app_config, db, catalog):
+    _saved(db, (1, 10), _conversation(app_config))
+    assert _loaded(db, (2, 10), catalog) == {}
+    assert _loaded(db, (1, 11), catalog) == {}
+
+
+def test_ended_conversations_are_deleted(app_config, db, catalog):
+    _saved(db, (1, 10), _conversation(app_config))
+    _saved(db, (1, 10), {"STATE": "END"})
+    assert _loaded(db, (1, 10), catalog) == {}
+
+
+def test_reference_missing_from_the_config_starts_over(app_config, db):
+    _saved(db, (1, 10), _conversation(app_config))
+    app_config.expenses.categories = app_config.expenses.categories[1:]
+    assert _loaded(db, (1, 10), Catalog(app_config)) == {}
+
+
+def test_loaded_once_and_never_over_a_live_conversation(app_config, db, catalog):
+    _saved(db, (1, 10), _conversation(app_config))
+    store = ConversationStore(db)
+    live = {"STATE": "GET_TOTAL"}
+    store.load((1, 10), live, catalog)
+    assert live == {"STATE": "GET_TOTAL"}
+    user_data: dict = {}
+    store.load((1, 10), user_data, catalog)
+    assert user_data == {}
+
+
+def test_saves_are_written_on_flush(app_config, db, catalog):
+    store = ConversationStore(db)
+    store.save((1, 10), _conversation(app_config))
+    assert _loaded(db, (1, 10), catalog) == {}
+    store.flush()
+    assert _loaded(db, (1, 10), catalog) == _conversation(app_config)
+
+
+def test_tables_of_conversations_per_user_are_dropped(app_config, db, catalog):
+    with db:
+        db.execute("CREATE TABLE conversations (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+        db.execute("INSERT INTO conversations VALUES (?, ?)", (10, '{"STATE": "GET_TOTAL"}'))
+    assert _loaded(db, (1, 10), catalog) == {}
+    _saved(db, (1, 10), _conversation(app_config))
+    assert _loaded(db, (1, 10), catalog) == _conversation(app_config)
@@ -0,0 +1,95 @@
+import csv
+import gzip
+from datetime import datetime
+import sys
+
+import pytest
+
+from tgsplitexpenses.export import ExportFilter, export_transactions
+from tgsplitexpenses.gsheet import GSheet
+
+from fakes import FakeSheets
+
+HEADER = ["Year", "Month", "Day", "Time", "Title", "Category", "Total", "Paid by", "Split type"] + [
+    f"{column} {user}" for column in ("Percentage", "Share", "Debt") for user in ("User1", "User2")
+]
+
+
+@pytest.fixture
+def sheets():
+    sheets = FakeSheets()
+    yield sheets
+    sheets.close()
+
+
+@pytest.fixture
+def gsheet(app_config, sheets, make_transaction) -> GSheet:
+    app_config.gsheet.partition = "year"
+    app_config.gsheet.requests_per_minute = 6000
+    gsheet = GSheet(app_config, sheets)
+    gsheet.transactions_worksheet.rows[0] = list(HEADER)
+    groceries = app_config.expenses.categories[1]
+    gsheet.insert_transactions(
+        [
+            make_transaction(1, datetime(2024, 11, 1)),
+            make_transaction(2, datetime(2024, 12, 1)).model_copy(update={"category": groceries}),
+            make_transaction(3, datetime(2025, 1, 1)),
+            make_transaction(4, datetime(2025, 1, 31)).model_copy(update={"category": groceries}),
+            make_transaction(5, datetime(2025, 2, 1)),
+        ],
+        app_config,
+    )
+    return gsheet
+
+
+def _export(gsheet, tmp_path, export_filter=ExportFilter(), **kwargs):
+    path, count = export_transactions(gsheet, tmp_path, "export", export_filter, **kwargs)
+    with open(path, newline="") as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == HEADER
+    assert count == len(rows) - 1
+    return path, sorted(float(row[6]) for row in rows[1:])
+
+
+def test_everything(gsheet, tmp_path):
+    path, totals = _export(gsheet, tmp_path)
+    assert path == tmp_path / "export.csv"
+    assert totals == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.parametrize(
+    "export_filter, totals",
+    [
+        (ExportFilter(since="2025-01"), [3, 4, 5]),
+        (ExportFilter(until="2024-12"), [1, 2]),
+        (ExportFilter(since="2024-12", until="2025-01"), [2, 3, 4]),
+        (ExportFilter(category="Groceries"), [2, 4]),
+        (ExportFilter(since="2025-01", category="Groceries"), [4]),
+        (ExportFilter(since="2026-01"), []),
+    ],
+)
+def test_filters(gsheet, tmp_path, export_filter, totals):
+    assert _export(gsheet, tmp_path, export_filter)[1] == totals
+
+
+def test_only_the_partitions_of_the_years_are_read(gsheet, sheets, tmp_path):
+    sheets.calls.clear()
+    assert _export(gsheet, tmp_path, ExportFilter(since="2025-01", until="2025-12"))[1] == [3, 4, 5]
+    assert sheets.calls["get"] == 2  # The transactions worksheet, empty, and "Expenses 2025"
+
+
+def test_read_in_chunks(gsheet, sheets, tmp_path):
+    sheets.calls.clear()
+    assert _export(gsheet, tmp_path, chunk_rows=2)[1] == [1, 2, 3, 4, 5]
+    # Empty transactions worksheet, then "Expenses 2024" (2 rows + an empty read) and "Expenses 2025" (3 rows)
+    assert sheets.calls["get"] == 1 + 2 + 2
+
+
+def test_compact_without_pyarrow(gsheet, tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    path, count = export_transactions(gsheet, tmp_path, "export", ExportFilter(), compact=True)
+    assert path == tmp_path / "export.csv.gz"
+    with gzip.open(path, "rt", newline="") as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == HEADER
+    assert count == len(rows) - 1 == 5
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+
+from tgsplitexpenses.gsheet import GSheet
+
+from fakes import FakeSheets, FakeWorksheet
+
+
+@pytest.fixture
+def sheets():
+    sheets = FakeSheets()
+    yield sheets
+    sheets.close()
+
+
+@pytest.fixture
+def gsheet(app_config, sheets) -> GSheet:
+    app_config.gsheet.partition = "rows"
+    app_config.gsheet.partition_rows = 3
+    app_config.gsheet.requests_per_minute = 6000
+    return GSheet(app_config, sheets)
+
+
+def _spreadsheet(sheets):
+    (spreadsheet,) = sheets.spreadsheets.values()
+    return spreadsheet
+
+
+def _runs(gsheet, transactions):
+    return [(title, len(run)) for title, run in gsheet._split_in_partitions(transactions)]
+
+
+def test_rows_fill_the_last_partition_then_roll_over(gsheet, make_transaction):
+    transactions = [make_transaction(n) for n in range(1, 8)]
+    assert _runs(gsheet, transactions) == [("Expenses", 3), ("Expenses 2", 3), ("Expenses 3", 1)]
+
+
+def test_rows_start_from_the_last_partition(gsheet, sheets, make_transaction):
+    gsheet._open()
+    spreadsheet = _spreadsheet(sheets)
+    spreadsheet.by_title["Expenses 2"] = FakeWorksheet(sheets, "Expenses 2", [["header"], ["a"], ["b"]])
+    gsheet._partitions["Expenses 2"] = spreadsheet.by_title["Expenses 2"]
+    transactions = [make_transaction() for _ in range(2)]
+    assert _runs(gsheet, transactions) == [("Expenses 2", 1), ("Expenses 3", 1)]
+
+
+def test_full_partition_rolls_over_right_away(gsheet, make_transaction):
+    gsheet.insert_transactions([make_transaction(n) for n in range(3)], gsheet.app_config)
+    assert _runs(gsheet, [make_transaction()]) == [("Expenses 2", 1)]
+
+
+def test_insert_writes_each_run_to_its_partition(gsheet, sheets, make_transaction):
+    gsheet.insert_transactions([make_transaction(n) for n in range(1, 5)], gsheet.app_config)
+    gsheet.insert_transactions([make_transaction(n) for n in range(5, 8)], gsheet.app_config)
+    by_title = _spreadsheet(sheets).by_title
+    header = by_title["Expenses"].rows[0]
+    totals = {
+        title: [row[6] for row in by_title[title].rows[1:]]
+        for title in ("Expenses", "Expenses 2", "Expenses 3")
+    }
+    assert totals == {"Expenses": [3, 2, 1], "Expenses 2": [6, 5, 4], "Expenses 3": [7]}
+    assert by_title["Expenses 3"].rows[0] == header
+
+
+def test_year_partitions(gsheet, make_transaction):
+    gsheet.app_config.gsheet.partition = "year"
+    transactions = [make_transaction(date=datetime(year, 6, 1)) for year in (2024, 2024, 2025, 2024)]
+    assert _runs(gsheet, transactions) == [("Expenses 2024", 2), ("Expenses 2025", 1), ("Expenses 2024", 1)]
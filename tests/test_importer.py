@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import pytest
+
+from tgsplitexpenses.importer import _parse_amount, import_csv
+
+
+@pytest.mark.parametrize(
+    "text, amount",
+    [
+        ("12.50", 12.5),
+        ("12,50", 12.5),
+        ("-12.50", -12.5),
+        ("12.50-", -12.5),
+        ("(12.50)", -12.5),
+        ("+12.50", 12.5),
+        ("1.234,56", 1234.56),
+        ("1,234.56", 1234.56),
+        ("-1 234,56", -1234.56),
+        ("1,234", 1234),  # Money has 2 decimals: a thousand
+        ("1.234", 1234),
+        ("1,234,567", 1234567),
+        ("1.5", 1.5),
+        ("12", 12),
+    ],
+)
+def test_parse_amount(text, amount):
+    assert _parse_amount(text) == amount
+
+
+def _import(app_config, category_matcher, lines):
+    expenses = app_config.expenses
+    return import_csv(lines, category_matcher, expenses.users[0], expenses.split_types[0])
+
+
+def test_income_is_skipped_when_expenses_are_negative(app_config, category_matcher):
+    result = _import(
+        app_config,
+        category_matcher,
+        [
+            "Date;Description;Amount",
+            "2025-01-02;Monthly rent;-1.000,00",
+            "2025-01-03;Salary;2.500,00",
+            "2025-01-04;Pizzeria da Mario;-25,50",
+        ],
+    )
+    assert [(t.title, t.total, t.category.name) for t in result.transactions] == [
+        ("Monthly rent", 1000, "Home"),
+        ("Pizzeria da Mario", 25.5, "Restaurants and Cafes"),
+    ]
+    assert [line for line, _ in result.skipped] == [3]
+
+
+def test_all_rows_are_expenses_without_negative_amounts(app_config, category_matcher):
+    result = _import(
+        app_config,
+        category_matcher,
+        ["date,payee,amount", "02/01/2025,Supermarket,30.00", "03/01/2025,Internet,29.99"],
+    )
+    assert [(t.date, t.total) for t in result.transactions] == [
+        (datetime(2025, 1, 2), 30),
+        (datetime(2025, 1, 3), 29.99),
+    ]
+    assert result.skipped == []
+
+
+def test_unreadable_and_uncategorized_rows(app_config, category_matcher):
+    result = _import(
+        app_config,
+        category_matcher,
+        [
+            "Date,Description,Amount",
+            "2025-01-02,Bookshop,12.00",
+            "yesterday,Rent,1000",
+            "2025-01-04,,5.00",
+            "",
+            "2025-01-05,Rent,1000",
+        ],
+    )
+    assert result.review == [{"date": "2025-01-02T00:00:00", "total": 12, "title": "Bookshop"}]
+    assert [line for line, _ in result.skipped] == [3, 4]
+    assert [t.title for t in result.transactions] == ["Rent"]
+
+
+def test_missing_column(app_config, category_matcher):
+    with pytest.raises(ValueError):
+        _import(app_config, category_matcher, ["Date,Description", "2025-01-02,Rent"])
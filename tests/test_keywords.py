@@ -0,0 +1,58 @@
+import pytest
+
+from tgsplitexpenses.keywords import CategoryMatcher
+from tgsplitexpenses.models import ExpenseCategory
+
+
+@pytest.fixture
+def matcher() -> CategoryMatcher:
+    return CategoryMatcher(
+        [
+            ExpenseCategory(name="Home", emoji="🏠", keywords=["rent", "furniture"]),
+            ExpenseCategory(name="Travel", emoji="🚆", keywords=["train", "store bought tickets"]),
+            ExpenseCategory(name="Groceries", emoji="🛒", keywords=["store", "grocery store"]),
+            ExpenseCategory(name="Bills", emoji="💡", keywords=["gas"]),
+            ExpenseCategory(name="Car", emoji="🚙", keywords=["gas"]),
+        ]
+    )
+
+
+def _names(categories):
+    return [category.name for category in categories]
+
+
+@pytest.mark.parametrize(
+    "title, best",
+    [
+        ("Monthly RENT", "Home"),
+        ("grocery store", "Groceries"),  # The longest keyword wins
+        ("rent trian", "Home"),  # Exact beats fuzzy
+        ("store bought tickets", "Travel"),
+        ("gas", None),  # Exact tie
+        ("trian", None),  # Fuzzy only
+        ("sent flowers", None),  # Fuzzy only, and a different word
+        ("rent train", None),  # Exact tie
+        ("dinner", None),
+        ("", None),
+    ],
+)
+def test_best(matcher, title, best):
+    category = matcher.best(title)
+    assert (category.name if category else None) == best
+
+
+def test_fuzzy_matches_are_suggested(matcher):
+    assert _names(matcher.suggest("trian")) == ["Travel"]
+    assert _names(matcher.suggest("sent flowers")) == ["Home"]
+    assert _names(matcher.suggest("rent trian")) == ["Home", "Travel"]
+    assert matcher.rank("trian") == [(matcher.categories[1], 0.5)]
+
+
+def test_short_words_are_not_fuzzy(matcher):
+    assert matcher.suggest("gaz") == []
+
+
+def test_fuzzy_disabled():
+    matcher = CategoryMatcher([ExpenseCategory(name="Travel", emoji="🚆", keywords=["train"])], fuzzy=False)
+    assert matcher.suggest("trian") == []
+    assert _names(matcher.suggest("train")) == ["Travel"]
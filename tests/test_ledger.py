@@ -0,0 +1,69 @@
+from pathlib import Path
+import sqlite3
+
+import pytest
+
+from tgsplitexpenses.ledger import Ledger, connect, unsynced_count, unsynced_ledgers
+
+
+@pytest.fixture
+def db() -> sqlite3.Connection:
+    return connect(Path(":memory:"))
+
+
+def test_unsynced_in_insertion_order(db, make_transaction):
+    ledger = Ledger(db)
+    ids = ledger.add_many([make_transaction(n) for n in range(1, 4)])
+    assert [(id_, t.total) for id_, t in ledger.unsynced()] == list(zip(ids, [1, 2, 3]))
+    assert [t.total for _, t in ledger.unsynced(limit=2)] == [1, 2]
+
+
+def test_mark_synced(db, make_transaction):
+    ledger = Ledger(db)
+    ids = ledger.add_many([make_transaction(n) for n in range(1, 4)])
+    ledger.mark_synced(ids[:2])
+    assert [t.total for _, t in ledger.unsynced()] == [3]
+    assert ledger.count_unsynced() == 1
+    assert ledger.recent(3) == [
+        (make_transaction(3), False),
+        (make_transaction(2), True),
+        (make_transaction(1), True),
+    ]
+
+
+def test_idempotency_keys_are_added_once(db, make_transaction):
+    ledger = Ledger(db)
+    assert ledger.add_many([make_transaction(1), make_transaction(2)], ["rent:a", "rent:b"])[1] is not None
+    ids = ledger.add_many([make_transaction(2), make_transaction(3)], ["rent:b", "rent:c"])
+    assert ids[0] is None and ids[1] is not None
+    assert ledger.keys("rent:") == {"rent:a", "rent:b", "rent:c"}
+    assert ledger.keys("gym:") == set()
+    assert ledger.count_unsynced() == 3
+
+
+def test_ledgers_are_partitioned_by_key(db, make_transaction):
+    first, second = Ledger(db, "first"), Ledger(db, "second")
+    first.add(make_transaction(1))
+    second.add_many([make_transaction(2), make_transaction(3)], ["rent:a", "rent:b"])
+    # The same idempotency key in another ledger is another transaction
+    assert first.add_many([make_transaction(2)], ["rent:a"])[0] is not None
+    assert [t.total for _, t in first.unsynced()] == [1, 2]
+    assert [t.total for _, t in second.unsynced()] == [2, 3]
+    assert sorted(unsynced_ledgers(db)) == ["first", "second"]
+    assert unsynced_count(db) == 4
+
+
+def test_databases_before_multi_ledger_support_are_migrated(tmp_path, make_transaction):
+    database_file = tmp_path / "ledger.db"
+    with sqlite3.connect(database_file) as old:
+        old.execute(
+            "CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, data TEXT NOT NULL, synced_at TEXT)"
+        )
+        old.execute(
+            "INSERT INTO transactions (date, data) VALUES (?, ?)",
+            (make_transaction().date.isoformat(), make_transaction().model_dump_json()),
+        )
+    old.close()
+    ledger = Ledger(connect(database_file))
+    assert [t for _, t in ledger.unsynced()] == [make_transaction()]
+    assert ledger.add_many([make_transaction()], ["rent:a"])[0] is not None
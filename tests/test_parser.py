@@ -0,0 +1,51 @@
+import pytest
+
+from tgsplitexpenses.parser import TransactionParser
+
+
+@pytest.fixture
+def parser(app_config, category_matcher) -> TransactionParser:
+    return TransactionParser(app_config, category_matcher)
+
+
+@pytest.mark.parametrize(
+    "text, total, title, category, paid_by, split_type",
+    [
+        ("12.50 pizza paid by User1 50/50", 12.5, "pizza", "Restaurants and Cafes", "user1", "50 / 50"),
+        ("12,5 pizza User2 60/40", 12.5, "pizza", "Restaurants and Cafes", "user2", "Split 60/40"),
+        ("rent 800 🤖 split 60/40", 800, "rent", "Home", "user2", "Split 60/40"),
+        ("45 grocery store User1 50 / 50", 45, "grocery store", "Groceries", "user1", "50 / 50"),
+    ],
+)
+def test_fast_path(parser, text, total, title, category, paid_by, split_type):
+    transaction, missing = parser.parse(text)
+    assert missing == []
+    assert transaction.total == total
+    assert transaction.title == title
+    assert transaction.category.name == category
+    assert transaction.paid_by.id == paid_by
+    assert transaction.split_type.name == split_type
+
+
+def test_sender_paid_when_nobody_is_mentioned(parser):
+    transaction, missing = parser.parse("12 pizza 50/50", sender_name="User2")
+    assert missing == []
+    assert transaction.paid_by.id == "user2"
+
+
+@pytest.mark.parametrize(
+    "text, missing",
+    [
+        ("pizza User1 50/50", ["total"]),
+        ("12 pizza 3 drinks User1 50/50", ["total"]),
+        ("0 pizza User1 50/50", ["total"]),
+        ("12 pizza User1 User2 50/50", ["paid_by"]),
+        ("12 pizza User1 33/67", ["split_type"]),
+        ("12 User1 50/50", ["title", "category"]),
+        ("12 dinner with friends User1 50/50", ["category"]),
+        ("12 pizzza User1 50/50", ["category"]),  # Fuzzy match: left to the LLM
+        ("12 gas User1 50/50", ["category"]),  # Bills or Car
+    ],
+)
+def test_fallback(parser, text, missing):
+    assert parser.parse(text) == (None, missing)
@@ -0,0 +1,116 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+from tgsplitexpenses.quota import READ, WRITE, SheetsScheduler
+
+from fakes import FakeAPIError
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = SheetsScheduler(requests_per_minute=600, retry_delay=0.01)
+    yield scheduler
+    scheduler.close()
+
+
+def _wait_until(condition) -> None:
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_writes_get_the_quota_before_reads(scheduler):
+    order = []
+    scheduler._drain()
+    scheduler._tokens = -2  # A few tenths of a second before the next token
+    with ThreadPoolExecutor(2) as executor:
+        read = executor.submit(scheduler.call, READ, "get", order.append, "read")
+        _wait_until(lambda: scheduler.waiting == 1)
+        write = executor.submit(scheduler.call, WRITE, "insert_rows", order.append, "write")
+        _wait_until(lambda: scheduler.waiting == 2)
+        read.result(), write.result()
+    assert order == ["write", "read"]
+
+
+def test_writes_get_a_thread_before_reads():
+    scheduler = SheetsScheduler(requests_per_minute=600, max_workers=1)
+    order = []
+    busy = threading.Event()
+
+    async def main():
+        blocking = asyncio.create_task(scheduler.run(READ, busy.wait))
+        await asyncio.sleep(0.01)
+        read = asyncio.create_task(scheduler.run(READ, order.append, "read"))
+        write = asyncio.create_task(scheduler.run(WRITE, order.append, "write"))
+        await asyncio.sleep(0.01)
+        assert scheduler.waiting == 2
+        busy.set()
+        await asyncio.gather(blocking, read, write)
+
+    try:
+        asyncio.run(main())
+    finally:
+        scheduler.close()
+    assert order == ["write", "read"]
+
+
+def test_identical_reads_in_flight_are_made_once(scheduler):
+    calls = []
+    release = threading.Event()
+
+    def get_all_values():
+        calls.append(1)
+        release.wait()
+        return [["header"]]
+
+    with ThreadPoolExecutor(4) as executor:
+        results = [
+            executor.submit(scheduler.read, ("get_all_values", "sheet"), "get_all_values", get_all_values)
+            for _ in range(3)
+        ]
+        _wait_until(lambda: calls)
+        time.sleep(0.05)  # The other two join the read in flight
+        other = executor.submit(scheduler.read, ("row_values", "sheet"), "row_values", lambda: ["header"])
+        assert other.result() == ["header"]
+        release.set()
+        assert [result.result() for result in results] == [[["header"]]] * 3
+    assert len(calls) == 1
+    # Once done, the same read is made again
+    scheduler.read(("get_all_values", "sheet"), "get_all_values", get_all_values)
+    assert len(calls) == 2
+
+
+def test_coalesced_reads_get_the_error(scheduler):
+    release = threading.Event()
+
+    def fail():
+        release.wait()
+        raise ConnectionError("down")
+
+    with ThreadPoolExecutor(2) as executor:
+        results = [executor.submit(scheduler.read, "key", "get", fail) for _ in range(2)]
+        time.sleep(0.05)
+        release.set()
+        for result in results:
+            with pytest.raises(ConnectionError):
+                result.result()
+
+
+def test_quota_errors_are_retried(scheduler):
+    responses = [FakeAPIError(429, "Quota exceeded"), "ok"]
+
+    def call():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert scheduler.write("insert_rows", call) == "ok"
+    responses = [FakeAPIError(400, "Bad request"), "ok"]
+    with pytest.raises(FakeAPIError):
+        scheduler.write("insert_rows", call)
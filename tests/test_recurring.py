@@ -0,0 +1,98 @@
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from tgsplitexpenses.ledger import Ledger, connect
+from tgsplitexpenses.models import RecurringExpense
+from tgsplitexpenses.recurring import due_transactions
+
+
+def _expense(start: date, every: str = "month", end=None) -> RecurringExpense:
+    return RecurringExpense(
+        id="rent",
+        title="Rent",
+        total=1000,
+        category="Home",
+        paid_by="user1",
+        split_type="50 / 50",
+        every=every,
+        start=start,
+        end=end,
+    )
+
+
+def test_month_end_is_clamped_and_restored():
+    expense = _expense(date(2025, 1, 31))
+    assert list(expense.occurrences(date(2025, 5, 31))) == [
+        date(2025, 1, 31),
+        date(2025, 2, 28),
+        date(2025, 3, 31),
+        date(2025, 4, 30),
+        date(2025, 5, 31),
+    ]
+
+
+def test_leap_year():
+    assert _expense(date(2024, 1, 30))._occurrence(1) == date(2024, 2, 29)
+    expense = _expense(date(2024, 2, 29), every="year")
+    assert list(expense.occurrences(date(2028, 3, 1))) == [
+        date(2024, 2, 29),
+        date(2025, 2, 28),
+        date(2026, 2, 28),
+        date(2027, 2, 28),
+        date(2028, 2, 29),
+    ]
+
+
+def test_year_rollover():
+    expense = _expense(date(2025, 11, 30))
+    assert [expense._occurrence(n) for n in range(4)] == [
+        date(2025, 11, 30),
+        date(2025, 12, 30),
+        date(2026, 1, 30),
+        date(2026, 2, 28),
+    ]
+
+
+@pytest.mark.parametrize(
+    "every, second",
+    [("day", date(2025, 1, 1)), ("week", date(2025, 1, 7)), ("month", date(2025, 1, 31))],
+)
+def test_every(every, second):
+    assert _expense(date(2024, 12, 31), every=every)._occurrence(1) == second
+
+
+def test_until_and_end():
+    expense = _expense(date(2025, 1, 15), end=date(2025, 3, 14))
+    assert list(expense.occurrences(date(2025, 1, 14))) == []
+    assert list(expense.occurrences(date(2025, 12, 31))) == [date(2025, 1, 15), date(2025, 2, 15)]
+
+
+@pytest.fixture
+def ledger() -> Ledger:
+    return Ledger(connect(Path(":memory:")))
+
+
+def _due(app_config, ledger, today):
+    transactions, keys = due_transactions(app_config, ledger, today)
+    ledger.add_many(transactions, keys)
+    return [transaction.date.date() for transaction in transactions]
+
+
+def test_due_transactions_catch_up_once(app_config, ledger):
+    app_config.expenses.recurring = [_expense(date(2025, 1, 31))]
+    assert _due(app_config, ledger, date(2025, 3, 30)) == [date(2025, 1, 31), date(2025, 2, 28)]
+    assert _due(app_config, ledger, date(2025, 3, 30)) == []
+    assert _due(app_config, ledger, date(2025, 4, 1)) == [date(2025, 3, 31)]
+
+
+def test_schedule_change_does_not_add_the_past_again(app_config, ledger):
+    app_config.expenses.recurring = [_expense(date(2025, 1, 1))]
+    assert len(_due(app_config, ledger, date(2025, 3, 10))) == 3
+    app_config.expenses.recurring = [_expense(date(2025, 1, 5), every="week")]
+    assert _due(app_config, ledger, date(2025, 3, 20)) == [
+        date(2025, 3, 2),
+        date(2025, 3, 9),
+        date(2025, 3, 16),
+    ]
@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+from tgsplitexpenses.settle import net_balances, settle
+
+
+def _apply(net, transfers):
+    after = {user_id: round(amount * 100) for user_id, amount in net.items()}
+    for transfer in transfers:
+        after[transfer.from_user] += round(transfer.amount * 100)
+        after[transfer.to_user] -= round(transfer.amount * 100)
+    return after
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_settle_zeroes_balances_with_at_most_users_minus_one_transfers(seed):
+    rng = random.Random(seed)
+    users = [f"user{n}" for n in range(rng.randint(2, 30))]
+    net = {user_id: rng.randint(-50_000, 50_000) / 100 for user_id in users[:-1]}
+    net[users[-1]] = -round(sum(net.values()), 2)
+
+    transfers = settle(net)
+
+    assert all(value == 0 for value in _apply(net, transfers).values())
+    assert len(transfers) <= len(users) - 1
+    assert all(transfer.amount > 0 for transfer in transfers)
+    assert all(net[transfer.from_user] < 0 < net[transfer.to_user] for transfer in transfers)
+
+
+def test_settle_pairs_equal_debts_and_credits():
+    net = {"a": -10.0, "b": -25.0, "c": 25.0, "d": 10.0}
+    assert sorted(settle(net)) == [("a", "d", 10.0), ("b", "c", 25.0)]
+
+
+def test_settle_nothing_to_do():
+    assert settle({"a": 0.0, "b": 0.001}) == []
+
+
+def test_net_balances(make_transaction):
+    net = net_balances(
+        [
+            make_transaction(100, paid_by=0, split_type=0),  # 50 / 50
+            make_transaction(50, paid_by=1, split_type=1),  # User2 60, User1 40
+        ]
+    )
+    assert net == pytest.approx({"user1": 30.0, "user2": -30.0})
+    assert settle(net) == [("user2", "user1", 30.0)]
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import pytest
+
+from tgsplitexpenses.stats import Stats
+
+
+@pytest.fixture
+def stats(make_transaction) -> Stats:
+    stats = Stats()
+    stats.seed(
+        [
+            make_transaction(10, datetime(2024, 12, 31)),
+            make_transaction(20, datetime(2025, 1, 1), paid_by=1),
+            make_transaction(30, datetime(2025, 1, 15), split_type=1),
+            make_transaction(40, datetime(2025, 2, 1)),
+        ]
+    )
+    return stats
+
+
+def test_group_by(stats):
+    assert stats.query("month") == {"2024-12": (10, 1), "2025-01": (50, 2), "2025-02": (40, 1)}
+    assert stats.query("paid_by") == {"user1": (80, 3), "user2": (20, 1)}
+    assert stats.query("category") == {"Home": (100, 4)}
+
+
+@pytest.mark.parametrize(
+    "since, until, months",
+    [
+        ("2025-01", None, {"2025-01", "2025-02"}),
+        (None, "2025-01", {"2024-12", "2025-01"}),
+        ("2025-01", "2025-01", {"2025-01"}),
+        ("2025-03", None, set()),
+    ],
+)
+def test_windows_include_both_ends(stats, since, until, months):
+    assert set(stats.query("month", since, until)) == months
+
+
+def test_window_applies_to_other_groupings(stats):
+    assert stats.query("paid_by", since="2025-01", until="2025-01") == {"user1": (30, 1), "user2": (20, 1)}
+
+
+def test_apply_only_once_seeded(make_transaction):
+    stats = Stats()
+    stats.apply(make_transaction(5))
+    assert stats.query("month") == {}
+    stats.seed([make_transaction(5)])
+    stats.apply(make_transaction(0.1))
+    stats.apply(make_transaction(0.2))
+    assert stats.query("month") == {"2025-01": (5.3, 3)}
+
+
+def test_unknown_grouping(stats):
+    with pytest.raises(ValueError):
+        stats.query("title")
@@ -0,0 +1,171 @@
+import asyncio
+from pathlib import Path
+import typing
+
+import pytest
+
+from tgsplitexpenses.gsheet import PartialWriteError
+from tgsplitexpenses.ledger import Ledger, connect
+from tgsplitexpenses.models import Transaction
+from tgsplitexpenses.writer import LedgerClosedError, TransactionWriter
+
+
+class StubSheet:
+    """Runs the calls right away on the event loop, inserts fail with the queued `failures` first"""
+
+    def __init__(self, rows: typing.Optional[typing.List[Transaction]] = None) -> None:
+        self.rows = list(rows or [])
+        self.writes: typing.List[int] = []  # Transactions per insert call
+        self.failures: typing.List[Exception] = []
+
+    async def run(self, priority: int, function: typing.Callable, *args) -> typing.Any:
+        return function(*args)
+
+    def get_transactions(self, app_config) -> typing.List[Transaction]:
+        return list(self.rows)
+
+    def insert_transactions(self, transactions: typing.List[Transaction], app_config) -> None:
+        self.writes.append(len(transactions))
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, PartialWriteError):
+                self.rows.extend(transactions[: failure.written])
+            raise failure
+        self.rows.extend(transactions)
+
+
+class RecordingView:
+    def __init__(self) -> None:
+        self.seeded: typing.List[Transaction] = []
+        self.applied: typing.List[Transaction] = []
+
+    def seed(self, transactions: typing.Iterable[Transaction]) -> None:
+        self.seeded = list(transactions)
+
+    def apply(self, transaction: Transaction) -> None:
+        self.applied.append(transaction)
+
+
+@pytest.fixture
+def ledger() -> Ledger:
+    return Ledger(connect(Path(":memory:")))
+
+
+def _writer(app_config, ledger, sheet, **kwargs) -> TransactionWriter:
+    kwargs = {"linger": 0.01, "retry_delay": 0.01, "max_retries": 3, **kwargs}
+    return TransactionWriter(sheet, ledger, app_config, **kwargs)
+
+
+def test_puts_are_written_in_one_batch(app_config, ledger, make_transaction):
+    async def main():
+        sheet = StubSheet()
+        writer = _writer(app_config, ledger, sheet)
+        writer.start()
+        futures = [writer.put(make_transaction(n)) for n in range(1, 6)]
+        await asyncio.wait_for(asyncio.gather(*futures), timeout=5)
+        await writer.stop()
+        return sheet
+
+    sheet = asyncio.run(main())
+    assert sheet.writes == [5]
+    assert [t.total for t in sheet.rows] == [1, 2, 3, 4, 5]
+    assert ledger.count_unsynced() == 0
+
+
+def test_batches_are_at_most_max_batch_size(app_config, ledger, make_transaction):
+    async def main():
+        sheet = StubSheet()
+        writer = _writer(app_config, ledger, sheet, max_batch_size=2)
+        writer.start()
+        await asyncio.wait_for(asyncio.gather(*writer.put_many([make_transaction()] * 5)), timeout=5)
+        await writer.stop()
+        return sheet
+
+    assert asyncio.run(main()).writes == [2, 2, 1]
+
+
+def test_failed_write_is_retried(app_config, ledger, make_transaction):
+    async def main():
+        sheet = StubSheet()
+        sheet.failures = [ConnectionError("down")]
+        writer = _writer(app_config, ledger, sheet)
+        writer.start()
+        await asyncio.wait_for(writer.put(make_transaction()), timeout=5)
+        await writer.stop()
+        return sheet
+
+    sheet = asyncio.run(main())
+    assert sheet.writes == [1, 1]
+    assert len(sheet.rows) == 1
+    assert ledger.count_unsynced() == 0
+
+
+def test_rows_stay_unsynced_until_the_next_sync_when_retries_run_out(app_config, ledger, make_transaction):
+    async def main():
+        sheet = StubSheet()
+        sheet.failures = [ConnectionError("down")] * 3
+        writer = _writer(app_config, ledger, sheet)
+        writer.start()
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(writer.put(make_transaction()), timeout=5)
+        assert ledger.count_unsynced() == 1
+        await writer.stop()  # Syncs once more before stopping
+        return sheet
+
+    sheet = asyncio.run(main())
+    assert sheet.writes == [1, 1, 1, 1]
+    assert ledger.count_unsynced() == 0
+
+
+def test_partial_write_is_not_written_again(app_config, ledger, make_transaction):
+    async def main():
+        sheet = StubSheet()
+        sheet.failures = [PartialWriteError(2, ConnectionError("down"))]
+        writer = _writer(app_config, ledger, sheet)
+        writer.start()
+        futures = writer.put_many([make_transaction(n) for n in range(1, 5)])
+        await asyncio.wait_for(asyncio.gather(*futures), timeout=5)
+        await writer.stop()
+        return sheet
+
+    sheet = asyncio.run(main())
+    assert sheet.writes == [4, 2]
+    assert [t.total for t in sheet.rows] == [1, 2, 3, 4]
+    assert ledger.count_unsynced() == 0
+
+
+def test_views_are_seeded_with_the_sheet_and_the_unsynced_rows(app_config, ledger, make_transaction):
+    ledger.add(make_transaction(2))  # Left unsynced by a previous run
+
+    async def main():
+        sheet = StubSheet([make_transaction(1)])
+        view = RecordingView()
+        writer = _writer(app_config, ledger, sheet)
+        writer.views.append(view)
+        writer.start()
+        while not writer.seeded:
+            await asyncio.sleep(0.01)
+        await writer.stop()
+        return sheet, view
+
+    sheet, view = asyncio.run(main())
+    assert [t.total for t in view.seeded] == [1, 2]
+    assert [t.total for t in sheet.rows] == [1, 2]
+
+
+def test_stop_does_not_wait_for_the_backoff(app_config, ledger, make_transaction):
+    async def main():
+        sheet = StubSheet()
+        sheet.failures = [ConnectionError("down")]
+        writer = _writer(app_config, ledger, sheet, retry_delay=60)
+        writer.start()
+        synced = writer.put(make_transaction())
+        while not sheet.writes:
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(writer.stop(), timeout=5)
+        with pytest.raises(LedgerClosedError):
+            await synced
+        return sheet
+
+    assert asyncio.run(main()).writes == [1]
+    assert ledger.count_unsynced() == 1